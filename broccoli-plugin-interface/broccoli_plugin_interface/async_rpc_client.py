@@ -0,0 +1,65 @@
+from typing import Dict, Optional, List, Tuple
+from abc import ABCMeta, abstractmethod
+
+
+class AsyncRpcClient(metaclass=ABCMeta):
+    """
+    Coroutine counterpart of RpcClient, concurrent calls are in flight at the same time
+    so a worker can fan out with asyncio.gather
+    """
+
+    @abstractmethod
+    async def query(self, q: Dict, limit: Optional[int] = None, projection: List[str] = None,
+                    sort: Dict[str, int] = None, datetime_q: List[Dict] = None) -> List[Dict]:
+        pass
+
+    @abstractmethod
+    async def query_page(self, q: Dict, page_size: int, resume_token: Optional[str] = None,
+                         projection: List[str] = None, sort: Dict[str, int] = None,
+                         datetime_q: List[Dict] = None) -> Tuple[List[Dict], Optional[str]]:
+        pass
+
+    @abstractmethod
+    async def update_one(self, filter_q: Dict, update_doc: Dict):
+        pass
+
+    @abstractmethod
+    async def update_one_binary_string(self, filter_q: Dict, key: str, binary_string: List[bool]):
+        pass
+
+    @abstractmethod
+    async def bulk_update_one(self, ops: List[Tuple[Dict, Dict]]) -> Dict[str, int]:
+        pass
+
+    @abstractmethod
+    async def bulk_update_one_binary_string(self, ops: List[Tuple[Dict, str, List[bool]]]) -> Dict[str, int]:
+        pass
+
+    @abstractmethod
+    async def append(self, idempotency_key: str, doc: Dict):
+        pass
+
+    @abstractmethod
+    async def append_many(self, idempotency_key: str, docs: List[Dict]) -> List[str]:
+        pass
+
+    @abstractmethod
+    async def random_one(self, q: Dict, projection: List[str]) -> Optional[Dict]:
+        pass
+
+    @abstractmethod
+    async def random_many(self, q: Dict, n: int, projection: List[str] = None) -> List[Dict]:
+        pass
+
+    @abstractmethod
+    async def count(self, q: Dict) -> int:
+        pass
+
+    @abstractmethod
+    async def aggregate(self, pipeline: List[Dict], datetime_q: List[Dict] = None) -> List[Dict]:
+        pass
+
+    @abstractmethod
+    async def query_n_nearest_hamming_neighbors(self, q: Dict, binary_string_key: str, from_binary_string: str,
+                                                pick_n: int, projection: List[str] = None) -> List[Dict]:
+        pass
@@ -0,0 +1,338 @@
+import base64
+import gzip
+import http.client
+import json
+import queue
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Executor
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+from broccoli_plugin_interface.rpc_client import RpcClient
+from .thread_pool_async_rpc_client import ThreadPoolAsyncRpcClient
+
+
+class RpcError(Exception):
+    pass
+
+
+def _to_binary_string(binary_string: List[bool]) -> str:
+    return ''.join(list(map(lambda b: '1' if b else '0', binary_string)))
+
+
+def _jwt_expires_at(access_token: str) -> Optional[float]:
+    try:
+        claims_segment = access_token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(claims_segment + "=" * (-len(claims_segment) % 4)))
+        return float(claims["exp"]) if "exp" in claims else None
+    except (IndexError, KeyError, ValueError):
+        return None
+
+
+class _ConnectionPool(object):
+    """
+    Keep-alive connections to one host, at most max_idle of them are kept between requests
+    """
+
+    def __init__(self, scheme: str, netloc: str, timeout_seconds: float, max_idle: int):
+        self.connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        self.netloc = netloc
+        self.timeout_seconds = timeout_seconds
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+
+    def acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """
+        Returns a connection and whether it was reused
+        """
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self.connection_class(self.netloc, timeout=self.timeout_seconds), False
+
+    def release(self, connection: http.client.HTTPConnection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+class HttpRpcClient(RpcClient):
+    """
+    RpcClient of a remote Broccoli server, for workers running outside of it.
+    Connections are pooled and kept alive, and the access token is reused until shortly before it expires.
+    Pass either an access token, or the admin username and password to log in with
+    """
+
+    # Refresh the access token this long before it expires
+    TOKEN_REFRESH_MARGIN_SECONDS = 60
+    # Verbs that only read, sent again when a reused connection breaks after sending them
+    IDEMPOTENT_VERBS = {"query", "schema", "count", "random_one", "random_many", "aggregate",
+                        "query_nearest_hamming_neighbors", "query_n_nearest_hamming_neighbors"}
+
+    def __init__(self, base_url: str, access_token: Optional[str] = None, username: Optional[str] = None,
+                 password: Optional[str] = None, timeout_seconds: float = 60, max_idle_connections: int = 16,
+                 max_batch_size: int = 500):
+        if not access_token and not (username and password):
+            raise ValueError("Either access_token or username and password are required")
+        parsed_url = urllib.parse.urlparse(base_url)
+        self.path_prefix = parsed_url.path.rstrip("/")
+        self.username = username
+        self.password = password
+        self.max_batch_size = max_batch_size
+        self._pool = _ConnectionPool(parsed_url.scheme, parsed_url.netloc, timeout_seconds, max_idle_connections)
+        self._access_token = access_token
+        self._access_token_expires_at = _jwt_expires_at(access_token) if access_token else None
+        self._token_lock = threading.Lock()
+
+    def call(self, verb: str, payload: Dict):
+        status, parsed_response = self._post_authorized("/apiInternal/rpc", {
+            "verb": verb,
+            "metadata": {},
+            "payload": payload
+        }, verb in self.IDEMPOTENT_VERBS)
+        return HttpRpcClient._result_or_raise(verb, status, parsed_response)
+
+    def batch(self, calls: List[Tuple[str, Dict]]) -> List[Any]:
+        """
+        Runs (verb, payload) calls in as few round trips as max_batch_size allows, returning results in order.
+        A failed call gives an RpcError in its place instead of raising
+        """
+        results = []
+        for start in range(0, len(calls), self.max_batch_size):
+            envelopes = list(map(
+                lambda call: {"verb": call[0], "metadata": {}, "payload": call[1]},
+                calls[start:start + self.max_batch_size]
+            ))
+            status, parsed_response = self._post_authorized(
+                "/apiInternal/rpc/batch",
+                envelopes,
+                all(map(lambda envelope: envelope["verb"] in self.IDEMPOTENT_VERBS, envelopes))
+            )
+            for envelope, response in zip(envelopes, HttpRpcClient._result_or_raise("batch", status, parsed_response)):
+                try:
+                    results.append(HttpRpcClient._result_or_raise(envelope["verb"], status, response))
+                except RpcError as e:
+                    results.append(e)
+        return results
+
+    @staticmethod
+    def _result_or_raise(verb: str, status: int, parsed_response):
+        if type(parsed_response) != dict or parsed_response.get("status") != "ok":
+            message = f"Verb {verb} failed with HTTP status {status}"
+            if type(parsed_response) == dict:
+                message = (parsed_response.get("payload") or {}).get("message") or \
+                    parsed_response.get("msg") or message
+            raise RpcError(message)
+        return parsed_response["payload"]
+
+    def _post_authorized(self, path: str, body, idempotent: bool) -> Tuple[int, Any]:
+        access_token = self._valid_access_token()
+        status, parsed_response = self._post(path, body, access_token, idempotent)
+        if status == 401 and self.username:
+            # Expired or revoked early, log in again once
+            status, parsed_response = self._post(path, body, self._valid_access_token(rejected=access_token),
+                                                 idempotent)
+        return status, parsed_response
+
+    def _valid_access_token(self, rejected: Optional[str] = None) -> str:
+        with self._token_lock:
+            expiring = self._access_token_expires_at is not None and \
+                self._access_token_expires_at - self.TOKEN_REFRESH_MARGIN_SECONDS < time.time()
+            if self.username and (not self._access_token or expiring or self._access_token == rejected):
+                status, parsed_response = self._post(
+                    "/auth",
+                    {"username": self.username, "password": self.password},
+                    idempotent=True
+                )
+                if status != 200:
+                    raise RpcError(f"Fails to log in, HTTP status {status}")
+                self._access_token = parsed_response["access_token"]
+                self._access_token_expires_at = _jwt_expires_at(self._access_token)
+            return self._access_token
+
+    def _post(self, path: str, body, access_token: Optional[str] = None,
+              idempotent: bool = False) -> Tuple[int, Any]:
+        # gzip only, so that the client keeps to the standard library
+        headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+        if access_token:
+            headers["Authorization"] = f"Bearer {access_token}"
+        connection, response = self._send(path, json.dumps(body).encode("utf-8"), headers, idempotent)
+        response_body = self._read_and_release(connection, response)
+        if response.getheader("Content-Encoding") == "gzip":
+            response_body = gzip.decompress(response_body)
+        try:
+            return response.status, json.loads(response_body)
+        except ValueError:
+            return response.status, None
+
+    def _send(self, path: str, encoded_body: bytes, headers: Dict[str, str],
+              idempotent: bool) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """
+        Posts on a pooled connection and returns it with the response, whose body is left to read.
+        A connection the server closed while idle fails when sending, the request is then sent again on another.
+        Once sent, the server may have run the request before the connection broke, so only idempotent requests
+        are sent again. Timeouts are never retried
+        """
+        while True:
+            connection, reused = self._pool.acquire()
+            sent = False
+            try:
+                connection.request("POST", self.path_prefix + path, body=encoded_body, headers=headers)
+                sent = True
+                return connection, connection.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                if reused and (not sent or idempotent):
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+
+    def blocking_query(self, q: Dict, limit: Optional[int] = None, projection: List[str] = None,
+                       sort: Dict[str, int] = None, datetime_q: List[Dict] = None) -> List[Dict]:
+        payload = {"q": q}
+        for key, value in [("limit", limit), ("projection", projection), ("sort", sort), ("datetime_q", datetime_q)]:
+            if value is not None:
+                payload[key] = value
+        return self.call("query", payload)
+
+    def blocking_iter_query(self, q: Dict, limit: Optional[int] = None, projection: List[str] = None,
+                            sort: Dict[str, int] = None, datetime_q: List[Dict] = None) -> Iterator[Mapping]:
+        """
+        Streams the documents of a query as BSON, for results too large to hold at once. Each document is decoded
+        when first read, into the same values blocking_query returns. Needs the bson package of pymongo
+        """
+        payload = {"q": q}
+        for key, value in [("limit", limit), ("projection", projection), ("sort", sort), ("datetime_q", datetime_q)]:
+            if value is not None:
+                payload[key] = value
+        body = {"verb": "query", "metadata": {}, "payload": payload}
+        access_token = self._valid_access_token()
+        connection, response = self._open_bson_stream(body, access_token)
+        if response.status == 401 and self.username:
+            self._read_and_release(connection, response)
+            connection, response = self._open_bson_stream(body, self._valid_access_token(rejected=access_token))
+        if response.status != 200 or response.getheader("Content-Type", "").split(";")[0] != "application/bson":
+            response_body = self._read_and_release(connection, response)
+            try:
+                parsed_response = json.loads(response_body)
+            except ValueError:
+                parsed_response = None
+            HttpRpcClient._result_or_raise("query", response.status, parsed_response)
+        return self._iter_bson_stream(connection, response)
+
+    def _open_bson_stream(self, body, access_token: str) -> Tuple[http.client.HTTPConnection,
+                                                                 http.client.HTTPResponse]:
+        headers = {"Content-Type": "application/json", "Accept": "application/bson",
+                   "Authorization": f"Bearer {access_token}"}
+        return self._send("/apiInternal/rpc", json.dumps(body).encode("utf-8"), headers, True)
+
+    def _iter_bson_stream(self, connection: http.client.HTTPConnection,
+                          response: http.client.HTTPResponse) -> Iterator[Mapping]:
+        # Imported here so that bson is only needed by who streams
+        from .lazy_bson_document import read_bson_documents
+        completed = False
+        try:
+            yield from read_bson_documents(response.read)
+            completed = True
+        finally:
+            if completed:
+                self._release(connection, response)
+            else:
+                # A stream left half read cannot carry another request
+                connection.close()
+
+    def _read_and_release(self, connection: http.client.HTTPConnection, response: http.client.HTTPResponse) -> bytes:
+        try:
+            response_body = response.read()
+        except BaseException:
+            connection.close()
+            raise
+        self._release(connection, response)
+        return response_body
+
+    def _release(self, connection: http.client.HTTPConnection, response: http.client.HTTPResponse):
+        if response.will_close:
+            connection.close()
+        else:
+            self._pool.release(connection)
+
+    def blocking_query_page(self, q: Dict, page_size: int, resume_token: Optional[str] = None,
+                            projection: List[str] = None, sort: Dict[str, int] = None,
+                            datetime_q: List[Dict] = None) -> Tuple[List[Dict], Optional[str]]:
+        payload = {"q": q, "page_size": page_size}
+        for key, value in [("resume_token", resume_token), ("projection", projection), ("sort", sort),
+                           ("datetime_q", datetime_q)]:
+            if value is not None:
+                payload[key] = value
+        result = self.call("query", payload)
+        return result["documents"], result["resume_token"]
+
+    def blocking_update_one(self, filter_q: Dict, update_doc: Dict):
+        self.call("update_one", {"filter_q": filter_q, "update_doc": update_doc})
+
+    def blocking_update_one_binary_string(self, filter_q: Dict, key: str, binary_string: List[bool]):
+        self.call("update_one_binary_string", {
+            "filter_q": filter_q,
+            "key": key,
+            "binary_string": _to_binary_string(binary_string)
+        })
+
+    def blocking_bulk_update_one(self, ops: List[Tuple[Dict, Dict]]) -> Dict[str, int]:
+        return self.call("bulk_update_one", {
+            "ops": list(map(lambda op: {"filter_q": op[0], "update_doc": op[1]}, ops))
+        })
+
+    def blocking_bulk_update_one_binary_string(self, ops: List[Tuple[Dict, str, List[bool]]]) -> Dict[str, int]:
+        return self.call("bulk_update_one_binary_string", {
+            "ops": list(map(
+                lambda op: {"filter_q": op[0], "key": op[1], "binary_string": _to_binary_string(op[2])},
+                ops
+            ))
+        })
+
+    def blocking_append(self, idempotency_key: str, doc: Dict):
+        self.call("append", {"idempotency_key": idempotency_key, "doc": doc})
+
+    def blocking_append_many(self, idempotency_key: str, docs: List[Dict]) -> List[str]:
+        return self.call("append_many", {"idempotency_key": idempotency_key, "docs": docs})
+
+    def blocking_random_one(self, q: Dict, projection: List[str]) -> Optional[Dict]:
+        return self.call("random_one", {"q": q, "projection": projection})
+
+    def blocking_random_many(self, q: Dict, n: int, projection: List[str] = None) -> List[Dict]:
+        payload = {"q": q, "n": n}
+        if projection is not None:
+            payload["projection"] = projection
+        return self.call("random_many", payload)
+
+    def blocking_count(self, q: Dict) -> int:
+        return self.call("count", {"q": q})
+
+    def blocking_aggregate(self, pipeline: List[Dict], datetime_q: List[Dict] = None) -> List[Dict]:
+        payload = {"pipeline": pipeline}
+        if datetime_q is not None:
+            payload["datetime_q"] = datetime_q
+        return self.call("aggregate", payload)
+
+    def blocking_query_n_nearest_hamming_neighbors(self, q: Dict, binary_string_key: str, from_binary_string: str,
+                                                   pick_n: int, projection: List[str] = None) -> List[Dict]:
+        payload = {
+            "q": q,
+            "binary_string_key": binary_string_key,
+            "from_binary_string": from_binary_string,
+            "pick_n": pick_n
+        }
+        if projection is not None:
+            payload["projection"] = projection
+        return self.call("query_n_nearest_hamming_neighbors", payload)
+
+
+class AsyncHttpRpcClient(ThreadPoolAsyncRpcClient):
+    """
+    AsyncRpcClient of a remote Broccoli server, concurrent calls go out on separate pooled connections
+    """
+
+    def __init__(self, http_rpc_client: HttpRpcClient, executor: Optional[Executor] = None):
+        super().__init__(http_rpc_client, executor)
@@ -0,0 +1,83 @@
+import datetime
+from collections.abc import Mapping
+from typing import Dict, Iterator
+import bson
+from bson import Binary, ObjectId
+
+# Packed binary strings, as the server stores them: a BSON binary vector of bits
+_PACKED_BIT_SUBTYPE = 9
+_PACKED_BIT_DTYPE = 0x10
+_EPOCH = datetime.datetime(1970, 1, 1)
+_ONE_MILLISECOND = datetime.timedelta(milliseconds=1)
+
+
+def _to_json_value(value):
+    if isinstance(value, dict):
+        return {k: _to_json_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return list(map(_to_json_value, value))
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return (value.replace(tzinfo=None) - _EPOCH) // _ONE_MILLISECOND
+    if isinstance(value, Binary) and value.subtype == _PACKED_BIT_SUBTYPE and len(value) >= 2 \
+            and value[0] == _PACKED_BIT_DTYPE:
+        bit_length = (len(value) - 2) * 8 - value[1]
+        if not bit_length:
+            return ""
+        return format(int.from_bytes(value[2:], "big") >> value[1], f"0{bit_length}b")
+    return value
+
+
+class LazyBsonDocument(Mapping):
+    """
+    A document received as BSON bytes, decoded on first access into the values the JSON API returns:
+    _id as a string, datetimes as milliseconds and packed binary strings as '0'/'1' strings
+    """
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self._document = None
+
+    def _decoded(self) -> Dict:
+        if self._document is None:
+            self._document = _to_json_value(bson.decode(self.raw))
+        return self._document
+
+    def __getitem__(self, key):
+        return self._decoded()[key]
+
+    def __iter__(self):
+        return iter(self._decoded())
+
+    def __len__(self):
+        return len(self._decoded())
+
+    def __repr__(self):
+        return f"LazyBsonDocument({self._decoded()!r})"
+
+
+def read_bson_documents(read) -> Iterator[LazyBsonDocument]:
+    """
+    Splits a stream of BSON documents written back to back, read(n) returns up to n bytes as a file does
+    """
+    while True:
+        length_bytes = _read_exactly(read, 4)
+        if not length_bytes:
+            return
+        length = int.from_bytes(length_bytes, "little")
+        yield LazyBsonDocument(length_bytes + _read_exactly(read, length - 4))
+
+
+def _read_exactly(read, n: int) -> bytes:
+    chunks = []
+    remaining = n
+    while remaining:
+        chunk = read(remaining)
+        if not chunk:
+            if chunks:
+                raise EOFError(f"Stream ends inside a BSON document, {remaining} of {n} bytes missing")
+            return b""
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
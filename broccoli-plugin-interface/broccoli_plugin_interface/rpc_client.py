@@ -1,4 +1,4 @@
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
 from abc import ABCMeta, abstractmethod
 
 
@@ -8,6 +8,15 @@ class RpcClient(metaclass=ABCMeta):
                        sort: Dict[str, int] = None, datetime_q: List[Dict] = None) -> List[Dict]:
         pass
 
+    @abstractmethod
+    def blocking_query_page(self, q: Dict, page_size: int, resume_token: Optional[str] = None,
+                            projection: List[str] = None, sort: Dict[str, int] = None,
+                            datetime_q: List[Dict] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Returns one page of documents and the resume token of the next page, None after the last page
+        """
+        pass
+
     @abstractmethod
     def blocking_update_one(self, filter_q: Dict, update_doc: Dict):
         pass
@@ -16,19 +25,57 @@ class RpcClient(metaclass=ABCMeta):
     def blocking_update_one_binary_string(self, filter_q: Dict, key: str, binary_string: List[bool]):
         pass
 
+    @abstractmethod
+    def blocking_bulk_update_one(self, ops: List[Tuple[Dict, Dict]]) -> Dict[str, int]:
+        """
+        Applies (filter_q, update_doc) operations like blocking_update_one in a single call,
+        returning the matched, modified and rejected counts
+        """
+        pass
+
+    @abstractmethod
+    def blocking_bulk_update_one_binary_string(self, ops: List[Tuple[Dict, str, List[bool]]]) -> Dict[str, int]:
+        """
+        Applies (filter_q, key, binary_string) operations like blocking_update_one_binary_string in a single call,
+        returning the matched, modified and rejected counts
+        """
+        pass
+
     @abstractmethod
     def blocking_append(self, idempotency_key: str, doc: Dict):
         pass
 
     @abstractmethod
-    def blocking_random_one(self, q: Dict, projection: List[str]) -> List[Dict]:
+    def blocking_append_many(self, idempotency_key: str, docs: List[Dict]) -> List[str]:
+        """
+        Appends docs in a few round trips, returning "inserted", "duplicate" or "invalid" for each doc
+        """
+        pass
+
+    @abstractmethod
+    def blocking_random_one(self, q: Dict, projection: List[str]) -> Optional[Dict]:
+        pass
+
+    @abstractmethod
+    def blocking_random_many(self, q: Dict, n: int, projection: List[str] = None) -> List[Dict]:
+        """
+        Returns up to n distinct random documents matching q
+        """
         pass
 
     @abstractmethod
     def blocking_count(self, q: Dict) -> int:
         pass
 
+    @abstractmethod
+    def blocking_aggregate(self, pipeline: List[Dict], datetime_q: List[Dict] = None) -> List[Dict]:
+        """
+        Runs an aggregation pipeline in MongoDB and returns its results. Stages are limited to $match, $group,
+        $sort, $limit, $project, $bucket and $facet. datetime_q is matched first, in milliseconds as in blocking_query
+        """
+        pass
+
     @abstractmethod
     def blocking_query_n_nearest_hamming_neighbors(self, q: Dict, binary_string_key: str, from_binary_string: str,
-                                                   pick_n: int) -> List[Dict]:
+                                                   pick_n: int, projection: List[str] = None) -> List[Dict]:
         pass
@@ -0,0 +1,88 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from broccoli_plugin_interface.async_rpc_client import AsyncRpcClient
+from broccoli_plugin_interface.rpc_client import RpcClient
+
+_executor = None  # type: Optional[ThreadPoolExecutor]
+_executor_lock = threading.Lock()
+
+
+def get_async_rpc_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide pool the async clients run blocking calls on, sized by ASYNC_RPC_MAX_WORKERS.
+    Created on first use so that a forked or spawned worker process gets its own
+    """
+    global _executor
+    with _executor_lock:
+        if not _executor:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("ASYNC_RPC_MAX_WORKERS", 16)),
+                thread_name_prefix="broccoli-async-rpc"
+            )
+        return _executor
+
+
+class ThreadPoolAsyncRpcClient(AsyncRpcClient):
+    """
+    AsyncRpcClient over a blocking RpcClient, every call runs on a bounded thread pool so that
+    concurrent calls of a worker are in flight together, up to the size of the pool
+    """
+
+    def __init__(self, rpc_client: RpcClient, executor: Optional[Executor] = None):
+        self.rpc_client = rpc_client
+        self.executor = executor
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor or get_async_rpc_executor(),
+            functools.partial(func, *args)
+        )
+
+    async def query(self, q: Dict, limit: Optional[int] = None, projection: List[str] = None,
+                    sort: Dict[str, int] = None, datetime_q: List[Dict] = None) -> List[Dict]:
+        return await self._run(self.rpc_client.blocking_query, q, limit, projection, sort, datetime_q)
+
+    async def query_page(self, q: Dict, page_size: int, resume_token: Optional[str] = None,
+                         projection: List[str] = None, sort: Dict[str, int] = None,
+                         datetime_q: List[Dict] = None) -> Tuple[List[Dict], Optional[str]]:
+        return await self._run(self.rpc_client.blocking_query_page, q, page_size, resume_token, projection, sort,
+                               datetime_q)
+
+    async def update_one(self, filter_q: Dict, update_doc: Dict):
+        return await self._run(self.rpc_client.blocking_update_one, filter_q, update_doc)
+
+    async def update_one_binary_string(self, filter_q: Dict, key: str, binary_string: List[bool]):
+        return await self._run(self.rpc_client.blocking_update_one_binary_string, filter_q, key, binary_string)
+
+    async def bulk_update_one(self, ops: List[Tuple[Dict, Dict]]) -> Dict[str, int]:
+        return await self._run(self.rpc_client.blocking_bulk_update_one, ops)
+
+    async def bulk_update_one_binary_string(self, ops: List[Tuple[Dict, str, List[bool]]]) -> Dict[str, int]:
+        return await self._run(self.rpc_client.blocking_bulk_update_one_binary_string, ops)
+
+    async def append(self, idempotency_key: str, doc: Dict):
+        return await self._run(self.rpc_client.blocking_append, idempotency_key, doc)
+
+    async def append_many(self, idempotency_key: str, docs: List[Dict]) -> List[str]:
+        return await self._run(self.rpc_client.blocking_append_many, idempotency_key, docs)
+
+    async def random_one(self, q: Dict, projection: List[str]) -> Optional[Dict]:
+        return await self._run(self.rpc_client.blocking_random_one, q, projection)
+
+    async def random_many(self, q: Dict, n: int, projection: List[str] = None) -> List[Dict]:
+        return await self._run(self.rpc_client.blocking_random_many, q, n, projection)
+
+    async def count(self, q: Dict) -> int:
+        return await self._run(self.rpc_client.blocking_count, q)
+
+    async def aggregate(self, pipeline: List[Dict], datetime_q: List[Dict] = None) -> List[Dict]:
+        return await self._run(self.rpc_client.blocking_aggregate, pipeline, datetime_q)
+
+    async def query_n_nearest_hamming_neighbors(self, q: Dict, binary_string_key: str, from_binary_string: str,
+                                                pick_n: int, projection: List[str] = None) -> List[Dict]:
+        return await self._run(self.rpc_client.blocking_query_n_nearest_hamming_neighbors, q, binary_string_key,
+                               from_binary_string, pick_n, projection)
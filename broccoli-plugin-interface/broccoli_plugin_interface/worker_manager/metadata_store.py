@@ -1,3 +1,4 @@
+from typing import Any, Dict, List
 from abc import ABCMeta, abstractmethod
 
 
@@ -14,6 +15,17 @@ class MetadataStore(metaclass=ABCMeta):
     def set(self, key: str, value):
         pass
 
+    @abstractmethod
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Values of the keys that exist, keys that do not are left out
+        """
+        pass
+
+    @abstractmethod
+    def set_many(self, values: Dict[str, Any]):
+        pass
+
     @abstractmethod
     def get_from_another_worker(self, worker_id: str, key: str):
         pass
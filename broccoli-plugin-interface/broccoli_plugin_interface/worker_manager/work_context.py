@@ -1,6 +1,7 @@
 import logging
 from abc import ABCMeta
 from broccoli_plugin_interface.rpc_client import RpcClient
+from broccoli_plugin_interface.async_rpc_client import AsyncRpcClient
 from .metadata_store import MetadataStore
 
 
@@ -13,6 +14,10 @@ class WorkContext(metaclass=ABCMeta):
     def rpc_client(self) -> RpcClient:
         pass
 
+    @property
+    def async_rpc_client(self) -> AsyncRpcClient:
+        pass
+
     @property
     def logger(self) -> logging.Logger:
         pass
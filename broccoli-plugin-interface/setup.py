@@ -9,5 +9,9 @@ setup(
     author_email='whj19931115@gmail.com',
     license='WTFPL',
     packages=find_packages(),
+    extras_require={
+        # HttpRpcClient.blocking_iter_query
+        "bson": ["pymongo"]
+    },
     zip_safe=False
 )
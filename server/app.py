@@ -1,27 +1,40 @@
 import os
-import sys
 import logging
 import datetime
 import importlib
 import json
+import socket
 import dotenv
 from threading import Thread
 from pathlib import Path
-from flask import Flask, jsonify, request, send_from_directory
+from typing import Dict
+from flask import Flask, Response, jsonify, request, send_from_directory, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, verify_jwt_in_request
+from apscheduler.events import EVENT_JOB_ADDED
 from apscheduler.schedulers.background import BackgroundScheduler
 from common.getenv_or_raise import getenv_or_raise
+from common.datetime_utils import datetime_to_milliseconds
 from common.validate_schema_or_not import validate_schema_or_not
 from common.in_process_rpc_client import InProcessRpcClient
+from common.mongo_client_registry import get_pool_metrics
+from common.metrics import REGISTRY
+from common.json_provider import set_json_provider
+from common.response_compression import ResponseCompression
 from content.content_store import ContentStore
 from content.rpc_core import RpcCore
 from scheduler.worker_config_store import WorkerConfigStore
 from scheduler.reconciler import Reconciler
+from scheduler.executor_pools import ExecutorPools
+from scheduler.worker_metrics import WorkerMetrics
 from scheduler.global_metadata_store import GlobalMetadataStore
+from scheduler.lease_store import LeaseStore
+from scheduler.leader_election import LeaderElection
+from scheduler.scheduler_stats_store import SchedulerStatsStore
+from scheduler.worker_assignment import WorkerAssignment
 from dashboard.boards_store import BoardsStore
 from dashboard.objects.board_query import BoardQuery
-from common.request_schemas import ADD_WORKER_BODY_SCHEMA
+from common.request_schemas import ADD_WORKER_BODY_SCHEMA, WORKER_SCHEDULING_SCHEMA
 
 # Load environment variables
 if Path(".env").exists():
@@ -36,11 +49,15 @@ else:
     print("Not loading .workers.env")
 
 # Initialize content objects
-content_store = ContentStore(
-    connection_string=getenv_or_raise("MONGODB_CONNECTION_STRING"),
-    db=getenv_or_raise("MONGODB_DB")
-)
+if os.getenv("CLUSTER_MODE_ENABLED", "false") == "true":
+    # The processes of the other nodes write to the same collection
+    os.environ.setdefault("CONTENT_CHANGE_LOG_ENABLED", "true")
+content_store = ContentStore.from_env()
 rpc_core = RpcCore(content_store)
+# Modules with a register_verbs(rpc_core) function adding their own verbs
+for rpc_verb_module in filter(None, os.getenv("RPC_VERB_MODULES", "").split(",")):
+    importlib.import_module(rpc_verb_module.strip()).register_verbs(rpc_core)
+rpc_batch_max_calls = int(os.getenv("RPC_BATCH_MAX_CALLS", 1000))
 
 # Initialize common objects
 in_process_rpc_client = InProcessRpcClient(content_store)
@@ -54,9 +71,39 @@ global_metadata_store = GlobalMetadataStore(
     connection_string=getenv_or_raise("MONGODB_CONNECTION_STRING"),
     db=getenv_or_raise("MONGODB_DB")
 )
+executor_pools = ExecutorPools.from_env()
+worker_metrics = WorkerMetrics(REGISTRY)
+lease_store = LeaseStore(
+    connection_string=getenv_or_raise("MONGODB_CONNECTION_STRING"),
+    db=getenv_or_raise("MONGODB_DB")
+)
+# Metrics of the scheduler as last published by the leader, for the API processes that do not run it
+scheduler_stats_store = SchedulerStatsStore(
+    connection_string=getenv_or_raise("MONGODB_CONNECTION_STRING"),
+    db=getenv_or_raise("MONGODB_DB")
+)
+# Only the process holding the leader lease runs the scheduler, however many processes serve the API.
+# In cluster mode there is one leader per node, and the nodes split the workers between them
+cluster_mode_enabled = os.getenv("CLUSTER_MODE_ENABLED", "false") == "true"
+scheduler_leader_election = LeaderElection(
+    lease_store=lease_store,
+    name=f"broccoli.scheduler_leader.{os.getenv('NODE_NAME', socket.gethostname())}" if cluster_mode_enabled
+    else "broccoli.scheduler_leader",
+    ttl_seconds=float(os.getenv("SCHEDULER_LEASE_TTL_SECONDS", 30)),
+    on_elected=lambda: _start_scheduler(),
+    on_deposed=lambda: _stop_scheduler()
+)
+worker_assignment = WorkerAssignment(
+    lease_store=lease_store,
+    owner=scheduler_leader_election.owner,
+    ttl_seconds=float(os.getenv("WORKER_LEASE_TTL_SECONDS", 60))
+) if cluster_mode_enabled else None
 reconciler = Reconciler(
     worker_config_store=worker_config_store,
-    rpc_client=in_process_rpc_client
+    rpc_client=in_process_rpc_client,
+    executor_pools=executor_pools,
+    worker_metrics=worker_metrics,
+    worker_assignment=worker_assignment
 )
 
 # Initialize dashboard objects
@@ -65,6 +112,10 @@ boards_store = BoardsStore(
     db=getenv_or_raise("MONGODB_DB")
 )
 
+# Boards are the hottest queries, let the index manager know about them upfront
+for (_, existing_board_query) in boards_store.get_all():
+    content_store.index_manager.record_board_query(json.loads(existing_board_query.q), existing_board_query.sort)
+
 # Initialize API objects
 default_api_handler_clazz = getattr(
     importlib.import_module(getenv_or_raise("DEFAULT_API_HANDLER_MODULE")),
@@ -74,8 +125,15 @@ default_api_handler = default_api_handler_clazz()
 
 # Flask misc.
 STATIC_FOLDER = "web_static"
+NDJSON_MIMETYPE = "application/x-ndjson"
+# BSON documents back to back, each starts with its own length
+BSON_MIMETYPE = "application/bson"
 app = Flask(__name__, static_folder=STATIC_FOLDER)
 CORS(app)
+set_json_provider(app, os.getenv("JSON_PROVIDER", "orjson"))
+response_compression = ResponseCompression(
+    min_bytes=int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", 1024))
+) if os.getenv("RESPONSE_COMPRESSION_ENABLED", "true") == "true" else None
 
 # Less verbose logging from Flask
 werkzeug_logger = logging.getLogger('werkzeug')
@@ -101,6 +159,13 @@ def before_request():
         verify_jwt_in_request()
 
 
+@app.after_request
+def after_request(response):
+    if response_compression:
+        return response_compression.compress(request, response)
+    return response
+
+
 # Serve the static react app under web_static
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -155,6 +220,10 @@ def api(path):
 def _rpc():
     # todo: parse json failure
     parsed_body = request.json
+    if NDJSON_MIMETYPE in request.headers.get("Accept", ""):
+        return _rpc_stream(parsed_body)
+    if BSON_MIMETYPE in request.headers.get("Accept", ""):
+        return _rpc_stream(parsed_body, bson_documents=True)
     status, message_or_result = rpc_core.call(parsed_body)
     if not status:
         return jsonify({
@@ -170,6 +239,67 @@ def _rpc():
         })
 
 
+@app.route("/apiInternal/rpc/batch", methods=['POST'])
+def _rpc_batch():
+    parsed_body = request.get_json(silent=True)
+    if type(parsed_body) != list:
+        return jsonify({
+            "status": "error",
+            "payload": {
+                "message": "Body must be a list of rpc requests"
+            }
+        }), 400
+    if len(parsed_body) > rpc_batch_max_calls:
+        return jsonify({
+            "status": "error",
+            "payload": {
+                "message": f"At most {rpc_batch_max_calls} rpc requests per batch"
+            }
+        }), 400
+    return jsonify({
+        "status": "ok",
+        "payload": list(map(
+            lambda result: {"status": "ok", "payload": result[1]} if result[0]
+            else {"status": "error", "payload": {"message": result[1]}},
+            rpc_core.call_batch(parsed_body)
+        ))
+    })
+
+
+def _rpc_stream(parsed_body, bson_documents=False):
+    status, message_or_documents = rpc_core.stream(parsed_body, bson_documents=bson_documents)
+    if not status:
+        return jsonify({
+            "status": "error",
+            "payload": {
+                "message": message_or_documents
+            }
+        }), 500
+
+    if bson_documents:
+        return Response(stream_with_context(_join_chunks(message_or_documents)), mimetype=BSON_MIMETYPE)
+
+    def generate():
+        for document in message_or_documents:
+            yield app.json.dumps(document) + "\n"
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def _join_chunks(chunks, min_bytes=64 * 1024):
+    """
+    Writes small documents in fewer and larger chunks
+    """
+    buffer, size = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= min_bytes:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
 @app.route("/apiInternal/worker", methods=["POST"])
 def _add_worker():
     body = request.json
@@ -183,7 +313,8 @@ def _add_worker():
         module=body["module"],
         class_name=body["class_name"],
         args=body["args"],
-        interval_seconds=body["interval_seconds"]
+        interval_seconds=body["interval_seconds"],
+        scheduling=body.get("scheduling")
     )
     if not status:
         return jsonify({
@@ -191,6 +322,7 @@ def _add_worker():
             "message": message_or_worker_id
         }), 400
     else:
+        reconciler.trigger()
         return jsonify({
             "status": "ok",
             "worker_id": message_or_worker_id
@@ -201,17 +333,34 @@ def _add_worker():
 def _get_workers():
     workers = []
     for worker_id, worker in worker_config_store.get_all().items():
-        module, class_name, args, interval_seconds = worker
+        module, class_name, args, interval_seconds, scheduling = worker
         workers.append({
             "worker_id": worker_id,
             "module": module,
             "class_name": class_name,
             "args": args,
-            "interval_seconds": interval_seconds
+            "interval_seconds": interval_seconds,
+            "scheduling": scheduling
         })
     return jsonify(workers), 200
 
 
+@app.route("/apiInternal/worker/stats", methods=["GET"])
+def _get_worker_stats():
+    workers = _scheduler_stats()["workers"]
+    stats = {}
+    for worker_id in worker_config_store.get_all().keys():
+        # A worker not run yet has empty metrics
+        stats[worker_id] = workers.get(worker_id) or worker_metrics.summary(worker_id)
+    return jsonify(stats), 200
+
+
+@app.route("/apiInternal/metrics", methods=["GET"])
+def _get_metrics():
+    # Workers run in the scheduler leader, the other processes serve the registry it last published
+    return Response(_scheduler_stats()["metrics"] or REGISTRY.expose(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/apiInternal/worker/<string:worker_id>", methods=["DELETE"])
 def _remove_worker(worker_id: str):
     status, message = worker_config_store.remove(worker_id)
@@ -221,6 +370,7 @@ def _remove_worker(worker_id: str):
             "message": message
         }), 400
     else:
+        reconciler.trigger()
         return jsonify({
             "status": "ok"
         }), 200
@@ -235,11 +385,44 @@ def _update_worker_interval_seconds(worker_id: str, interval_seconds: int):
             "message": message
         }), 400
     else:
+        reconciler.trigger()
+        return jsonify({
+            "status": "ok"
+        }), 200
+
+
+@app.route("/apiInternal/worker/<string:worker_id>/scheduling", methods=["PUT"])
+def _update_worker_scheduling(worker_id: str):
+    body = request.json
+    success, message = validate_schema_or_not(instance=body, schema=WORKER_SCHEDULING_SCHEMA)
+    if not success:
+        return jsonify({
+            "status": "error",
+            "message": message
+        }), 400
+    if "executor" in body and body["executor"] not in executor_pools:
+        return jsonify({
+            "status": "error",
+            "message": f"Executor {body['executor']} does not exist"
+        }), 400
+    status, message = worker_config_store.update_scheduling(worker_id, body)
+    if not status:
+        return jsonify({
+            "status": "error",
+            "message": message
+        }), 400
+    else:
+        reconciler.trigger()
         return jsonify({
             "status": "ok"
         }), 200
 
 
+@app.route("/apiInternal/executors", methods=["GET"])
+def _get_executors():
+    return jsonify(_scheduler_stats()["executors"] or executor_pools.metrics()), 200
+
+
 @app.route("/apiInternal/worker/<string:worker_id>/metadata", methods=["GET"])
 def _get_worker_metadata(worker_id: str):
     return jsonify(global_metadata_store.get_all(worker_id)), 200
@@ -257,6 +440,7 @@ def _set_worker_metadata(worker_id: str):
 @app.route("/apiInternal/board/<string:board_id>", methods=["POST"])
 def _upsert_board(board_id: str):
     parsed_body = request.json
+    content_store.index_manager.record_board_query(parsed_body["q"], parsed_body.get("sort"))
     parsed_body["q"] = json.dumps(parsed_body["q"])
     boards_store.upsert(board_id, BoardQuery(parsed_body))
     return jsonify({
@@ -300,28 +484,205 @@ def _remove_board(board_id: str):
     }), 200
 
 
-if __name__ == '__main__':
-    # detect flask debug mode
-    # https://stackoverflow.com/questions/14874782/apscheduler-in-flask-executes-twice
-    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
-        print("Not in debug mode, starting scheduler")
-        scheduler = BackgroundScheduler()
-        reconciler.set_scheduler(scheduler)
+@app.route("/apiInternal/indexes", methods=["GET"])
+def _get_indexes():
+    return jsonify(content_store.index_manager.describe()), 200
+
+
+@app.route("/apiInternal/schema", methods=["GET"])
+def _get_schema_catalog():
+    return jsonify(content_store.schema_catalog.describe()), 200
+
+
+@app.route("/apiInternal/schema/rebuild", methods=["POST"])
+def _rebuild_schema_catalog():
+    sample_size = (request.get_json(silent=True) or {}).get("sample_size")
+    if sample_size is not None and (type(sample_size) != int or sample_size < 1):
+        return jsonify({
+            "status": "error",
+            "message": "sample_size must be a positive integer"
+        }), 400
+    documents_read = content_store.schema_catalog.rebuild(sample_size)
+    return jsonify({
+        "status": "ok",
+        "documents_read": documents_read
+    }), 200
+
+
+@app.route("/apiInternal/binary_strings/<string:key>", methods=["GET"])
+def _get_binary_string_storage(key):
+    return jsonify(content_store.binary_string_storage(key)), 200
+
+
+@app.route("/apiInternal/query_cache", methods=["GET"])
+def _get_query_cache():
+    if not content_store.query_cache:
+        return jsonify({
+            "enabled": False
+        }), 200
+    return jsonify(dict(content_store.query_cache.stats(), enabled=True)), 200
+
+
+@app.route("/apiInternal/mongo/pool", methods=["GET"])
+def _get_mongo_pool():
+    return jsonify(get_pool_metrics()), 200
+
+
+def _start_scheduler():
+    global scheduler
+    scheduler = BackgroundScheduler(executors=executor_pools.build())
+    executor_pools.listen(scheduler)
+    worker_metrics.listen(scheduler)
+    scheduler.add_listener(_enable_change_log_for_process_pools, EVENT_JOB_ADDED)
+    reconciler.set_scheduler(scheduler)
+    scheduler.add_job(
+        reconciler.reconcile,
+        id=reconciler.RECONCILE_JOB_ID,
+        trigger='interval',
+        # Cheap while nothing changes, a version check unless in cluster mode
+        seconds=float(os.getenv("WORKER_RECONCILE_INTERVAL_SECONDS", 2)),
+        executor=ExecutorPools.SYSTEM_EXECUTOR
+    )
+    if os.getenv("INDEX_MANAGER_ENABLED", "true") == "true":
         scheduler.add_job(
-            reconciler.reconcile,
-            id=reconciler.RECONCILE_JOB_ID,
+            content_store.index_manager.reconcile,
+            id="broccoli.index_manager_reconcile",
             trigger='interval',
-            seconds=10
+            seconds=int(os.getenv("INDEX_MANAGER_INTERVAL_SECONDS", 60)),
+            executor=ExecutorPools.SYSTEM_EXECUTOR
+        )
+    if content_store.schema_catalog.is_empty():
+        # Backfill once for collections written before the catalog existed
+        scheduler.add_job(
+            content_store.schema_catalog.rebuild,
+            id="broccoli.schema_catalog_backfill",
+            kwargs={"sample_size": int(os.getenv("SCHEMA_CATALOG_BACKFILL_SAMPLE_SIZE", 10000))},
+            executor=ExecutorPools.SYSTEM_EXECUTOR
         )
+    scheduler.add_job(
+        _publish_scheduler_stats,
+        id="broccoli.scheduler_stats_publish",
+        trigger='interval',
+        seconds=float(os.getenv("SCHEDULER_STATS_PUBLISH_SECONDS", 5)),
+        executor=ExecutorPools.SYSTEM_EXECUTOR
+    )
+    if content_store.packed_binary_strings:
+        migration_keys = map(lambda k: k.strip(), os.getenv("BINARY_STRING_MIGRATION_KEYS", "").split(","))
+        for binary_string_key in filter(None, migration_keys):
+            scheduler.add_job(
+                content_store.migrate_binary_strings,
+                id=f"broccoli.binary_string_migration.{binary_string_key}",
+                args=(binary_string_key,),
+                kwargs={"pause_seconds": float(os.getenv("BINARY_STRING_MIGRATION_PAUSE_SECONDS", 0.1))},
+                executor=ExecutorPools.SYSTEM_EXECUTOR
+            )
+
+    scheduler.start()
+
+
+def _enable_change_log_for_process_pools(event):
+    job = scheduler.get_job(event.job_id) if scheduler else None
+    if job and job.executor in executor_pools and executor_pools.is_process_pool(job.executor) \
+            and not content_store.change_log:
+        # Pool processes are started on the first run of a job, after this, and inherit the environment
+        os.environ["CONTENT_CHANGE_LOG_ENABLED"] = "true"
+        content_store.enable_change_log()
+
+
+def _stop_scheduler():
+    global scheduler
+    if scheduler:
+        if scheduler.running:
+            # Running jobs finish before their worker leases are released, so that the next leader does not
+            # start a worker that is still running here
+            scheduler.shutdown(wait=True)
+        scheduler = None
+    if worker_assignment:
+        worker_assignment.release_all()
+
+
+scheduler = None
+
+
+def _current_scheduler_stats() -> Dict:
+    return {
+        "owner": scheduler_leader_election.owner,
+        "published_at": datetime.datetime.utcnow(),
+        "workers": dict(map(
+            lambda worker_id: (worker_id, worker_metrics.summary(worker_id)),
+            worker_config_store.get_all().keys()
+        )),
+        "executors": executor_pools.metrics(),
+        "jobs": len(scheduler.get_jobs()) if scheduler else 0,
+        "metrics": REGISTRY.expose()
+    }
+
+
+def _publish_scheduler_stats():
+    stats = _current_scheduler_stats()
+    scheduler_stats_store.publish(scheduler_leader_election.name, stats["owner"], stats["workers"],
+                                  stats["executors"], stats["jobs"], stats["metrics"])
+
+
+def _scheduler_stats() -> Dict:
+    """
+    Metrics of the scheduler of this node, live in the leader and as last published by it in the other processes
+    """
+    if scheduler_leader_election.is_leader and scheduler:
+        return _current_scheduler_stats()
+    return scheduler_stats_store.get(scheduler_leader_election.name) or {
+        "owner": None,
+        "published_at": None,
+        "workers": {},
+        "executors": {},
+        "jobs": 0,
+        "metrics": ""
+    }
+
+
+@app.route("/apiInternal/scheduler", methods=["GET"])
+def _get_scheduler():
+    lease = lease_store.get(scheduler_leader_election.name) or {}
+    stats = _scheduler_stats()
+    return jsonify({
+        "leader": lease.get("owner"),
+        "lease_expires_at": datetime_to_milliseconds(lease["expires_at"]) if "expires_at" in lease else None,
+        "this_process": scheduler_leader_election.owner,
+        "is_leader": scheduler_leader_election.is_leader,
+        "jobs": stats["jobs"],
+        "stats_published_by": stats["owner"],
+        "stats_published_at": datetime_to_milliseconds(stats["published_at"]) if stats["published_at"] else None
+    }), 200
+
+
+@app.route("/apiInternal/cluster", methods=["GET"])
+def _get_cluster():
+    if not worker_assignment:
+        return jsonify({
+            "enabled": False
+        }), 200
+    return jsonify({
+        "enabled": True,
+        "nodes": list(map(lambda d: d["owner"], lease_store.live(WorkerAssignment.NODE_LEASE_PREFIX))),
+        "workers": dict(map(
+            lambda d: (d["_id"][len(WorkerAssignment.WORKER_LEASE_PREFIX):], d["owner"]),
+            lease_store.live(WorkerAssignment.WORKER_LEASE_PREFIX)
+        ))
+    }), 200
+
 
-        print(f"Press Ctrl+{'Break' if os.name == 'nt' else 'C'} to exit")
-        try:
-            scheduler.start()
-        except (KeyboardInterrupt, SystemExit):
-            print('Workers exit')
-            scheduler.shutdown(wait=False)
-            sys.exit(0)
+if __name__ == '__main__':
+    # detect flask debug mode
+    # https://stackoverflow.com/questions/14874782/apscheduler-in-flask-executes-twice
+    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        print("Not in debug mode, starting scheduler once elected as the leader")
+        scheduler_leader_election.start()
     else:
         print("In debug mode, not starting scheduler")
 
-    app.run(host='0.0.0.0', port=int(os.getenv("PORT", 5000)))
+    print(f"Press Ctrl+{'Break' if os.name == 'nt' else 'C'} to exit")
+    try:
+        app.run(host='0.0.0.0', port=int(os.getenv("PORT", 5000)))
+    finally:
+        print('Workers exit')
+        scheduler_leader_election.stop()
@@ -0,0 +1,73 @@
+"""
+Compares radius hamming search engines on synthetic 64-bit hashes
+
+    python -m benchmarks.hamming_benchmark --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+from typing import Callable, List
+from content.content_store import ContentStore
+from content.hamming_index import HammingIndex
+
+HASH_BITS = 64
+
+
+def random_hashes(n: int, random_gen: random.Random) -> List[str]:
+    return [format(random_gen.getrandbits(HASH_BITS), f"0{HASH_BITS}b") for _ in range(n)]
+
+
+def near(binary_string: str, flipped_bits: int, random_gen: random.Random) -> str:
+    bits = list(binary_string)
+    for position in random_gen.sample(range(len(bits)), flipped_bits):
+        bits[position] = "1" if bits[position] == "0" else "0"
+    return "".join(bits)
+
+
+def linear_string_scan(hashes: List[str]) -> Callable[[str, int], List[int]]:
+    def within(from_binary_string: str, max_distance: int) -> List[int]:
+        return [i for i, h in enumerate(hashes)
+                if ContentStore._compute_binary_hamming_distance(h, from_binary_string) <= max_distance]
+    return within
+
+
+def build_index(hashes: List[str], multi_index_hashing: bool) -> HammingIndex:
+    index = HammingIndex("bs", multi_index_hashing=multi_index_hashing)
+    for i, h in enumerate(hashes):
+        index.add(i, h)
+    return index
+
+
+def time_queries(within: Callable[[str, int], List[int]], queries: List[str], max_distance: int) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        within(query, max_distance)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark radius hamming search engines")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--max-distances", type=int, nargs="+", default=[4, 8])
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random_gen = random.Random(args.seed)
+    print(f"{'documents':>10} {'radius':>6} {'engine':>20} {'build s':>9} {'query ms':>10}")
+    for size in args.sizes:
+        hashes = random_hashes(size, random_gen)
+        queries = [near(hashes[random_gen.randrange(size)], 2, random_gen) for _ in range(args.queries)]
+        engines = [("linear string scan", 0.0, linear_string_scan(hashes))]
+        for name, multi_index_hashing in [("packed linear scan", False), ("multi-index hashing", True)]:
+            start = time.perf_counter()
+            index = build_index(hashes, multi_index_hashing)
+            engines.append((name, time.perf_counter() - start, index.within))
+        for max_distance in args.max_distances:
+            for name, build_seconds, within in engines:
+                query_ms = time_queries(within, queries, max_distance)
+                print(f"{size:>10} {max_distance:>6} {name:>20} {build_seconds:>9.2f} {query_ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
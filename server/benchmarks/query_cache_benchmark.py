@@ -0,0 +1,71 @@
+"""
+Simulates open dashboard tabs polling the same boards while workers append, and counts the queries
+that reach MongoDB with and without the query cache
+
+    python -m benchmarks.query_cache_benchmark --tabs 20 --boards 5 --polls 100 --append-every 10
+"""
+import argparse
+import threading
+import time
+import mongomock
+from content.content_store import ContentStore
+from content.query_cache import QueryCache
+
+
+class CountingContentStore(ContentStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mongo_queries = 0
+        self._count_lock = threading.Lock()
+
+    def iter_query(self, *args, **kwargs):
+        with self._count_lock:
+            self.mongo_queries += 1
+        return super().iter_query(*args, **kwargs)
+
+
+def poll(content_store: ContentStore, tabs: int, boards: int, polls: int, append_every: int) -> float:
+    start = time.perf_counter()
+    for poll_i in range(polls):
+        if append_every and poll_i % append_every == 0:
+            content_store.append({"key": f"value_{poll_i}", "board": poll_i % boards, "score": poll_i}, "key")
+        # Every open tab refreshes every board, concurrently
+        threads = []
+        for _ in range(tabs):
+            for board in range(boards):
+                thread = threading.Thread(
+                    target=content_store.query,
+                    args=({"board": board},),
+                    kwargs={"limit": 50, "projection": ["key", "score"], "sort": {"score": -1}}
+                )
+                threads.append(thread)
+                thread.start()
+        for thread in threads:
+            thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the query cache against polling dashboards")
+    parser.add_argument("--tabs", type=int, default=20)
+    parser.add_argument("--boards", type=int, default=5)
+    parser.add_argument("--polls", type=int, default=100)
+    parser.add_argument("--append-every", type=int, default=10)
+    parser.add_argument("--documents", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'engine':>10} {'requests':>9} {'mongo queries':>14} {'hit ratio':>10} {'seconds':>8}")
+    for run, (name, query_cache) in enumerate([("no cache", None), ("cache", QueryCache(ttl_seconds=60))]):
+        with mongomock.patch(servers=(("localhost", 27017),)):
+            content_store = CountingContentStore("mongodb://localhost:27017", f"benchmark_{run}",
+                                                 query_cache=query_cache)
+            content_store.append_many(
+                [{"key": f"seed_{i}", "board": i % args.boards, "score": i} for i in range(args.documents)], "key")
+            seconds = poll(content_store, args.tabs, args.boards, args.polls, args.append_every)
+            requests = args.tabs * args.boards * args.polls
+            hit_ratio = query_cache.stats()["hit_ratio"] if query_cache else 0.0
+            print(f"{name:>10} {requests:>9} {content_store.mongo_queries:>14} {hit_ratio:>10.3f} {seconds:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares the CPU time and peak memory of sending a large query result as one json response, as an ndjson stream
+and as a stream of the raw BSON documents. MongoDB replies are stood in for by BSON batches decoded the way
+pymongo decodes them, so no mongod is needed
+
+    python -m benchmarks.raw_bson_benchmark --documents 100000
+"""
+import argparse
+import time
+import tracemalloc
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from flask import Flask
+from common.json_provider import set_json_provider
+from benchmarks.serialization_benchmark import make_documents
+
+RAW_BSON_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+
+def make_batches(n: int, batch_size: int):
+    documents = make_documents(n)
+    return list(map(
+        lambda start: b"".join(map(bson.encode, documents[start:start + batch_size])),
+        range(0, n, batch_size)
+    ))
+
+
+def json_response(app: Flask, batches):
+    documents = []
+    for batch in batches:
+        documents += bson.decode_all(batch)
+    with app.app_context():
+        yield app.json.response(documents).get_data()
+
+
+def ndjson_stream(app: Flask, batches):
+    for batch in batches:
+        for document in bson.decode_all(batch):
+            yield (app.json.dumps(document) + "\n").encode("utf-8")
+
+
+def bson_stream(app: Flask, batches):
+    for batch in batches:
+        yield b"".join(map(lambda d: d.raw, bson.decode_all(batch, RAW_BSON_CODEC_OPTIONS)))
+
+
+def send(chunks) -> int:
+    return sum(map(len, chunks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exporting a large query as json, ndjson and raw BSON")
+    parser.add_argument("--documents", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    set_json_provider(app, "orjson")
+    batches = make_batches(args.documents, args.batch_size)
+    print(f"{args.documents} documents, {sum(map(len, batches)) / 1024 / 1024:.1f} MiB of BSON")
+    print(f"{'path':>14} {'seconds':>8} {'peak MiB':>9} {'sent MiB':>9}")
+    for name, path in [("json", json_response), ("ndjson stream", ndjson_stream), ("bson stream", bson_stream)]:
+        start = time.perf_counter()
+        sent_bytes = send(path(app, batches))
+        seconds = time.perf_counter() - start
+        # Separately, tracing allocations slows the run down
+        tracemalloc.start()
+        send(path(app, batches))
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:>14} {seconds:>8.3f} {peak_bytes / 1024 / 1024:>9.1f} {sent_bytes / 1024 / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Measures the rpc dispatch overhead per verb, against a content store that does no work, comparing the verb registry
+with the former dispatch that walked an if-chain, rebuilt the jsonschema validator and formatted the debug log
+on every call
+
+    python -m benchmarks.rpc_dispatch_benchmark --seconds 1
+"""
+import argparse
+import time
+from typing import Callable, Dict
+from common.validate_schema_or_not import validate_schema_or_not
+from content.logging import logger
+from content.rpc_core import RpcCore
+from content.rpc_schemas import SCHEMAS
+
+CALLS = {
+    "append": {"doc": {"key": "value"}, "idempotency_key": "key"},
+    "append_many": {"docs": [{"key": "value"}], "idempotency_key": "key"},
+    "query": {"q": {"key": "value"}, "limit": 10, "projection": ["key"], "sort": {"key": -1}},
+    "update_one": {"filter_q": {"key": "value"}, "update_doc": {"$set": {"other_key": 1}}},
+    "schema": {},
+    "update_one_binary_string": {"filter_q": {"key": "value"}, "key": "hash", "binary_string": "0101"},
+    "bulk_update_one": {"ops": [{"filter_q": {"key": "value"}, "update_doc": {"$set": {"other_key": 1}}}]},
+    "bulk_update_one_binary_string": {"ops": [{"filter_q": {"key": "value"}, "key": "hash", "binary_string": "0101"}]},
+    "query_nearest_hamming_neighbors": {"q": {}, "binary_string_key": "hash", "from_binary_string": "0101",
+                                        "max_distance": 2},
+    "query_n_nearest_hamming_neighbors": {"q": {}, "binary_string_key": "hash", "from_binary_string": "0101",
+                                          "pick_n": 1},
+    "random_one": {"q": {}, "projection": ["key"]},
+    "random_many": {"q": {}, "n": 1},
+    "count": {"q": {"key": "value"}},
+    "aggregate": {"pipeline": [{"$match": {"key": "value"}}, {"$group": {"_id": "$other_key", "n": {"$sum": 1}}}]},
+}
+
+
+class NoOpContentStore(object):
+    # Filters are rewritten for packed binary strings as in production
+    packed_binary_strings = True
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: [] if name != "query_page" else ([], None)
+
+
+class LegacyRpcCore(RpcCore):
+    """
+    The dispatch as it was before the verb registry
+    """
+
+    def call(self, parsed_body: Dict):
+        status, message = RpcCore._validate_body(parsed_body)
+        if not status:
+            return False, message
+        verb = parsed_body["verb"]
+        metadata = parsed_body["metadata"]
+        payload = parsed_body['payload']
+        logger.debug(f"Received rpc request verb={verb} metadata={metadata} payload={payload}")
+        for known_verb in CALLS.keys():
+            if verb == known_verb:
+                logger.debug(f"Calling {verb} metadata={metadata}, payload={payload}")
+                # update_one checked its payload by hand
+                if verb in SCHEMAS and verb != "update_one":
+                    status, message = validate_schema_or_not(payload, SCHEMAS[verb]["payload"])
+                    if not status:
+                        return False, message
+                return getattr(self, verb)(metadata, payload)
+        return False, 'Unknown verb'
+
+
+def calls_per_second(call: Callable[[Dict], object], parsed_body: Dict, seconds: float) -> float:
+    calls = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            call(parsed_body)
+        calls += 100
+    return calls / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rpc dispatch and payload validation")
+    parser.add_argument("--seconds", type=float, default=1, help="time spent on each verb and dispatch")
+    args = parser.parse_args()
+
+    legacy, registry = LegacyRpcCore(NoOpContentStore()), RpcCore(NoOpContentStore())
+    print(f"{'verb':>34} {'before calls/s':>15} {'after calls/s':>14} {'speedup':>8}")
+    for verb, payload in CALLS.items():
+        parsed_body = {"verb": verb, "metadata": {"caller": "benchmark"}, "payload": payload}
+        for rpc_core in [legacy, registry]:
+            status, message = rpc_core.call(parsed_body)
+            assert status, f"{verb} fails, message {message}"
+        before = calls_per_second(legacy.call, parsed_body, args.seconds)
+        after = calls_per_second(registry.call, parsed_body, args.seconds)
+        print(f"{verb:>34} {before:>15.0f} {after:>14.0f} {after / before:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
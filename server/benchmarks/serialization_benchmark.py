@@ -0,0 +1,85 @@
+"""
+Times turning a large query result into a response body: the former per-document conversion followed by Flask's
+json encoder, against raw documents written by the orjson provider, and then the cost and size of compressing it
+
+    python -m benchmarks.serialization_benchmark --documents 50000
+"""
+import argparse
+import copy
+import datetime
+import time
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from common.json_provider import set_json_provider
+from common.response_compression import ENCODERS, ResponseCompression
+from content.content_store import ContentStore
+from content.packed_binary_string import to_packed
+
+
+def make_documents(n: int):
+    created_at = datetime.datetime(2020, 1, 1)
+    return list(map(lambda i: {
+        "_id": ObjectId(),
+        "created_at": created_at + datetime.timedelta(seconds=i),
+        "title": f"Document {i}",
+        "url": f"https://example.com/documents/{i}",
+        "tags": ["tag_a", "tag_b", f"tag_{i % 100}"],
+        "score": i * 0.5,
+        "hash": to_packed(format(i * 2654435761 % 2 ** 64, "064b")),
+    }, range(n)))
+
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serializing and compressing query responses")
+    parser.add_argument("--documents", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    documents = make_documents(args.documents)
+    before_app, after_app = Flask("before"), Flask("after")
+    before_app.json = DefaultJSONProvider(before_app)
+    set_json_provider(after_app, "orjson")
+
+    # query converted its documents in place, each run gets its own copy made outside of the timing
+    copies = []
+
+    def before():
+        json_documents = list(map(ContentStore._to_json_document, copies.pop()))
+        with before_app.app_context():
+            return before_app.json.response(json_documents).get_data()
+
+    def after():
+        with after_app.app_context():
+            return after_app.json.response(list(map(ContentStore.created_at_to_milliseconds, documents))).get_data()
+
+    print(f"{args.documents} documents")
+    print(f"{'encoder':>24} {'seconds':>8}")
+    results = {}
+    for name, encode in [("convert + flask json", before), ("orjson provider", after)]:
+        runs = []
+        for _ in range(args.repeat):
+            copies.append(copy.deepcopy(documents))
+            body, seconds = timed(encode)
+            runs.append(seconds)
+        results[name] = min(runs)
+        print(f"{name:>24} {results[name]:>8.3f}")
+    print(f"{'speedup':>24} {results['convert + flask json'] / results['orjson provider']:>7.1f}x")
+
+    print(f"{len(body) / 1024 / 1024:.1f} MiB of json")
+    print(f"{'compression':>24} {'seconds':>8} {'MiB':>6} {'ratio':>6}")
+    level = ResponseCompression().level
+    for encoding in ENCODERS.keys():
+        compressed, seconds = timed(lambda: ENCODERS[encoding](body, level))
+        print(f"{encoding:>24} {seconds:>8.3f} {len(compressed) / 1024 / 1024:>6.2f} "
+              f"{len(body) / len(compressed):>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+Times every rpc verb through InProcessRpcClient and through the Flask app, and N workers firing through
+BackgroundScheduler, against a synthetic collection with 64 and 256 bit hashes. Results go to a JSON file,
+which a later run compares itself to, failing on regressions past a threshold
+
+    python -m benchmarks.suite --documents 10000 --output before.json
+    python -m benchmarks.suite --documents 10000 --output after.json --baseline before.json --max-regression 0.2
+
+Without --mongodb-connection-string everything runs against mongomock, which is fine to compare commits with but
+says little about MongoDB itself. Use a local mongod for the larger sizes, its database is dropped before and after
+"""
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import mongomock
+from content.packed_binary_string import to_packed
+
+BENCHMARK_DB = "broccoli_benchmark"
+MOCK_CONNECTION_STRING = "mongodb://localhost:27017"
+HASH_BITS = [64, 256]
+GROUPS = 100
+# The metric compared against the baseline, higher is better
+COMPARED_METRIC = "ops_per_second"
+# Verbs RpcClient has no blocking_ method for, only timed through the app
+HTTP_ONLY_VERBS = {"query_nearest_hamming_neighbors"}
+
+
+def random_binary_string(rng: random.Random, bits: int) -> str:
+    return format(rng.getrandbits(bits), f"0{bits}b")
+
+
+def load_documents(collection, n: int, seed: int, packed: bool, batch_size: int = 10000):
+    """
+    Inserts n documents straight into the collection, much faster than appending them one by one
+    """
+    rng = random.Random(seed)
+    created_at = datetime.datetime(2020, 1, 1)
+    for start in range(0, n, batch_size):
+        documents = []
+        for i in range(start, min(n, start + batch_size)):
+            document = {
+                "i": i,
+                "idempotency_key": f"document_{i}",
+                "group": i % GROUPS,
+                "score": rng.random(),
+                "tags": [f"tag_{rng.randrange(20)}" for _ in range(3)],
+                "created_at": created_at + datetime.timedelta(seconds=i),
+            }
+            for bits in HASH_BITS:
+                binary_string = random_binary_string(rng, bits)
+                document[f"hash_{bits}"] = to_packed(binary_string) if packed else binary_string
+            documents.append(document)
+        collection.insert_many(documents)
+
+
+def operations(n: int, seed: int) -> List[Tuple[str, str, Callable[[int], Dict]]]:
+    """
+    (name, verb, payload of the i-th call) of every timed call, the payload changes between calls so that
+    writes do not collide and reads do not all hit the same cached query
+    """
+    rng = random.Random(seed + 1)
+    some_binary_strings = {bits: random_binary_string(rng, bits) for bits in HASH_BITS}
+    specs = [
+        ("append", "append", lambda i: {"doc": {"idempotency_key": f"benchmark_{i}", "group": i % GROUPS},
+                                        "idempotency_key": "idempotency_key"}),
+        ("append_many", "append_many", lambda i: {
+            "docs": [{"idempotency_key": f"benchmark_many_{i}_{j}", "group": j % GROUPS} for j in range(100)],
+            "idempotency_key": "idempotency_key"}),
+        ("query", "query", lambda i: {"q": {"group": i % GROUPS}, "limit": 100, "sort": {"score": -1}}),
+        ("query_page", "query", lambda i: {"q": {"group": i % GROUPS}, "page_size": 100}),
+        ("count", "count", lambda i: {"q": {"group": i % GROUPS}}),
+        ("update_one", "update_one", lambda i: {"filter_q": {"i": i % n},
+                                                "update_doc": {"$set": {"updated": i}}}),
+        ("bulk_update_one", "bulk_update_one", lambda i: {"ops": [
+            {"filter_q": {"i": (i * 100 + j) % n}, "update_doc": {"$set": {"updated": i}}} for j in range(100)]}),
+        ("random_one", "random_one", lambda i: {"q": {"group": i % GROUPS}, "projection": ["i"]}),
+        ("random_many", "random_many", lambda i: {"q": {}, "n": 10}),
+        ("aggregate", "aggregate", lambda i: {"pipeline": [
+            {"$match": {"group": i % GROUPS}},
+            {"$group": {"_id": "$group", "n": {"$sum": 1}, "score": {"$avg": "$score"}}}
+        ]}),
+    ]
+    for bits in HASH_BITS:
+        key = f"hash_{bits}"
+        specs += [
+            (f"update_one_binary_string_{bits}", "update_one_binary_string", lambda i, key=key, bits=bits: {
+                "filter_q": {"i": i % n}, "key": key, "binary_string": random_binary_string(rng, bits)}),
+            (f"query_nearest_hamming_neighbors_{bits}", "query_nearest_hamming_neighbors",
+             lambda i, key=key, bits=bits: {"q": {}, "binary_string_key": key, "max_distance": bits // 8,
+                                            "from_binary_string": some_binary_strings[bits]}),
+            (f"query_n_nearest_hamming_neighbors_{bits}", "query_n_nearest_hamming_neighbors",
+             lambda i, key=key, bits=bits: {"q": {}, "binary_string_key": key,
+                                            "from_binary_string": some_binary_strings[bits], "pick_n": 10}),
+        ]
+    return specs
+
+
+def in_process_call(rpc_client, verb: str, payload: Dict):
+    """
+    The blocking_ method of verb, called the way a worker calls it
+    """
+    if verb == "query" and "page_size" in payload:
+        return rpc_client.blocking_query_page(payload["q"], payload["page_size"])
+    if verb == "append":
+        return rpc_client.blocking_append(payload["idempotency_key"], payload["doc"])
+    if verb == "append_many":
+        return rpc_client.blocking_append_many(payload["idempotency_key"], payload["docs"])
+    if verb == "update_one":
+        return rpc_client.blocking_update_one(payload["filter_q"], payload["update_doc"])
+    if verb == "bulk_update_one":
+        return rpc_client.blocking_bulk_update_one(list(map(lambda op: (op["filter_q"], op["update_doc"]),
+                                                            payload["ops"])))
+    if verb == "update_one_binary_string":
+        return rpc_client.blocking_update_one_binary_string(
+            payload["filter_q"], payload["key"], list(map(lambda c: c == "1", payload["binary_string"])))
+    if verb == "aggregate":
+        return rpc_client.blocking_aggregate(payload["pipeline"])
+    return getattr(rpc_client, f"blocking_{verb}")(**payload)
+
+
+def measure(call: Callable[[int], object], seconds: float, min_calls: int, repeat: int) -> Dict:
+    """
+    Best of repeat rounds, the least disturbed by whatever else the machine is doing
+    """
+    # Untimed, the first call may build an index or fill a cache
+    call(0)
+    best = None
+    for _ in range(repeat):
+        latencies = []
+        started_at = time.perf_counter()
+        while len(latencies) < min_calls or time.perf_counter() - started_at < seconds:
+            call_started_at = time.perf_counter()
+            call(len(latencies))
+            latencies.append(time.perf_counter() - call_started_at)
+        latencies.sort()
+        result = {
+            "calls": len(latencies),
+            "ops_per_second": len(latencies) / sum(latencies),
+            "p50_ms": latencies[len(latencies) // 2] * 1000,
+            "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        }
+        if not best or result["ops_per_second"] > best["ops_per_second"]:
+            best = result
+    return best
+
+
+def benchmark_verbs(app_module, n: int, seed: int, seconds: float, min_calls: int,
+                    repeat: int) -> Dict[str, Dict]:
+    from common.in_process_rpc_client import InProcessRpcClient
+    in_process_rpc_client = InProcessRpcClient(app_module.content_store)
+    test_client = app_module.app.test_client()
+    access_token = test_client.post("/auth", json={
+        "username": os.environ["ADMIN_USERNAME"],
+        "password": os.environ["ADMIN_PASSWORD"]
+    }).json["access_token"]
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    def http_call(verb: str, payload: Dict):
+        response = test_client.post("/apiInternal/rpc", json={"verb": verb, "metadata": {}, "payload": payload},
+                                    headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{verb} fails with HTTP status {response.status_code}, {response.get_data()}")
+        return response.get_data()
+
+    results = {}
+    # Numbered across both clients, so that the second does not append what the first already did
+    call_numbers = itertools.count()
+    for name, verb, payload_of in operations(n, seed):
+        for client_name, call in [("in_process", lambda v, p: in_process_call(in_process_rpc_client, v, p)),
+                                  ("http", http_call)]:
+            if client_name == "in_process" and verb in HTTP_ONLY_VERBS:
+                continue
+            result = measure(lambda _: call(verb, payload_of(next(call_numbers))), seconds, min_calls, repeat)
+            results[f"rpc.{client_name}.{name}"] = result
+            print(f"{'rpc.' + client_name + '.' + name:>58} {result['ops_per_second']:>10.1f} "
+                  f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}")
+    result = measure(lambda i: test_client.get(f"/api/query?group={i % GROUPS}"), seconds, min_calls, repeat)
+    results["api.query"] = result
+    print(f"{'api.query':>58} {result['ops_per_second']:>10.1f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}")
+    return results
+
+
+def benchmark_scheduler(app_module, workers: int, interval_seconds: float, seconds: float) -> Dict[str, Dict]:
+    """
+    Adds the workers, reconciles them into a BackgroundScheduler and lets them fire for a while
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from common.metrics import MetricsRegistry
+    from scheduler.reconciler import Reconciler
+    from scheduler.worker_metrics import WorkerMetrics, STATUS_SUCCEEDED
+
+    worker_ids = []
+    for w in range(workers):
+        status, message = app_module.worker_config_store.add(
+            "benchmarks.suite_fixtures", "QueryWorker", {"name": f"benchmark_{w}", "group": w % GROUPS},
+            interval_seconds
+        )
+        if not status:
+            raise RuntimeError(f"Fails to add worker, message {message}")
+        worker_ids.append(f"broccoli.worker.benchmark_{w}")
+    worker_metrics = WorkerMetrics(MetricsRegistry())
+    reconciler = Reconciler(app_module.worker_config_store, app_module.in_process_rpc_client,
+                            app_module.executor_pools, worker_metrics)
+    scheduler = BackgroundScheduler(executors=app_module.executor_pools.build())
+    worker_metrics.listen(scheduler)
+    reconciler.set_scheduler(scheduler)
+    scheduler.start()
+    try:
+        reconcile_started_at = time.perf_counter()
+        reconciler.reconcile()
+        reconcile_seconds = time.perf_counter() - reconcile_started_at
+        time.sleep(seconds)
+    finally:
+        scheduler.shutdown(wait=True)
+        for worker_id in worker_ids:
+            app_module.worker_config_store.remove(worker_id)
+
+    runs, failed, lag_seconds, run_seconds = 0, 0, [], []
+    for worker_id in worker_ids:
+        summary = worker_metrics.summary(worker_id)
+        runs += summary["runs"][STATUS_SUCCEEDED]
+        failed += summary["runs"]["failed"]
+        lag_seconds.append(summary["scheduling_lag_average_seconds"])
+        run_seconds.append(summary["runs"]["average_seconds"])
+    expected_runs = workers * seconds / interval_seconds
+    run_average_seconds = statistics.mean(run_seconds)
+    results = {
+        "scheduler.reconcile": {"ops_per_second": 1 / reconcile_seconds, "seconds": reconcile_seconds,
+                                "workers": workers},
+        "scheduler.worker_run": {"ops_per_second": 1 / run_average_seconds if run_average_seconds else 0.0,
+                                 "average_ms": run_average_seconds * 1000},
+        # How many runs the scheduler kept up with, it depends on the number of workers and is not compared
+        "scheduler.runs": {"runs": runs, "failed": failed, "expected_runs": expected_runs,
+                           "lag_average_ms": statistics.mean(lag_seconds) * 1000},
+    }
+    for name in ["scheduler.reconcile", "scheduler.worker_run"]:
+        print(f"{name:>58} {results[name]['ops_per_second']:>10.1f}")
+    print(f"{'scheduler.runs':>58} {runs} of {expected_runs:.0f} expected runs, {failed} failed, "
+          f"{results['scheduler.runs']['lag_average_ms']:.1f} ms average lag")
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], max_regression: float) -> List[str]:
+    """
+    Names of the results slower than their baseline by more than max_regression, as a fraction
+    """
+    regressions = []
+    print(f"{'compared to baseline':>58} {'before':>10} {'after':>10} {'change':>8}")
+    for name in sorted(set(results.keys()) & set(baseline.keys())):
+        if COMPARED_METRIC not in results[name] or COMPARED_METRIC not in baseline[name]:
+            continue
+        before, after = baseline[name][COMPARED_METRIC], results[name][COMPARED_METRIC]
+        change = after / before - 1 if before else 0.0
+        regressed = change < -max_regression
+        if regressed:
+            regressions.append(name)
+        print(f"{name:>58} {before:>10.1f} {after:>10.1f} {change:>+7.1%}{' REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ContentStore, RpcCore and the scheduler")
+    parser.add_argument("--documents", type=int, default=10000, help="size of the synthetic collection")
+    parser.add_argument("--seconds", type=float, default=1.0, help="time spent on each verb and client")
+    parser.add_argument("--min-calls", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="rounds of each measurement, the best one is kept")
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--worker-interval-seconds", type=float, default=1.0)
+    parser.add_argument("--scheduler-seconds", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mongodb-connection-string", help="a local mongod to run against instead of mongomock")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="largest drop in ops per second from the baseline that passes, as a fraction")
+    args = parser.parse_args()
+
+    connection_string = args.mongodb_connection_string or MOCK_CONNECTION_STRING
+    os.environ.update({
+        "MONGODB_CONNECTION_STRING": connection_string,
+        "MONGODB_DB": BENCHMARK_DB,
+        "DEFAULT_API_HANDLER_MODULE": "benchmarks.suite_fixtures",
+        "DEFAULT_API_HANDLER_CLASSNAME": "QueryApiHandler",
+    })
+    for env, value in [("ADMIN_USERNAME", "benchmark"), ("ADMIN_PASSWORD", "benchmark"),
+                       ("JWT_SECRET_KEY", "benchmark" * 4)]:
+        os.environ.setdefault(env, value)
+    patcher = None
+    if not args.mongodb_connection_string:
+        patcher = mongomock.patch(servers=(("localhost", 27017),))
+        patcher.start()
+    try:
+        # Imported only now, the app connects to MongoDB while it loads
+        import app as app_module
+        # Duplicate appends and job changes are expected here
+        for logger_name in ["content", "scheduler"]:
+            logging.getLogger(logger_name).setLevel(logging.WARNING)
+        app_module.content_store.client.drop_database(BENCHMARK_DB)
+        load_started_at = time.perf_counter()
+        load_documents(app_module.content_store.collection, args.documents, args.seed,
+                       app_module.content_store.packed_binary_strings)
+        load_seconds = time.perf_counter() - load_started_at
+        print(f"Loaded {args.documents} documents in {load_seconds:.1f} seconds")
+
+        print(f"{'benchmark':>58} {'ops/s':>10} {'p50 ms':>8} {'p95 ms':>8}")
+        results = benchmark_verbs(app_module, args.documents, args.seed, args.seconds, args.min_calls, args.repeat)
+        results.update(benchmark_scheduler(app_module, args.workers, args.worker_interval_seconds,
+                                           args.scheduler_seconds))
+        app_module.content_store.client.drop_database(BENCHMARK_DB)
+    finally:
+        if patcher:
+            patcher.stop()
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "meta": {
+                "git_commit": git_commit(),
+                "created_at": datetime.datetime.utcnow().isoformat() + "Z",
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "backend": "mongod" if args.mongodb_connection_string else "mongomock",
+                "documents": args.documents,
+                "hash_bits": HASH_BITS,
+                "seconds": args.seconds,
+                "workers": args.workers,
+                "seed": args.seed,
+                "repeat": args.repeat,
+                "load_seconds": load_seconds,
+            },
+            "results": results
+        }, f, indent=2, sort_keys=True)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["backend"] != ("mongod" if args.mongodb_connection_string else "mongomock") \
+                or baseline["meta"]["documents"] != args.documents:
+            print("Warning: the baseline ran on another backend or collection size")
+        regressions = compare(results, baseline["results"], args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} regressions past {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
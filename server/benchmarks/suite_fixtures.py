@@ -0,0 +1,33 @@
+"""
+The api handler and worker the benchmark suite loads by module and class name, as the server loads plugins
+"""
+from typing import Dict
+from broccoli_plugin_interface.api.api_handler import ApiHandler
+from broccoli_plugin_interface.rpc_client import RpcClient
+from broccoli_plugin_interface.worker_manager.work_context import WorkContext
+from broccoli_plugin_interface.worker_manager.worker import Worker
+
+
+class QueryApiHandler(ApiHandler):
+    def handle_request(self, path: str, query_params: Dict, rpc_client: RpcClient):
+        return rpc_client.blocking_query({"group": int(query_params.get("group", 0))}, limit=100)
+
+
+class QueryWorker(Worker):
+    """
+    Counts and reads a page of one group of the synthetic collection on every run
+    """
+
+    def __init__(self, name: str, group: int):
+        self.name = name
+        self.group = group
+
+    def get_id(self) -> str:
+        return self.name
+
+    def pre_work(self, context: WorkContext):
+        pass
+
+    def work(self, context: WorkContext):
+        context.rpc_client.blocking_count({"group": self.group})
+        context.rpc_client.blocking_query({"group": self.group}, limit=10, sort={"score": -1})
@@ -1,5 +1,7 @@
 import datetime
-import pytz
+
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MILLISECOND = datetime.timedelta(milliseconds=1)
 
 
 def milliseconds_to_datetime(milliseconds: int) -> datetime.datetime:
@@ -7,4 +9,8 @@ def milliseconds_to_datetime(milliseconds: int) -> datetime.datetime:
 
 
 def datetime_to_milliseconds(dt: datetime.datetime) -> int:
-    return int(dt.replace(tzinfo=pytz.utc).timestamp() * 1000)
+    # The wall time is read as UTC whatever tzinfo says. Integer arithmetic, going through a float timestamp
+    # is slower and is sometimes one millisecond short
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None)
+    return (dt - EPOCH) // ONE_MILLISECOND
@@ -1,32 +1,70 @@
-from typing import Dict, List, Optional
+from concurrent.futures import Executor
+from typing import Dict, List, Optional, Tuple
 from content.content_store import ContentStore
+from content.packed_binary_string import match_either_form, pipeline_match_either_form
 from broccoli_plugin_interface.rpc_client import RpcClient
+from broccoli_plugin_interface.thread_pool_async_rpc_client import ThreadPoolAsyncRpcClient
 
 
 class InProcessRpcClient(RpcClient):
     def __init__(self, content_store: ContentStore):
         self.content_store = content_store
 
+    def _filter(self, q: Dict) -> Dict:
+        # Filters written against the '0'/'1' strings workers read back also match the values stored packed
+        return match_either_form(q) if self.content_store.packed_binary_strings else q
+
     def blocking_query(self, q: Dict, limit: Optional[int] = None, projection: List[str] = None,
                        sort: Dict[str, int] = None, datetime_q: List[Dict] = None) -> List[Dict]:
-        return self.content_store.query(q, limit, projection, sort, datetime_q)
+        return self.content_store.query(self._filter(q), limit, projection, sort, datetime_q)
+
+    def blocking_query_page(self, q: Dict, page_size: int, resume_token: Optional[str] = None,
+                            projection: List[str] = None, sort: Dict[str, int] = None,
+                            datetime_q: List[Dict] = None) -> Tuple[List[Dict], Optional[str]]:
+        return self.content_store.query_page(self._filter(q), page_size, resume_token, projection, sort, datetime_q)
 
     def blocking_update_one(self, filter_q: Dict, update_doc: Dict):
-        self.content_store.update_one(filter_q, update_doc)
+        self.content_store.update_one(self._filter(filter_q), update_doc)
 
     def blocking_update_one_binary_string(self, filter_q: Dict, key: str, binary_string: List[bool]):
         bs = ''.join(list(map(lambda b: '1' if b else '0', binary_string)))
-        self.content_store.update_one_binary_string(filter_q, key, bs)
+        self.content_store.update_one_binary_string(self._filter(filter_q), key, bs)
+
+    def blocking_bulk_update_one(self, ops: List[Tuple[Dict, Dict]]) -> Dict[str, int]:
+        return self.content_store.bulk_update_one(list(map(lambda op: (self._filter(op[0]), op[1]), ops)))
+
+    def blocking_bulk_update_one_binary_string(self, ops: List[Tuple[Dict, str, List[bool]]]) -> Dict[str, int]:
+        return self.content_store.bulk_update_one_binary_string(list(map(
+            lambda op: (self._filter(op[0]), op[1], ''.join(list(map(lambda b: '1' if b else '0', op[2])))),
+            ops
+        )))
 
     def blocking_append(self, idempotency_key: str, doc: Dict):
         self.content_store.append(doc, idempotency_key)
 
-    def blocking_random_one(self, q: Dict, projection: List[str]) -> dict:
-        return self.content_store.random_one(q, projection)
+    def blocking_append_many(self, idempotency_key: str, docs: List[Dict]) -> List[str]:
+        return self.content_store.append_many(docs, idempotency_key)
+
+    def blocking_random_one(self, q: Dict, projection: List[str]) -> Optional[Dict]:
+        return self.content_store.random_one(self._filter(q), projection)
+
+    def blocking_random_many(self, q: Dict, n: int, projection: List[str] = None) -> List[Dict]:
+        return self.content_store.random_many(self._filter(q), n, projection)
 
     def blocking_count(self, q: Dict) -> int:
-        return self.content_store.count(q)
+        return self.content_store.count(self._filter(q))
+
+    def blocking_aggregate(self, pipeline: List[Dict], datetime_q: List[Dict] = None) -> List[Dict]:
+        if self.content_store.packed_binary_strings:
+            pipeline = pipeline_match_either_form(pipeline)
+        return self.content_store.aggregate(pipeline, datetime_q)
 
     def blocking_query_n_nearest_hamming_neighbors(self, q: Dict, binary_string_key: str, from_binary_string: str,
-                                                   pick_n: int) -> List[Dict]:
-        return self.content_store.query_n_nearest_hamming_neighbors(q, binary_string_key, from_binary_string, pick_n)
+                                                   pick_n: int, projection: List[str] = None) -> List[Dict]:
+        return self.content_store.query_n_nearest_hamming_neighbors(self._filter(q), binary_string_key,
+                                                                    from_binary_string, pick_n, projection)
+
+
+class AsyncInProcessRpcClient(ThreadPoolAsyncRpcClient):
+    def __init__(self, content_store: ContentStore, executor: Optional[Executor] = None):
+        super().__init__(InProcessRpcClient(content_store), executor)
@@ -0,0 +1,87 @@
+import json
+import datetime
+import decimal
+import orjson
+from bson import Binary, Decimal128, ObjectId
+from flask import Flask, Response
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+from werkzeug.http import http_date
+from content.packed_binary_string import from_packed, is_packed
+
+# Datetimes go through encode_default too, orjson would write them as RFC 3339 strings rather than HTTP dates
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def _encode_binary(value: Binary):
+    if is_packed(value):
+        return from_packed(value)
+    raise TypeError("Object of type Binary is not JSON serializable")
+
+
+# By exact type, a dict lookup is cheaper than a chain of isinstance for the values every document has
+_ENCODERS_BY_TYPE = {
+    ObjectId: str,
+    # As Flask's own encoder writes them, created_at is turned into milliseconds before encoding
+    datetime.datetime: http_date,
+    datetime.date: http_date,
+    Binary: _encode_binary,
+    decimal.Decimal: str,
+    Decimal128: str,
+}
+
+
+def encode_default(value):
+    """
+    Converts the values MongoDB documents hold to what the API returns: ObjectId to a string, datetime to an
+    HTTP date and packed binary strings back to '0'/'1' strings
+    """
+    encoder = _ENCODERS_BY_TYPE.get(type(value))
+    if encoder:
+        return encoder(value)
+    for value_type, encoder in _ENCODERS_BY_TYPE.items():
+        if isinstance(value, value_type):
+            return encoder(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    Encodes with orjson, falling back to the json module for what orjson refuses, such as integers over 64 bits
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        return self._dumps_bytes(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj), mimetype="application/json")
+
+    @staticmethod
+    def _dumps_bytes(obj) -> bytes:
+        try:
+            return orjson.dumps(obj, default=encode_default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return json.dumps(obj, default=encode_default, separators=(",", ":")).encode("utf-8")
+
+
+class BsonJSONProvider(DefaultJSONProvider):
+    """
+    Flask's own encoder, with the MongoDB conversions of encode_default
+    """
+    default = staticmethod(encode_default)
+
+
+JSON_PROVIDERS = {
+    "orjson": OrjsonProvider,
+    "json": BsonJSONProvider,
+}
+
+
+def set_json_provider(app: Flask, name: str):
+    if name not in JSON_PROVIDERS:
+        raise ValueError(f"Unknown json provider {name}, expects one of {list(JSON_PROVIDERS.keys())}")
+    app.json_provider_class = JSON_PROVIDERS[name]
+    app.json = JSON_PROVIDERS[name](app)
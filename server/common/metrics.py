@@ -0,0 +1,134 @@
+import bisect
+import math
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence, extra: Tuple = ()) -> str:
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(map(lambda p: f"{p[0]}=\"{_escape_label_value(p[1])}\"", pairs)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}  # type: Dict[Tuple, float]
+        self._lock = threading.Lock()
+
+    def inc(self, label_values: Sequence = (), amount: float = 1):
+        label_values = tuple(label_values)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, label_values: Sequence = ()) -> float:
+        with self._lock:
+            return self._values.get(tuple(label_values), 0)
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class _HistogramValue(object):
+    def __init__(self, n_buckets: int):
+        self.bucket_counts = [0] * n_buckets
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(object):
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(map(float, buckets))) + (math.inf,)
+        self._values = {}  # type: Dict[Tuple, _HistogramValue]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: Sequence, value: float):
+        label_values = tuple(label_values)
+        with self._lock:
+            if label_values not in self._values:
+                self._values[label_values] = _HistogramValue(len(self.buckets))
+            histogram_value = self._values[label_values]
+            histogram_value.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            histogram_value.count += 1
+            histogram_value.sum += value
+
+    def get(self, label_values: Sequence = ()) -> Tuple[int, float]:
+        """
+        Returns the count and the sum of the observations
+        """
+        with self._lock:
+            histogram_value = self._values.get(tuple(label_values))
+            return (histogram_value.count, histogram_value.sum) if histogram_value else (0, 0.0)
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, histogram_value in sorted(self._values.items()):
+                cumulative_count = 0
+                for le, bucket_count in zip(self.buckets, histogram_value.bucket_counts):
+                    cumulative_count += bucket_count
+                    labels = _format_labels(self.label_names, label_values, (("le", _format_value(le)),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative_count}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {_format_value(histogram_value.sum)}")
+                lines.append(f"{self.name}_count{labels} {histogram_value.count}")
+        return lines
+
+
+class MetricsRegistry(object):
+    """
+    Counters and histograms of the process, exposed in the Prometheus text format
+    """
+
+    def __init__(self):
+        self._metrics = {}  # type: Dict[str, object]
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.expose()
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+
+# Process-wide registry served at /apiInternal/metrics
+REGISTRY = MetricsRegistry()
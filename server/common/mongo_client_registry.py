@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+import pymongo
+from pymongo import monitoring
+from typing import Dict
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checkout_started_at = threading.local()
+        self.pool_size = 0
+        self.checked_out = 0
+        self.checkout_count = 0
+        self.checkout_failed_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "checked_out": self.checked_out,
+                "checkout_count": self.checkout_count,
+                "checkout_failed_count": self.checkout_failed_count,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "wait_seconds_average": self.wait_seconds_total / self.checkout_count if self.checkout_count else 0.0
+            }
+
+    def connection_created(self, event):
+        with self._lock:
+            self.pool_size += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.pool_size -= 1
+
+    def connection_check_out_started(self, event):
+        self._checkout_started_at.value = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failed_count += 1
+
+    def connection_checked_out(self, event):
+        started_at = getattr(self._checkout_started_at, "value", None)
+        wait_seconds = time.perf_counter() - started_at if started_at is not None else 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.checkout_count += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+# Environment variable to MongoClient keyword argument, all in integers
+POOL_OPTIONS_FROM_ENV = {
+    "MONGODB_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGODB_MIN_POOL_SIZE": "minPoolSize",
+    "MONGODB_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "MONGODB_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGODB_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGODB_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGODB_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+}
+
+_clients = {}  # type: Dict[str, pymongo.MongoClient]
+_listeners = {}  # type: Dict[str, PoolMetricsListener]
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def get_mongo_client(connection_string: str) -> pymongo.MongoClient:
+    """
+    Returns the process-wide MongoClient of a connection string, so that every store and worker context
+    share one connection pool
+    """
+    global _pid
+    with _lock:
+        # MongoClient is not fork-safe, a forked process starts over with its own clients
+        if _pid != os.getpid():
+            _clients.clear()
+            _listeners.clear()
+            _pid = os.getpid()
+        if connection_string not in _clients:
+            options = {}
+            for env, option in POOL_OPTIONS_FROM_ENV.items():
+                if os.getenv(env):
+                    options[option] = int(os.environ[env])
+            listener = PoolMetricsListener()
+            _clients[connection_string] = pymongo.MongoClient(
+                connection_string,
+                event_listeners=[listener],
+                **options
+            )
+            _listeners[connection_string] = listener
+        return _clients[connection_string]
+
+
+def get_pool_metrics() -> Dict:
+    with _lock:
+        listeners = list(_listeners.values())
+    metrics = list(map(lambda l: l.to_dict(), listeners))
+    checkout_count = sum(map(lambda m: m["checkout_count"], metrics))
+    wait_seconds_total = sum(map(lambda m: m["wait_seconds_total"], metrics))
+    return {
+        "clients": len(metrics),
+        "max_pool_size": int(os.getenv("MONGODB_MAX_POOL_SIZE", 100)),
+        "pool_size": sum(map(lambda m: m["pool_size"], metrics)),
+        "checked_out": sum(map(lambda m: m["checked_out"], metrics)),
+        "checkout_count": checkout_count,
+        "checkout_failed_count": sum(map(lambda m: m["checkout_failed_count"], metrics)),
+        "wait_seconds_total": wait_seconds_total,
+        "wait_seconds_max": max(map(lambda m: m["wait_seconds_max"], metrics), default=0.0),
+        "wait_seconds_average": wait_seconds_total / checkout_count if checkout_count else 0.0
+    }
+
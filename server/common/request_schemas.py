@@ -1,3 +1,24 @@
+WORKER_SCHEDULING_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "executor": {
+            "type": "string"
+        },
+        "max_instances": {
+            "type": "integer",
+            "minimum": 1
+        },
+        "coalesce": {
+            "type": "boolean"
+        },
+        "misfire_grace_time": {
+            "type": ["integer", "null"],
+            "minimum": 1
+        }
+    },
+    "additionalProperties": False
+}
+
 ADD_WORKER_BODY_SCHEMA = {
     "type": "object",
     "properties": {
@@ -12,7 +33,8 @@ ADD_WORKER_BODY_SCHEMA = {
         },
         "interval_seconds": {
             "type": "number"
-        }
+        },
+        "scheduling": WORKER_SCHEDULING_SCHEMA
     },
     "required": ["module", "class_name", "args", "interval_seconds"]
 }
\ No newline at end of file
@@ -0,0 +1,36 @@
+import gzip
+import brotli
+from flask import Request, Response
+
+# In the order picked when a client accepts several encodings with the same quality
+ENCODERS = {
+    "br": lambda data, level: brotli.compress(data, quality=level["br"]),
+    "gzip": lambda data, level: gzip.compress(data, compresslevel=level["gzip"]),
+}
+
+
+class ResponseCompression(object):
+    """
+    Compresses responses with brotli or gzip, as negotiated through Accept-Encoding. Streamed responses,
+    responses that are already encoded and bodies under min_bytes are sent as they are
+    """
+
+    def __init__(self, min_bytes: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.min_bytes = min_bytes
+        # Brotli's default quality of 11 costs more CPU than the bytes it saves are worth for responses
+        self.level = {"gzip": gzip_level, "br": brotli_quality}
+
+    def compress(self, request: Request, response: Response) -> Response:
+        if response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers \
+                or response.status_code < 200 or response.status_code in (204, 304):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(list(ENCODERS.keys()))
+        if not encoding or response.content_length is not None and response.content_length < self.min_bytes:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_bytes:
+            return response
+        response.set_data(ENCODERS[encoding](data, self.level))
+        response.headers["Content-Encoding"] = encoding
+        return response
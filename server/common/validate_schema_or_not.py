@@ -1,5 +1,7 @@
-from typing import Tuple
+from typing import Callable, List, Optional, Tuple
 from jsonschema import validate, ValidationError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
 
 def validate_schema_or_not(instance, schema) -> Tuple[bool, str]:
@@ -8,3 +10,99 @@ def validate_schema_or_not(instance, schema) -> Tuple[bool, str]:
         return True, ""
     except ValidationError as e:
         return False, str(e)
+
+
+# Stricter than jsonschema, 1.0 is no integer here and True no number, which only sends such payloads to jsonschema
+_TYPE_CHECKS = {
+    "object": lambda instance: type(instance) == dict,
+    "array": lambda instance: type(instance) == list,
+    "string": lambda instance: type(instance) == str,
+    "integer": lambda instance: type(instance) == int,
+    "number": lambda instance: type(instance) in (int, float),
+    "boolean": lambda instance: type(instance) == bool,
+    "null": lambda instance: instance is None
+}
+_CHECKED_KEYWORDS = {"type", "properties", "required", "items", "contains", "enum", "minimum", "minProperties",
+                     "maxProperties", "title", "description"}
+
+
+def _compile_check(schema) -> Optional[Callable[[object], bool]]:
+    """
+    A plain Python check for schemas made only of the keywords payload schemas use, None for any other schema.
+    It may reject a valid instance but never accepts an invalid one
+    """
+    if type(schema) != dict or not schema.keys() <= _CHECKED_KEYWORDS:
+        return None
+    checks = []  # type: List[Callable[[object], bool]]
+    if "type" in schema:
+        if schema["type"] not in _TYPE_CHECKS:
+            return None
+        checks.append(_TYPE_CHECKS[schema["type"]])
+    if "required" in schema:
+        required = schema["required"]
+        checks.append(lambda instance: type(instance) != dict or all(map(lambda name: name in instance, required)))
+    if "properties" in schema:
+        property_checks = []
+        for name, property_schema in schema["properties"].items():
+            property_check = _compile_check(property_schema)
+            if property_check is None:
+                return None
+            property_checks.append((name, property_check))
+        checks.append(lambda instance: type(instance) != dict or all(map(
+            lambda item: item[0] not in instance or item[1](instance[item[0]]),
+            property_checks
+        )))
+    if "items" in schema:
+        item_check = _compile_check(schema["items"])
+        if item_check is None:
+            return None
+        checks.append(lambda instance: type(instance) != list or all(map(item_check, instance)))
+    if "contains" in schema:
+        contains_check = _compile_check(schema["contains"])
+        if contains_check is None:
+            return None
+        checks.append(lambda instance: type(instance) != list or any(map(contains_check, instance)))
+    if "enum" in schema:
+        enum = schema["enum"]
+        checks.append(lambda instance: any(map(lambda value: type(value) == type(instance) and value == instance,
+                                               enum)))
+    if "minimum" in schema:
+        minimum = schema["minimum"]
+        checks.append(lambda instance: type(instance) not in (int, float) or instance >= minimum)
+    for keyword, compare in [("minProperties", lambda n, bound: n >= bound),
+                             ("maxProperties", lambda n, bound: n <= bound)]:
+        if keyword in schema:
+            checks.append(lambda instance, bound=schema[keyword], compare=compare:
+                          type(instance) != dict or compare(len(instance), bound))
+
+    def _check(instance) -> bool:
+        for check in checks:
+            if not check(instance):
+                return False
+        return True
+
+    return _check
+
+
+def compile_validator(schema) -> Callable[[object], Tuple[bool, str]]:
+    """
+    Same as validate_schema_or_not, but the schema is checked and its validator built once instead of on every call
+    """
+    validator_cls = validator_for(schema)
+    validator_cls.check_schema(schema)
+    validator = validator_cls(schema)
+
+    # Most payloads are valid, check them without jsonschema when the schema allows it
+    is_valid = _compile_check(schema) or validator.is_valid
+
+    def _validate(instance) -> Tuple[bool, str]:
+        # Errors are only collected to pick the message of an invalid instance, or to confirm a rejection
+        # of the plain check
+        if is_valid(instance):
+            return True, ""
+        error = best_match(validator.iter_errors(instance))
+        if error is None:
+            return True, ""
+        return False, str(error)
+
+    return _validate
@@ -0,0 +1,93 @@
+import datetime
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+from pymongo import ReturnDocument
+from pymongo.database import Database
+from .logging import logger
+
+
+class ContentChangeLog(object):
+    """
+    Numbered log of content writes, so that every process sharing the collection, gunicorn workers and process
+    pool workers alike, brings its hamming indexes and query cache up to date with the writes of the others.
+    A writer numbers an entry by bumping a version and then writes it, readers apply entries in version order.
+    An entry missing for longer than gap_timeout_seconds, expired or lost by a writer dying in between,
+    makes readers start over from scratch
+    """
+
+    VERSION_ID = "content"
+
+    def __init__(self, db: Database, poll_interval_seconds: float = 1.0, retention_seconds: int = 3600,
+                 gap_timeout_seconds: float = 30.0):
+        self.version_collection = db['broccoli.content_version']
+        self.collection = db['broccoli.content_changes']
+        self.collection.create_index("at", expireAfterSeconds=retention_seconds)
+        self.poll_interval_seconds = poll_interval_seconds
+        self.gap_timeout_seconds = gap_timeout_seconds
+        # Entries of this log are already applied where they are written
+        self.writer = uuid.uuid4().hex
+        self.applied_version = self.version()
+        self._polled_at = 0.0
+        # First missing version and when it was first found missing
+        self._gap = None  # type: Optional[Tuple[int, float]]
+        self._lock = threading.Lock()
+
+    def version(self) -> int:
+        document = self.version_collection.find_one({"_id": self.VERSION_ID})
+        return document["version"] if document else 0
+
+    def publish(self, ids: List, fields: Set[str], inserted: bool):
+        version = self.version_collection.find_one_and_update(
+            {"_id": self.VERSION_ID},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )["version"]
+        self.collection.insert_one({
+            "_id": version,
+            "writer": self.writer,
+            "ids": ids,
+            "fields": sorted(fields),
+            "inserted": inserted,
+            "at": datetime.datetime.utcnow()
+        })
+
+    def poll(self) -> Tuple[bool, List[Dict]]:
+        """
+        Returns whether the log is complete and the entries other writers made since the last poll, in version
+        order. Polls at most once per poll_interval_seconds and only from one thread at a time, the others get
+        no entries. When the log is not complete, everything built from the collection has to be rebuilt
+        """
+        now = time.monotonic()
+        if now - self._polled_at < self.poll_interval_seconds or not self._lock.acquire(blocking=False):
+            return True, []
+        try:
+            self._polled_at = now
+            version = self.version()
+            if version < self.applied_version:
+                logger.warning(f"Content version went back from {self.applied_version} to {version}, starting over")
+                self.applied_version = version
+                return False, []
+            if version == self.applied_version:
+                return True, []
+            entries = []
+            for entry in self.collection.find({"_id": {"$gt": self.applied_version, "$lte": version}}).sort("_id", 1):
+                if entry["_id"] != self.applied_version + 1:
+                    break
+                entries.append(entry)
+                self.applied_version = entry["_id"]
+            if self.applied_version == version:
+                self._gap = None
+            elif not self._gap or self._gap[0] != self.applied_version + 1:
+                # Usually a writer between numbering and writing its entry, waited for on the next polls
+                self._gap = (self.applied_version + 1, now)
+            elif now - self._gap[1] > self.gap_timeout_seconds:
+                logger.warning(f"Content change {self._gap[0]} is missing, starting over at version {version}")
+                self.applied_version = version
+                self._gap = None
+                return False, []
+            return True, list(filter(lambda e: e["writer"] != self.writer, entries))
+        finally:
+            self._lock.release()
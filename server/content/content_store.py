@@ -1,11 +1,30 @@
+import os
 import pymongo
 import datetime
-import random
+import base64
 import heapq
+import threading
+import time
 from functools import total_ordering
-from pymongo_schema.extract import extract_collection_schema
-from typing import Dict, List, Optional
+import bson
+from bson import ObjectId, json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import UpdateOne
+from pymongo.common import validate_ok_for_update
+from pymongo.collection import Collection
+from pymongo.cursor import Cursor
+from pymongo.errors import BulkWriteError
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 from common.datetime_utils import datetime_to_milliseconds, milliseconds_to_datetime
+from common.getenv_or_raise import getenv_or_raise
+from common.mongo_client_registry import get_mongo_client
+from .content_change_log import ContentChangeLog
+from .hamming_index import HammingIndex, is_binary_string
+from .index_manager import IndexManager
+from .packed_binary_string import from_packed, is_packed, to_int, to_packed, unpack_document
+from .query_cache import QueryCache
+from .schema_catalog import SchemaCatalog
 from .logging import logger
 
 
@@ -26,40 +45,273 @@ class ComparableQueryResult(object):
 
 
 class ContentStore(object):
-    def __init__(self, connection_string: str, db: str):
-        self.client = pymongo.MongoClient(connection_string)
+    HAMMING_NEIGHBORS_BATCH_SIZE = 1000
+    HAMMING_NEIGHBORS_FIRST_BATCH_FACTOR = 4
+    APPEND_MANY_BATCH_SIZE = 1000
+    BULK_UPDATE_BATCH_SIZE = 1000
+    BINARY_STRING_MIGRATION_BATCH_SIZE = 1000
+    DUPLICATE_KEY_ERROR_CODE = 11000
+    APPEND_INSERTED = "inserted"
+    APPEND_DUPLICATE = "duplicate"
+    APPEND_INVALID = "invalid"
+    # Scalar types whose equality filters bulk updates resolve with a single $in query, bool is left out as
+    # Python hashes True like 1 while MongoDB does not match them
+    EQUALITY_VALUE_TYPES = (str, int, float, ObjectId)
+    # Query operators an aggregation $match does not take, filters using them are resolved with one find each
+    FIND_ONLY_OPERATORS = {"$where", "$text", "$near", "$nearSphere"}
+    AGGREGATE_STAGES = {"$match", "$group", "$sort", "$limit", "$project", "$bucket", "$facet"}
+    # Operators that run JavaScript or reach other collections, refused anywhere in an aggregation pipeline
+    AGGREGATE_FORBIDDEN_OPERATORS = {"$where", "$function", "$accumulator", "$lookup", "$graphLookup", "$unionWith",
+                                     "$out", "$merge"}
+
+    def __init__(self, connection_string: str, db: str, hamming_index_enabled: bool = True,
+                 multi_index_hashing_enabled: bool = True, query_cache: Optional[QueryCache] = None,
+                 packed_binary_strings: bool = False, change_log_enabled: bool = False,
+                 change_log_poll_seconds: float = 1.0):
+        self.client = get_mongo_client(connection_string)
         self.db = self.client[db]
         self.collection = self.db['broccoli.server']
+        self.hamming_index_enabled = hamming_index_enabled
+        self.multi_index_hashing_enabled = multi_index_hashing_enabled
+        # Store binary strings packed into BSON binary, readers still get '0'/'1' strings back
+        self.packed_binary_strings = packed_binary_strings
+        self.hamming_indexes = {}  # type: Dict[str, HammingIndex]
+        self._hamming_indexes_lock = threading.Lock()
+        # _ids written under a key while its hamming index is built, reloaded once the build read the collection
+        self._hamming_index_builds = {}  # type: Dict[str, Set]
+        self._hamming_index_builds_lock = threading.Lock()
+        self.index_manager = IndexManager(self.collection, self.db['broccoli.index_usage'])
+        # One document per idempotency key and value appended, their unique _id settles concurrent appends
+        self.idempotency_claims = self.db['broccoli.idempotency_claims']
+        self.query_cache = query_cache
+        self.schema_catalog = SchemaCatalog(self.db['broccoli.schema_catalog'], self.collection)
+        # Writes of other processes reach the hamming indexes and the query cache of this one through the log
+        self.change_log_poll_seconds = change_log_poll_seconds
+        self.change_log = ContentChangeLog(self.db, change_log_poll_seconds) if change_log_enabled else None
+
+    @staticmethod
+    def from_env() -> 'ContentStore':
+        """
+        The content store configured by the environment, the same in the web processes and in worker pool processes
+        """
+        return ContentStore(
+            connection_string=getenv_or_raise("MONGODB_CONNECTION_STRING"),
+            db=getenv_or_raise("MONGODB_DB"),
+            hamming_index_enabled=os.getenv("HAMMING_INDEX_ENABLED", "true") == "true",
+            multi_index_hashing_enabled=os.getenv("MULTI_INDEX_HASHING_ENABLED", "true") == "true",
+            query_cache=QueryCache(
+                max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 1000)),
+                max_bytes=int(os.getenv("QUERY_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+                ttl_seconds=float(os.getenv("QUERY_CACHE_TTL_SECONDS", 5))
+            ) if os.getenv("QUERY_CACHE_ENABLED", "true") == "true" else None,
+            packed_binary_strings=os.getenv("PACKED_BINARY_STRINGS", "false") == "true",
+            change_log_enabled=os.getenv("CONTENT_CHANGE_LOG_ENABLED", "false") == "true",
+            change_log_poll_seconds=float(os.getenv("CONTENT_CHANGE_LOG_POLL_SECONDS", 1))
+        )
+
+    def enable_change_log(self):
+        """
+        Logs the writes of this process and reads the writes of the others from now on, once another process
+        starts sharing the collection
+        """
+        if not self.change_log:
+            self.change_log = ContentChangeLog(self.db, self.change_log_poll_seconds)
 
     def append(self, doc: Dict, idempotency_key: str):
-        if idempotency_key not in doc:
-            logger.error(f"Idempotency key {idempotency_key} is not found in payload {doc}")
-            return
+        self.append_many([doc], idempotency_key)
 
-        idempotency_value = doc[idempotency_key]
-        existing_doc_count = self.collection.count_documents({idempotency_key: idempotency_value})
-        if existing_doc_count != 0:
-            logger.info(f"Document with {idempotency_key}={idempotency_value} is already present")
-            return
+    def append_many(self, docs: List[Dict], idempotency_key: str) -> List[str]:
+        self.index_manager.record_idempotency_key(idempotency_key)
+        statuses = [self.APPEND_INVALID] * len(docs)
+        valid_indices = []
+        for i, doc in enumerate(docs):
+            if idempotency_key not in doc:
+                logger.error(f"Idempotency key {idempotency_key} is not found in payload {doc}")
+                continue
+            valid_indices.append(i)
+
+        all_inserted_docs = []
+        for start in range(0, len(valid_indices), self.APPEND_MANY_BATCH_SIZE):
+            batch_indices = valid_indices[start:start + self.APPEND_MANY_BATCH_SIZE]
+            batch_docs = list(map(lambda i: docs[i], batch_indices))
+            created_at = datetime.datetime.utcnow()
+            for doc in batch_docs:
+                doc["created_at"] = created_at
+            batch_statuses = self._upsert_many(batch_docs, idempotency_key)
+            for i, status in zip(batch_indices, batch_statuses):
+                statuses[i] = status
+            inserted_docs = [doc for doc, status in zip(batch_docs, batch_statuses) if status == self.APPEND_INSERTED]
+            if inserted_docs:
+                hamming_indexes = self._written_hamming_indexes(list(map(lambda d: d["_id"], inserted_docs)),
+                                                                set().union(*map(lambda d: d.keys(), inserted_docs)))
+                for doc in inserted_docs:
+                    self._update_hamming_indexes(doc["_id"], doc, hamming_indexes)
+                self.schema_catalog.record_documents(inserted_docs)
+                all_inserted_docs += inserted_docs
+                if self.change_log:
+                    self.change_log.publish(list(map(lambda d: d["_id"], inserted_docs)),
+                                            set().union(*map(lambda d: d.keys(), inserted_docs)), True)
+
+        # Once per call, only the cached queries the new documents may match
+        if self.query_cache and all_inserted_docs:
+            self.query_cache.invalidate_documents(all_inserted_docs)
+
+        duplicate_count = statuses.count(self.APPEND_DUPLICATE)
+        if duplicate_count:
+            logger.info(f"{duplicate_count} documents with existing {idempotency_key} are already present")
+        return statuses
+
+    def _upsert_many(self, docs: List[Dict], idempotency_key: str) -> List[str]:
+        # Values are claimed first, so that of two concurrent appends of one value only one goes on to insert.
+        # The $setOnInsert upsert then also finds documents written before claims existed or by other verbs.
+        # Claims are per idempotency key, documents appended under other keys are never held back
+        statuses = [self.APPEND_DUPLICATE] * len(docs)
+        claimed_indices = self._claim_many(docs, idempotency_key)
+        claimed_docs = list(map(lambda i: docs[i], claimed_indices))
+        if not claimed_docs:
+            return statuses
+        for doc in claimed_docs:
+            # _ids are set here so that inserted documents are told apart by _id rather than by write index
+            doc.setdefault("_id", ObjectId())
+        try:
+            result = self.collection.bulk_write(
+                list(map(
+                    lambda doc: UpdateOne({idempotency_key: doc[idempotency_key]}, {"$setOnInsert": doc},
+                                          upsert=True),
+                    claimed_docs
+                )),
+                ordered=False
+            )
+        except BulkWriteError as e:
+            # Values whose document was not written can be appended again
+            upserted_ids = set(map(lambda upserted: upserted["_id"], e.details.get("upserted", [])))
+            self._release_claims(list(filter(lambda doc: doc["_id"] not in upserted_ids, claimed_docs)),
+                                 idempotency_key)
+            raise
+        upserted_ids = set(result.upserted_ids.values())
+        for i, doc in zip(claimed_indices, claimed_docs):
+            if doc["_id"] in upserted_ids:
+                statuses[i] = self.APPEND_INSERTED
+        return statuses
 
-        # todo: insert fails?
-        doc["created_at"] = datetime.datetime.utcnow()
-        self.collection.insert(doc)
+    def _claim_many(self, docs: List[Dict], idempotency_key: str) -> List[int]:
+        """
+        Indices of the documents whose idempotency value was claimed by this call
+        """
+        claimed = [True] * len(docs)
+        try:
+            self.idempotency_claims.insert_many(
+                list(map(lambda doc: {"_id": ContentStore._claim_id(doc, idempotency_key)}, docs)),
+                ordered=False
+            )
+        except BulkWriteError as e:
+            for write_error in e.details["writeErrors"]:
+                if write_error["code"] != self.DUPLICATE_KEY_ERROR_CODE:
+                    raise
+                claimed[write_error["index"]] = False
+        return [i for i, is_claimed in enumerate(claimed) if is_claimed]
+
+    def _release_claims(self, docs: List[Dict], idempotency_key: str):
+        if docs:
+            self.idempotency_claims.delete_many({
+                "_id": {"$in": list(map(lambda doc: ContentStore._claim_id(doc, idempotency_key), docs))}
+            })
+
+    @staticmethod
+    def _claim_id(doc: Dict, idempotency_key: str) -> Dict:
+        return {"key": idempotency_key, "value": doc[idempotency_key]}
 
     def query(self, q: Dict, limit: Optional[int] = None, projection: Optional[List[str]] = None,
-              sort: Optional[Dict[str, int]] = None, datetime_q: Optional[List[Dict]] = None) -> List[Dict]:
+              sort: Optional[Dict[str, int]] = None, datetime_q: Optional[List[Dict]] = None,
+              raw: bool = False) -> List[Dict]:
+        """
+        With raw, documents are returned as read from MongoDB, with ObjectId, datetime and packed binary string
+        values left for the json encoder to convert
+        """
+        if not self.query_cache:
+            return list(self.iter_query(q, limit, projection, sort, datetime_q, raw=raw))
+        self._apply_changes()
+        # Fingerprint before _find, which adds datetime_q and default projections in place
+        key = QueryCache.fingerprint(q, limit, projection, sort, datetime_q)
+        fields = QueryCache.dependent_fields(q, projection, sort)
+        documents = self.query_cache.get_or_load(
+            key,
+            fields,
+            lambda: list(self.iter_query(q, limit, projection, sort, datetime_q, raw=True)),
+            q
+        )
+        return documents if raw else list(map(ContentStore._to_json_document, documents))
+
+    def iter_query(self, q: Dict, limit: Optional[int] = None, projection: Optional[List[str]] = None,
+                   sort: Optional[Dict[str, int]] = None, datetime_q: Optional[List[Dict]] = None,
+                   batch_size: Optional[int] = None, raw: bool = False) -> Iterator[Dict]:
+        cursor = self._find(q, limit, projection, sort, datetime_q, batch_size=batch_size)
+        return cursor if raw else map(ContentStore._to_json_document, cursor)
+
+    def iter_query_bson(self, q: Dict, limit: Optional[int] = None, projection: Optional[List[str]] = None,
+                        sort: Optional[Dict[str, int]] = None, datetime_q: Optional[List[Dict]] = None,
+                        batch_size: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Same documents as iter_query, each as the BSON bytes MongoDB sent, never decoded into Python objects.
+        Documents keep their ObjectId, datetime and packed binary string values
+        """
+        try:
+            raw_collection = self.collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+        except NotImplementedError:
+            # Stand-ins such as mongomock only return dicts, which are encoded back
+            cursor = self._find(q, limit, projection, sort, datetime_q, batch_size=batch_size)
+            return map(bson.encode, cursor)
+        cursor = self._find(q, limit, projection, sort, datetime_q, collection=raw_collection, batch_size=batch_size)
+        return map(lambda document: document.raw, cursor)
+
+    def query_page(self, q: Dict, page_size: int, resume_token: Optional[str] = None,
+                   projection: Optional[List[str]] = None, sort: Optional[Dict[str, int]] = None,
+                   datetime_q: Optional[List[Dict]] = None, raw: bool = False) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Returns one page of documents and an opaque token to resume after its last document, or None for the
+        last page. Pages are ordered by sort and then _id, and resume from the sort key values of the last
+        document, so a page costs the same no matter how deep it is
+        """
+        sort_keys = list((sort or {}).items())
+        if "_id" not in (sort or {}):
+            sort_keys.append(("_id", pymongo.ASCENDING))
+        if resume_token:
+            after_q = ContentStore._after_sort_values(sort_keys, ContentStore._decode_resume_token(resume_token))
+            q = {"$and": [q, after_q]} if q else after_q
+        fetch_projection = None
+        if projection:
+            fetch_projection = projection + list(map(lambda k: k[0], sort_keys))
+        self.index_manager.record_sort(sort)
+        cursor = self._find(q, None, fetch_projection, None, datetime_q).sort(sort_keys).limit(page_size + 1)
+
+        documents = list(cursor)
+        next_resume_token = None
+        if len(documents) > page_size:
+            documents = documents[:page_size]
+            last_values = list(map(lambda k: ContentStore._path_value(documents[-1], k[0]), sort_keys))
+            next_resume_token = ContentStore._encode_resume_token(last_values)
+        if projection:
+            # A dotted projection like a.b comes back under a
+            kept_keys = set(map(lambda k: k.split(".")[0], projection + ["_id", "created_at"]))
+            documents = list(map(lambda d: {k: v for k, v in d.items() if k in kept_keys}, documents))
+        return (documents if raw else list(map(ContentStore._to_json_document, documents))), next_resume_token
+
+    def _find(self, q: Dict, limit: Optional[int], projection: Optional[List[str]], sort: Optional[Dict[str, int]],
+              datetime_q: Optional[List[Dict]], collection: Optional[Collection] = None,
+              batch_size: Optional[int] = None) -> Cursor:
         # Append datetime query
         if datetime_q:
-            for qd in datetime_q:
-                q[qd["key"]] = {
-                    "$" + qd["op"]: milliseconds_to_datetime(qd["value"])
-                }
+            q.update(ContentStore._datetime_filter(datetime_q))
+        self.index_manager.record_filter(q)
+        self.index_manager.record_sort(sort)
 
         # Append default projections
         if projection:
             projection += ["_id", "created_at"]
         # todo: find fails?
-        cursor = self.collection.find(q, projection=projection)
+        cursor = (collection or self.collection).find(q, projection=projection)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
 
         # Append limit
         if limit:
@@ -69,34 +321,322 @@ class ContentStore(object):
         if sort:
             for sort_key, sort_order in sort.items():
                 cursor = cursor.sort(sort_key, sort_order)
+        return cursor
 
-        res = []
-        for document in cursor:
-            document["_id"] = str(document["_id"])
-            document["created_at"] = datetime_to_milliseconds(document["created_at"])
-            res.append(document)
-        return res
+    @staticmethod
+    def _datetime_filter(datetime_q: List[Dict]) -> Dict:
+        return {qd["key"]: {"$" + qd["op"]: milliseconds_to_datetime(qd["value"])} for qd in datetime_q}
+
+    def aggregate(self, pipeline: List[Dict], datetime_q: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        Runs an aggregation pipeline made of AGGREGATE_STAGES, with datetime_q matched first as query does.
+        Dates in the results come back as milliseconds and ObjectIds as strings. To bucket by date, group by
+        {"$toLong": "$created_at"} with boundaries in milliseconds
+        """
+        ContentStore._validate_pipeline(pipeline, ContentStore.AGGREGATE_STAGES)
+        if datetime_q:
+            pipeline = [{"$match": ContentStore._datetime_filter(datetime_q)}] + pipeline
+        if pipeline and "$match" in pipeline[0]:
+            self.index_manager.record_filter(pipeline[0]["$match"])
+        return list(map(ContentStore._to_json_value, self.collection.aggregate(pipeline)))
+
+    @staticmethod
+    def _validate_pipeline(pipeline: List[Dict], stages: Set[str]):
+        for stage in pipeline:
+            if type(stage) != dict or len(stage) != 1:
+                raise ValueError(f"Pipeline stage {stage} must be an object with exactly one key")
+            name, spec = next(iter(stage.items()))
+            if name not in stages:
+                raise ValueError(f"Pipeline stage {name} is not allowed, expects one of {sorted(stages)}")
+            if name == "$facet":
+                if type(spec) != dict:
+                    raise ValueError("$facet expects an object of pipelines")
+                for facet_pipeline in spec.values():
+                    if type(facet_pipeline) != list:
+                        raise ValueError("$facet expects an object of pipelines")
+                    # MongoDB does not nest $facet either
+                    ContentStore._validate_pipeline(facet_pipeline, stages - {"$facet"})
+            else:
+                ContentStore._validate_operators(spec)
+
+    @staticmethod
+    def _validate_operators(value):
+        if type(value) == dict:
+            for key, v in value.items():
+                if key in ContentStore.AGGREGATE_FORBIDDEN_OPERATORS:
+                    raise ValueError(f"Operator {key} is not allowed in a pipeline")
+                ContentStore._validate_operators(v)
+        elif type(value) == list:
+            for v in value:
+                ContentStore._validate_operators(v)
+
+    @staticmethod
+    def _to_json_value(value):
+        if isinstance(value, dict):
+            return {k: ContentStore._to_json_value(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return list(map(ContentStore._to_json_value, value))
+        if isinstance(value, ObjectId):
+            return str(value)
+        if isinstance(value, datetime.datetime):
+            return datetime_to_milliseconds(value)
+        if is_packed(value):
+            return from_packed(value)
+        return value
+
+    @staticmethod
+    def _to_json_document(document: Dict) -> Dict:
+        document["_id"] = str(document["_id"])
+        document["created_at"] = datetime_to_milliseconds(document["created_at"])
+        return unpack_document(document)
+
+    @staticmethod
+    def created_at_to_milliseconds(document: Dict) -> Dict:
+        """
+        A raw document with created_at in milliseconds, as the API returns it, copied so that cached documents
+        stay raw. Its other values are left for the json encoder
+        """
+        if type(document.get("created_at")) != datetime.datetime:
+            return document
+        return dict(document, created_at=datetime_to_milliseconds(document["created_at"]))
+
+    @staticmethod
+    def _path_value(document: Dict, path: str):
+        """
+        The value at a dotted path like a.b, None when missing as MongoDB sorts it
+        """
+        value = document
+        for key in path.split("."):
+            if type(value) != dict:
+                return None
+            value = value.get(key)
+        return value
+
+    @staticmethod
+    def _encode_resume_token(last_values: List) -> str:
+        return base64.urlsafe_b64encode(json_util.dumps(last_values).encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def _decode_resume_token(resume_token: str) -> List:
+        try:
+            last_values = json_util.loads(base64.urlsafe_b64decode(resume_token.encode("ascii")).decode("utf-8"))
+        except (ValueError, TypeError):
+            raise ValueError(f"Invalid resume token {resume_token}")
+        if type(last_values) != list:
+            raise ValueError(f"Invalid resume token {resume_token}")
+        return last_values
+
+    @staticmethod
+    def _after_sort_values(sort_keys: List[Tuple[str, int]], last_values: List) -> Dict:
+        if len(sort_keys) != len(last_values):
+            raise ValueError("Resume token does not match the sort of the query")
+        # (k1, k2, ...) > (v1, v2, ...) in sort order, expanded into one clause per sort key. Null and missing
+        # values sort before every other value, and $gt or $lt never match across types, so they get their own
+        clauses = []
+        for i, (sort_key, sort_order) in enumerate(sort_keys):
+            clause = {}
+            for (previous_key, _), previous_value in zip(sort_keys[:i], last_values[:i]):
+                clause[previous_key] = previous_value
+            value = last_values[i]
+            if value is None:
+                # Descending, nothing comes after the nulls
+                if sort_order > 0:
+                    clauses.append({**clause, sort_key: {"$exists": True, "$ne": None}})
+            elif sort_order > 0:
+                clauses.append({**clause, sort_key: {"$gt": value}})
+            else:
+                clauses.append({**clause, sort_key: {"$lt": value}})
+                clauses.append({**clause, sort_key: None})
+        return {"$or": clauses}
 
     def update_one(self, filter_q: Dict, update_doc: Dict):
-        existing_doc_count = self.collection.count_documents(filter_q)
-        if existing_doc_count == 0:
+        self.index_manager.record_filter(filter_q)
+        existing_docs = list(self.collection.find(filter_q, projection=["_id"]).limit(2))
+        if len(existing_docs) == 0:
             logger.info(f"Document with query {filter_q} does not exist")
             return
 
-        if existing_doc_count > 1:
+        if len(existing_docs) > 1:
             logger.info(f"More than one document with query {filter_q} exists")
             return
 
         # todo: update_one fails
-        self.collection.update_one(filter_q, update_doc, upsert=False)
+        _id = existing_docs[0]["_id"]
+        self.collection.update_one({"_id": _id}, update_doc, upsert=False)
+        self._after_updates([(_id, update_doc)])
+
+    def bulk_update_one(self, ops: List[Tuple[Dict, Dict]]) -> Dict[str, int]:
+        """
+        Applies every (filter_q, update_doc) like update_one, in one unordered bulk write per batch.
+        Operations whose filter matches no document or more than one are rejected
+        """
+        counts = {"matched": 0, "modified": 0, "rejected": 0}
+        for start in range(0, len(ops), self.BULK_UPDATE_BATCH_SIZE):
+            batch = ops[start:start + self.BULK_UPDATE_BATCH_SIZE]
+            for filter_q, _ in batch:
+                self.index_manager.record_filter(filter_q)
+            ids = self._unique_match_ids(list(map(lambda op: op[0], batch)))
+            writes = []
+            updates = []
+            for (filter_q, update_doc), _id in zip(batch, ids):
+                if _id is None:
+                    counts["rejected"] += 1
+                    continue
+                try:
+                    validate_ok_for_update(update_doc)
+                except (TypeError, ValueError) as e:
+                    logger.info(f"Invalid update document {update_doc}, message {e}")
+                    counts["rejected"] += 1
+                    continue
+                writes.append(UpdateOne({"_id": _id}, update_doc))
+                updates.append((_id, update_doc))
+            if not writes:
+                continue
+            try:
+                result = self.collection.bulk_write(writes, ordered=False)
+                counts["matched"] += result.matched_count
+                counts["modified"] += result.modified_count
+            except BulkWriteError as e:
+                counts["matched"] += e.details["nMatched"]
+                counts["modified"] += e.details["nModified"]
+                failed_indices = set(map(lambda write_error: write_error["index"], e.details["writeErrors"]))
+                counts["rejected"] += len(failed_indices)
+                updates = [update for i, update in enumerate(updates) if i not in failed_indices]
+            self._after_updates(updates)
+        return counts
+
+    def bulk_update_one_binary_string(self, ops: List[Tuple[Dict, str, str]]) -> Dict[str, int]:
+        valid_ops = []
+        rejected = 0
+        for filter_q, key, binary_string in ops:
+            if not ContentStore._check_if_string_is_binary(binary_string):
+                rejected += 1
+                continue
+            valid_ops.append((filter_q, {"$set": {key: self._stored_binary_string(binary_string)}}))
+        counts = self.bulk_update_one(valid_ops)
+        counts["rejected"] += rejected
+        return counts
+
+    def _unique_match_ids(self, filters: List[Dict]) -> List:
+        """
+        The _id of the only document each filter matches, or None when it matches none or several
+        """
+        field = ContentStore._single_equality_field(filters)
+        if not field and ContentStore._contains_operators(filters, self.FIND_ONLY_OPERATORS):
+            return list(map(
+                lambda f: ContentStore._only_id(list(map(
+                    lambda d: d["_id"],
+                    self.collection.find(f, projection=["_id"]).limit(2)
+                ))),
+                filters
+            ))
+        if not field:
+            # Any other filters are answered by one aggregation, the $or can use indexes and each branch of the
+            # $facet keeps the first two of the matched documents its filter matches
+            facets = {}
+            for i, filter_q in enumerate(filters):
+                facets[str(i)] = [{"$match": filter_q}, {"$limit": 2}, {"$project": {"_id": 1}}]
+            result = next(self.collection.aggregate([{"$match": {"$or": filters}}, {"$facet": facets}]))
+            return list(map(lambda i: ContentStore._only_id(list(map(lambda d: d["_id"], result[str(i)]))),
+                            range(len(filters))))
+        # Filters like {field: value} are all answered by a single $in query
+        values = set(map(lambda f: f[field], filters))
+        ids_by_value = {}  # type: Dict[object, Set]
+        for document in self.collection.find({field: {"$in": list(values)}}, projection=[field]):
+            document_values = document.get(field)
+            # An equality filter also matches documents whose array contains the value
+            if type(document_values) != list:
+                document_values = [document_values]
+            for value in document_values:
+                if type(value) in self.EQUALITY_VALUE_TYPES and value in values:
+                    ids_by_value.setdefault(value, set()).add(document["_id"])
+        return list(map(lambda f: ContentStore._only_id(list(ids_by_value.get(f[field], []))), filters))
+
+    @staticmethod
+    def _contains_operators(value, operators: Set[str]) -> bool:
+        if type(value) == dict:
+            return any(map(lambda item: item[0] in operators or ContentStore._contains_operators(item[1], operators),
+                           value.items()))
+        if type(value) == list:
+            return any(map(lambda v: ContentStore._contains_operators(v, operators), value))
+        return False
+
+    @staticmethod
+    def _only_id(ids: List):
+        return ids[0] if len(ids) == 1 else None
+
+    @staticmethod
+    def _single_equality_field(filters: List[Dict]) -> Optional[str]:
+        fields = set()
+        for filter_q in filters:
+            if len(filter_q) != 1:
+                return None
+            field, value = next(iter(filter_q.items()))
+            if field.startswith("$") or "." in field or type(value) not in ContentStore.EQUALITY_VALUE_TYPES:
+                return None
+            fields.add(field)
+        return fields.pop() if len(fields) == 1 else None
+
+    def _after_updates(self, updates: List[Tuple[object, Dict]]):
+        """
+        Keeps the schema catalog, the query cache and the hamming indexes in step with updated documents
+        """
+        updated_keys_by_id = {}
+        for _id, update_doc in updates:
+            self.schema_catalog.record_update(update_doc)
+            updated_keys_by_id[_id] = updated_keys_by_id.get(_id, set()) | self._updated_keys(update_doc)
+        updated_keys = set().union(*updated_keys_by_id.values())
+        if self.query_cache and updated_keys:
+            self.query_cache.invalidate_fields(updated_keys)
+        if self.change_log and updated_keys:
+            self.change_log.publish(list(updated_keys_by_id.keys()), updated_keys, False)
+
+        hamming_indexes = self._written_hamming_indexes(list(updated_keys_by_id.keys()), updated_keys)
+        if hamming_indexes:
+            ids = [_id for _id, keys in updated_keys_by_id.items() if keys & hamming_indexes.keys()]
+            self._reload_hamming_indexes(ids, hamming_indexes)
+
+    def _reload_hamming_indexes(self, ids: List, hamming_indexes: Dict[str, HammingIndex]):
+        for document in self.collection.find({"_id": {"$in": ids}}, projection=list(hamming_indexes.keys())):
+            self._update_hamming_indexes(document["_id"], document, hamming_indexes)
+
+    def _written_hamming_indexes(self, ids: List, keys: Set[str]) -> Dict[str, HammingIndex]:
+        """
+        The built hamming indexes of the keys written to, for the documents to be updated in. The _ids written to
+        a key whose index is being built are kept for the build to reload
+        """
+        with self._hamming_index_builds_lock:
+            for key in keys & self._hamming_index_builds.keys():
+                self._hamming_index_builds[key].update(ids)
+            hamming_indexes = dict(map(lambda key: (key, self.hamming_indexes.get(key)), keys))
+        return dict(filter(lambda item: item[1] is not None, hamming_indexes.items()))
+
+    def _apply_changes(self):
+        """
+        Brings the hamming indexes and the query cache up to date with the writes of other processes
+        """
+        if not self.change_log:
+            return
+        complete, changes = self.change_log.poll()
+        if not complete:
+            with self._hamming_indexes_lock:
+                self.hamming_indexes.clear()
+            if self.query_cache:
+                self.query_cache.invalidate_all()
+            return
+        for change in changes:
+            fields = set(change["fields"])
+            if self.query_cache and self.query_cache.stats()["entries"]:
+                if change["inserted"]:
+                    self.query_cache.invalidate_documents(list(self.collection.find({"_id": {"$in": change["ids"]}})))
+                else:
+                    self.query_cache.invalidate_fields(fields)
+            hamming_indexes = self._written_hamming_indexes(change["ids"], fields)
+            if hamming_indexes:
+                self._reload_hamming_indexes(change["ids"], hamming_indexes)
 
     def schema(self) -> List[str]:
-        field_names = []
-        extracted_schema = extract_collection_schema(self.collection)["object"]
-        for field_name, _ in extracted_schema.items():
-            if field_name != "_id":
-                field_names.append(field_name)
-        return field_names
+        return self.schema_catalog.fields()
 
     def update_one_binary_string(self, filter_q: Dict, key: str, binary_string: str):
         if not ContentStore._check_if_string_is_binary(binary_string):
@@ -104,18 +644,65 @@ class ContentStore(object):
             return
         self.update_one(filter_q, {
             "$set": {
-                key: binary_string
+                key: self._stored_binary_string(binary_string)
             }
         })
 
+    def _stored_binary_string(self, binary_string: str):
+        return to_packed(binary_string) if self.packed_binary_strings else binary_string
+
+    def migrate_binary_strings(self, key: str, pause_seconds: float = 0) -> int:
+        """
+        Packs the '0'/'1' strings already stored under key, one batch at a time with a pause in between
+        so that it can run next to live traffic. A document written meanwhile is left as written.
+        Returns the number of documents packed
+        """
+        migrated = 0
+        last_id = None
+        while True:
+            q = {key: {"$type": "string"}}
+            if last_id is not None:
+                q["_id"] = {"$gt": last_id}
+            documents = list(self.collection.find(q, projection=[key]).sort("_id", pymongo.ASCENDING)
+                             .limit(self.BINARY_STRING_MIGRATION_BATCH_SIZE))
+            if not documents:
+                break
+            last_id = documents[-1]["_id"]
+            packed_documents = list(map(
+                lambda d: {"_id": d["_id"], key: to_packed(d[key]), "from": d[key]},
+                filter(lambda d: is_binary_string(d[key]), documents)
+            ))
+            if packed_documents:
+                self.schema_catalog.record_documents(map(lambda d: {key: d[key]}, packed_documents[:1]))
+                migrated += self.collection.bulk_write(list(map(
+                    lambda d: UpdateOne({"_id": d["_id"], key: d["from"]}, {"$set": {key: d[key]}}),
+                    packed_documents
+                )), ordered=False).modified_count
+            if pause_seconds:
+                time.sleep(pause_seconds)
+        logger.info(f"Packed {migrated} binary strings under {key}")
+        # Cached results and hamming indexes hold the same bits in either form, neither needs to change
+        return migrated
+
+    def binary_string_storage(self, key: str) -> Dict[str, int]:
+        return {
+            "string": self.collection.count_documents({key: {"$type": "string"}}),
+            "packed": self.collection.count_documents({key: {"$type": "binData"}})
+        }
+
     def query_nearest_hamming_neighbors(self, q: Dict, binary_string_key: str, from_binary_string: str,
                                         max_distance: int) -> List[Dict]:
-        # todo: use a metric tree
         # todo: various failure case here
         if not ContentStore._check_if_string_is_binary(from_binary_string):
             return []
+        if self.hamming_index_enabled:
+            self._apply_changes()
+            hit_ids = self._hamming_index(binary_string_key).within(from_binary_string, max_distance)
+            if not hit_ids:
+                return []
+            return list(self.iter_query(ContentStore._restrict_to_ids(q, hit_ids)))
         results = []
-        for q_result in self.query(q, limit=None):
+        for q_result in self.iter_query(q):
             if not ContentStore._check_if_q_result_has_valid_binary(q_result, binary_string_key, from_binary_string):
                 continue
             q_binary_string = q_result[binary_string_key]
@@ -125,25 +712,124 @@ class ContentStore(object):
         return results
 
     def query_n_nearest_hamming_neighbors(self, q: Dict, binary_string_key: str, from_binary_string: str,
-                                          pick_n: int) -> List[Dict]:
-        # todo: use a metric tree
+                                          pick_n: int, projection: Optional[List[str]] = None) -> List[Dict]:
         if not ContentStore._check_if_string_is_binary(from_binary_string):
             logger.info(f"from_binary_string {from_binary_string} is not a 01 string")
             return []
-        q_results = self.query(q, limit=None)
-        if len(q_results) < pick_n:
+        if pick_n <= 0:
+            return []
+        self.index_manager.record_filter(q)
+        if self.hamming_index_enabled:
+            self._apply_changes()
+            winners = self._n_nearest_hamming_ids_from_index(q, binary_string_key, from_binary_string, pick_n)
+        else:
+            winners = self._n_nearest_hamming_ids_from_cursor(q, binary_string_key, from_binary_string, pick_n)
+        if not winners:
             return []
+
+        # Only the winners are fetched in full, keeping the order of a heap on negated distance
+        documents = {}
+        winner_ids = list(map(lambda w: w[0], winners))
+        for document in self.iter_query(ContentStore._restrict_to_ids({}, winner_ids), projection=projection):
+            documents[document["_id"]] = document
         results = []
-        heapq.heapify(results)
-        for q_result in q_results:
-            if not ContentStore._check_if_q_result_has_valid_binary(q_result, binary_string_key, from_binary_string):
+        for _id, distance in winners:
+            if str(_id) in documents:
+                heapq.heappush(results, ComparableQueryResult(-distance, documents[str(_id)]))
+        return list(map(lambda h_item: h_item.q_result, results))
+
+    def _n_nearest_hamming_ids_from_index(self, q: Dict, binary_string_key: str, from_binary_string: str,
+                                          pick_n: int) -> List[Tuple]:
+        # Walk the candidates from nearest to farthest and keep the first pick_n that also match q. Batches start
+        # at a few times pick_n and double, so a selective q costs a few more round trips instead of large $in
+        hamming_index = self._hamming_index(binary_string_key)
+        winners = []
+        first_batch_size = min(pick_n * self.HAMMING_NEIGHBORS_FIRST_BATCH_FACTOR, self.HAMMING_NEIGHBORS_BATCH_SIZE)
+        for batch in hamming_index.iter_nearest(from_binary_string, first_batch_size,
+                                                self.HAMMING_NEIGHBORS_BATCH_SIZE):
+            if batch and not q:
+                # Every indexed document matches, the winners are fetched in full afterwards anyway
+                winners += batch
+            elif batch:
+                batch_ids = list(map(lambda c: c[0], batch))
+                matched_ids = set(map(
+                    lambda d: d["_id"],
+                    self.collection.find(ContentStore._restrict_to_ids(q, batch_ids), projection=["_id"])
+                ))
+                winners += list(filter(lambda c: c[0] in matched_ids, batch))
+            if len(winners) >= pick_n:
+                break
+        return winners[:pick_n]
+
+    def _n_nearest_hamming_ids_from_cursor(self, q: Dict, binary_string_key: str, from_binary_string: str,
+                                           pick_n: int) -> List[Tuple]:
+        # Stream only _id and the binary string through a heap of at most pick_n items
+        from_int, from_length = to_int(from_binary_string)
+        cursor = self.collection.find(
+            {"$and": [q, {binary_string_key: {"$exists": True}}]},
+            projection=[binary_string_key]
+        ).batch_size(self.HAMMING_NEIGHBORS_BATCH_SIZE)
+        results = []
+        for document in cursor:
+            q_int_and_length = to_int(document[binary_string_key])
+            if not q_int_and_length or q_int_and_length[1] != from_length:
                 continue
-            q_binary_string = q_result[binary_string_key]
-            distance = ContentStore._compute_binary_hamming_distance(q_binary_string, from_binary_string)
-            heapq.heappush(results, ComparableQueryResult(-distance, q_result))
+            distance = bin(q_int_and_length[0] ^ from_int).count("1")
+            heapq.heappush(results, ComparableQueryResult(-distance, document["_id"]))
             if len(results) > pick_n:
                 heapq.heappop(results)
-        return list(map(lambda h_item: h_item.q_result, results))
+        return list(map(lambda h_item: (h_item.q_result, -h_item.key), results))
+
+    def _hamming_index(self, binary_string_key: str) -> HammingIndex:
+        with self._hamming_indexes_lock:
+            hamming_index = self.hamming_indexes.get(binary_string_key)
+            if hamming_index is not None:
+                return hamming_index
+            logger.info(f"Building hamming index for {binary_string_key}")
+            hamming_index = HammingIndex(binary_string_key, self.multi_index_hashing_enabled)
+            with self._hamming_index_builds_lock:
+                self._hamming_index_builds[binary_string_key] = set()
+            try:
+                cursor = self.collection.find({binary_string_key: {"$exists": True}}, projection=[binary_string_key])
+                for document in cursor:
+                    hamming_index.add(document["_id"], document[binary_string_key])
+            except Exception:
+                with self._hamming_index_builds_lock:
+                    self._hamming_index_builds.pop(binary_string_key)
+                raise
+            # Writes from now on find the index, the ones made while the collection was read are reloaded
+            with self._hamming_index_builds_lock:
+                self.hamming_indexes[binary_string_key] = hamming_index
+                written_ids = self._hamming_index_builds.pop(binary_string_key)
+            if written_ids:
+                self._reload_hamming_indexes(list(written_ids), {binary_string_key: hamming_index})
+            logger.info(f"Built hamming index for {binary_string_key} with {len(hamming_index)} documents")
+            return hamming_index
+
+    def _update_hamming_indexes(self, _id, doc: Optional[Dict], hamming_indexes: Dict[str, HammingIndex]):
+        for binary_string_key, hamming_index in hamming_indexes.items():
+            if doc and binary_string_key in doc:
+                hamming_index.add(_id, doc[binary_string_key])
+            else:
+                hamming_index.remove(_id)
+
+    @staticmethod
+    def _updated_keys(update_doc: Dict) -> Set[str]:
+        keys = set()
+        for operator, operator_doc in update_doc.items():
+            if type(operator_doc) == dict:
+                keys |= set(map(lambda path: path.split(".")[0], operator_doc.keys()))
+                # $rename also writes to the new field names
+                if operator == "$rename":
+                    keys |= set(map(lambda path: str(path).split(".")[0], operator_doc.values()))
+        return keys
+
+    @staticmethod
+    def _restrict_to_ids(q: Dict, ids: List) -> Dict:
+        id_q = {"_id": {"$in": ids}}
+        if not q:
+            return id_q
+        return {"$and": [q, id_q]}
 
     @staticmethod
     def _check_if_string_is_binary(string: str) -> bool:
@@ -174,10 +860,28 @@ class ContentStore(object):
                 distance += 1
         return distance
 
-    def random_one(self, q: Dict, projection: List[str]) -> Dict:
-        documents = self.query(q, projection=projection)
-        random_index = random.randint(0, len(documents) - 1)
-        return documents[random_index]
+    def random_one(self, q: Dict, projection: List[str]) -> Optional[Dict]:
+        documents = self.random_many(q, 1, projection)
+        return documents[0] if documents else None
+
+    def random_many(self, q: Dict, n: int, projection: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Up to n distinct random documents matching q, sampled by the server. With an empty q, $sample is the
+        first stage and reads n random documents without scanning the collection. Otherwise $sample follows
+        the $match, and the server reads every matching document, through an index on q when there is one,
+        to sample among them, so the cost grows with the number of matching documents
+        """
+        self.index_manager.record_filter(q)
+        pipeline = [{"$match": q}] if q else []
+        pipeline.append({"$sample": {"size": n}})
+        if projection:
+            pipeline.append({"$project": dict.fromkeys(projection + ["_id", "created_at"], 1)})
+        # $sample may return a document more than once
+        documents = {}
+        for document in self.collection.aggregate(pipeline):
+            documents.setdefault(document["_id"], document)
+        return list(map(ContentStore._to_json_document, documents.values()))
 
     def count(self, q: Dict) -> int:
+        self.index_manager.record_filter(q)
         return self.collection.count_documents(q)
@@ -0,0 +1,246 @@
+import threading
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Tuple
+from .multi_index_hashing import MultiIndexHashing
+from .packed_binary_string import is_packed, packed_bytes
+
+WORD_BITS = 64
+
+if hasattr(np, "bitwise_count"):
+    def _popcount_rows(words: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount_rows(words: np.ndarray) -> np.ndarray:
+        return _POPCOUNT_TABLE[words.view(np.uint8)].reshape(words.shape[0], -1).sum(axis=1, dtype=np.int64)
+
+
+def is_binary_string(string) -> bool:
+    return isinstance(string, str) and set(string) <= set("01")
+
+
+def pack_binary_string(binary_string: str) -> np.ndarray:
+    """
+    Packs a '0'/'1' string into uint64 words, zero padded to a multiple of 64 bits.
+    Padding bits are zero for every packed string so they never contribute to a distance
+    """
+    bits = np.frombuffer(binary_string.encode("ascii"), dtype=np.uint8) - ord("0")
+    return pack_bytes(np.packbits(bits).tobytes(), len(binary_string))
+
+
+def pack_bytes(data: bytes, bit_length: int) -> np.ndarray:
+    """
+    Packs bits already packed into bytes, most significant first, into uint64 words like pack_binary_string
+    """
+    n_words = (bit_length + WORD_BITS - 1) // WORD_BITS
+    padded = np.zeros(n_words * 8, dtype=np.uint8)
+    padded[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+    if bit_length % 8:
+        # Unused low bits of the last byte are not guaranteed to be zero
+        padded[bit_length // 8] &= (0xff << (8 - bit_length % 8)) & 0xff
+    return padded.view(np.uint64)
+
+
+class _PackedBucket(object):
+    """
+    Packed hashes of one bit length. Rows keep insertion order, removed rows are tombstoned
+    and compacted away once they make up half of the bucket
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, bit_length: int, multi_index_hashing: bool):
+        self.bit_length = bit_length
+        self.multi_index = MultiIndexHashing(bit_length) if multi_index_hashing else None
+        self.n_words = (bit_length + WORD_BITS - 1) // WORD_BITS
+        self.words = np.zeros((self.INITIAL_CAPACITY, self.n_words), dtype=np.uint64)
+        self.alive = np.zeros(self.INITIAL_CAPACITY, dtype=bool)
+        self.ids = []  # type: List
+        self.rows = {}  # type: Dict
+        self.size = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, _id, packed: np.ndarray):
+        if _id in self.rows:
+            row = self.rows[_id]
+            if self.multi_index:
+                self.multi_index.remove(row, self.words[row])
+                self.multi_index.add(row, packed)
+            self.words[row] = packed
+            return
+        if self.multi_index:
+            self.multi_index.add(self.size, packed)
+        if self.size == len(self.words):
+            self._grow()
+        self.words[self.size] = packed
+        self.alive[self.size] = True
+        self.ids.append(_id)
+        self.rows[_id] = self.size
+        self.size += 1
+
+    def remove(self, _id):
+        row = self.rows.pop(_id)
+        if self.multi_index:
+            self.multi_index.remove(row, self.words[row])
+        self.alive[row] = False
+        self.ids[row] = None
+        if self.size - len(self.rows) > max(len(self.rows), self.INITIAL_CAPACITY):
+            self._compact()
+
+    def distances(self, packed: np.ndarray) -> np.ndarray:
+        distances = _popcount_rows(np.bitwise_xor(self.words[:self.size], packed))
+        distances[~self.alive[:self.size]] = self.bit_length + 1
+        return distances
+
+    def within(self, packed: np.ndarray, max_distance: int) -> List:
+        if self.multi_index and self.multi_index.supports(max_distance):
+            candidate_rows = self.multi_index.candidates(packed, max_distance)
+            if not candidate_rows:
+                return []
+            rows = np.fromiter(candidate_rows, dtype=np.int64, count=len(candidate_rows))
+            distances = _popcount_rows(np.bitwise_xor(self.words[rows], packed))
+            # Only the hits are sorted back into insertion order, there are far fewer of them than candidates
+            return [self.ids[row] for row in np.sort(rows[distances <= max_distance])]
+        distances = self.distances(packed)
+        return [self.ids[row] for row in np.flatnonzero(distances <= max_distance)]
+
+    def _grow(self):
+        capacity = len(self.words) * 2
+        words = np.zeros((capacity, self.n_words), dtype=np.uint64)
+        words[:self.size] = self.words[:self.size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive[:self.size]
+        self.words, self.alive = words, alive
+
+    def _compact(self):
+        keep = np.flatnonzero(self.alive[:self.size])
+        capacity = max(self.INITIAL_CAPACITY, len(keep) * 2)
+        words = np.zeros((capacity, self.n_words), dtype=np.uint64)
+        words[:len(keep)] = self.words[keep]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(keep)] = True
+        self.ids = [self.ids[row] for row in keep]
+        self.rows = {_id: row for row, _id in enumerate(self.ids)}
+        self.words, self.alive, self.size = words, alive, len(keep)
+        if self.multi_index:
+            # Rows are renumbered, the band tables are rebuilt to point at the new ones
+            self.multi_index = MultiIndexHashing(self.bit_length)
+            for row in range(self.size):
+                self.multi_index.add(row, self.words[row])
+
+
+class HammingIndex(object):
+    """
+    In-process index of the '0'/'1' strings, or their packed form, stored under one binary string key,
+    kept as packed uint64 words next to the _id of their documents.
+    Radius searches go through multi-index hashing when the radius is small compared to the hash length
+    and through a linear XOR plus popcount scan otherwise
+    """
+
+    def __init__(self, binary_string_key: str, multi_index_hashing: bool = True):
+        self.binary_string_key = binary_string_key
+        self.multi_index_hashing = multi_index_hashing
+        self._buckets = {}  # type: Dict[int, _PackedBucket]
+        self._bit_lengths = {}  # type: Dict
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._bit_lengths)
+
+    def add(self, _id, binary_string) -> bool:
+        if is_packed(binary_string):
+            data, bit_length = packed_bytes(binary_string)
+            packed = pack_bytes(data, bit_length) if bit_length else None
+        elif is_binary_string(binary_string) and binary_string:
+            bit_length = len(binary_string)
+            packed = pack_binary_string(binary_string)
+        else:
+            packed = None
+        if packed is None:
+            self.remove(_id)
+            return False
+        with self._lock:
+            if self._bit_lengths.get(_id, bit_length) != bit_length:
+                self.remove(_id)
+            if bit_length not in self._buckets:
+                self._buckets[bit_length] = _PackedBucket(bit_length, self.multi_index_hashing)
+            self._buckets[bit_length].add(_id, packed)
+            self._bit_lengths[_id] = bit_length
+        return True
+
+    def remove(self, _id):
+        with self._lock:
+            bit_length = self._bit_lengths.pop(_id, None)
+            if bit_length is not None:
+                self._buckets[bit_length].remove(_id)
+
+    def within(self, from_binary_string: str, max_distance: int) -> List:
+        """
+        _ids whose string is at most max_distance away from from_binary_string, in insertion order
+        """
+        with self._lock:
+            bucket = self._buckets.get(len(from_binary_string))
+            if not bucket:
+                return []
+            return bucket.within(pack_binary_string(from_binary_string), max_distance)
+
+    def nearest(self, from_binary_string: str, limit: Optional[int] = None) -> List[Tuple]:
+        """
+        (_id, distance) pairs ordered by ascending distance, ties broken towards the most recently inserted
+        """
+        with self._lock:
+            bucket = self._buckets.get(len(from_binary_string))
+            if not bucket:
+                return []
+            distances = bucket.distances(pack_binary_string(from_binary_string))
+            # Removed rows sort last, past the len(bucket) live ones
+            limit = len(bucket) if limit is None else min(limit, len(bucket))
+            if limit <= 0:
+                return []
+            order = HammingIndex._first_rows(HammingIndex._nearest_keys(distances), limit)
+            return [(bucket.ids[row], int(distances[row])) for row in order]
+
+    def iter_nearest(self, from_binary_string: str, first_batch_size: int,
+                     max_batch_size: int) -> Iterator[List[Tuple]]:
+        """
+        The pairs of nearest in batches, the first of first_batch_size and the next ones doubling up to
+        max_batch_size. Distances are computed once, the rows past the first batch are only sorted when asked for.
+        Documents removed in between are skipped, documents added in between are left out
+        """
+        with self._lock:
+            bucket = self._buckets.get(len(from_binary_string))
+            if not bucket or first_batch_size <= 0:
+                return
+            distances = bucket.distances(pack_binary_string(from_binary_string))
+            # Removing a document clears its _id in place, compacting replaces the list
+            ids, n_alive = bucket.ids, len(bucket)
+        keys = HammingIndex._nearest_keys(distances)
+        batch_size = min(first_batch_size, n_alive)
+        yield HammingIndex._pairs(ids, distances, HammingIndex._first_rows(keys, batch_size))
+        rest = np.argsort(keys)[batch_size:n_alive]
+        start = 0
+        while start < len(rest):
+            batch_size = min(batch_size * 2, max_batch_size)
+            yield HammingIndex._pairs(ids, distances, rest[start:start + batch_size])
+            start += batch_size
+
+    @staticmethod
+    def _nearest_keys(distances: np.ndarray) -> np.ndarray:
+        # One int64 key per row, ascending distance and then descending row
+        size = len(distances)
+        return distances * size + (size - 1 - np.arange(size))
+
+    @staticmethod
+    def _first_rows(keys: np.ndarray, limit: int) -> np.ndarray:
+        if limit < len(keys):
+            # Only the first limit rows are sorted
+            rows = np.argpartition(keys, limit - 1)[:limit]
+            return rows[np.argsort(keys[rows])]
+        return np.argsort(keys)[:limit]
+
+    @staticmethod
+    def _pairs(ids: List, distances: np.ndarray, rows: np.ndarray) -> List[Tuple]:
+        return [(ids[row], int(distances[row])) for row in rows if ids[row] is not None]
@@ -0,0 +1,214 @@
+import datetime
+import json
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure, PyMongoError
+from common.datetime_utils import datetime_to_milliseconds
+from .logging import logger
+
+IndexKey = Tuple[Tuple[str, int], ...]
+
+
+class _KeyUsage(object):
+    def __init__(self):
+        self.kinds = set()  # type: Set[str]
+        self.uses = 0
+        self.last_used_at = datetime.datetime.utcnow()
+
+
+class IndexManager(object):
+    """
+    Records which fields of a collection are used as idempotency, filter and sort keys and, on reconcile,
+    creates indexes for keys used often enough and drops the indexes it created once their key goes idle.
+    Usage is summed up in usage_collection across processes and restarts, every process flushes its own at most
+    every flush_seconds. Indexes not named with INDEX_NAME_PREFIX, or whose key has no recorded usage, are never
+    dropped
+    """
+
+    INDEX_NAME_PREFIX = "broccoli_auto_"
+    KIND_IDEMPOTENCY = "idempotency"
+    KIND_FILTER = "filter"
+    KIND_SORT = "sort"
+    KIND_BOARD = "board"
+    LOGICAL_OPERATORS = {"$and", "$or", "$nor"}
+
+    def __init__(self, collection: Collection, usage_collection: Collection, min_uses: int = 3,
+                 idle_seconds: int = 7 * 24 * 3600, max_managed_indexes: int = 20, flush_seconds: float = 10):
+        self.collection = collection
+        self.usage_collection = usage_collection
+        self.min_uses = min_uses
+        self.idle_seconds = idle_seconds
+        self.max_managed_indexes = max_managed_indexes
+        self.flush_seconds = flush_seconds
+        self.started_at = datetime.datetime.utcnow()
+        self.actions = deque(maxlen=100)
+        # Usage recorded here and not yet added to usage_collection
+        self._pending = {}  # type: Dict[IndexKey, _KeyUsage]
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record_idempotency_key(self, idempotency_key: str):
+        self._record(((idempotency_key, 1),), self.KIND_IDEMPOTENCY)
+
+    def record_filter(self, q: Dict):
+        for field in IndexManager._filter_fields(q):
+            self._record(((field, 1),), self.KIND_FILTER)
+
+    def record_sort(self, sort: Optional[Dict[str, int]]):
+        if sort:
+            self._record(IndexManager._sort_key(sort), self.KIND_SORT)
+
+    def record_board_query(self, q: Dict, sort: Optional[Dict[str, int]]):
+        # Boards are polled by every open dashboard, so their keys qualify right away
+        keys = list(map(lambda field: ((field, 1),), IndexManager._filter_fields(q)))
+        if sort:
+            keys.append(IndexManager._sort_key(sort))
+        for key in keys:
+            self._record(key, self.KIND_BOARD, uses=self.min_uses)
+
+    def flush(self):
+        """
+        Adds the usage recorded in this process to usage_collection
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+        requests = []
+        for key, usage in pending.items():
+            requests.append(UpdateOne({"_id": IndexManager._usage_id(key)}, {
+                "$setOnInsert": {"key": list(map(list, key))},
+                "$inc": {"uses": usage.uses},
+                "$max": {"last_used_at": usage.last_used_at},
+                "$addToSet": {"kinds": {"$each": sorted(usage.kinds)}}
+            }, upsert=True))
+        try:
+            self.usage_collection.bulk_write(requests, ordered=False)
+        except PyMongoError as e:
+            # Usage only steers index creation, losing a flush is not worth failing the request that triggered it
+            logger.warning(f"Index manager failed to flush usage of {len(requests)} keys: {e}")
+
+    def reconcile(self):
+        self.flush()
+        existing_indexes = self._existing_indexes()
+        usages = self._usages()
+        desired_keys = self._desired_keys(usages)
+
+        for key in desired_keys:
+            if key in existing_indexes:
+                continue
+            name = self.INDEX_NAME_PREFIX + "_".join(map(lambda k: f"{k[0]}_{k[1]}", key))
+            try:
+                self.collection.create_index(list(key), name=name, background=True)
+                self._log_action("create", name, key)
+            except OperationFailure as e:
+                self._log_action("create_failed", name, key, str(e))
+
+        for key, index in existing_indexes.items():
+            if index["name"].startswith(self.INDEX_NAME_PREFIX) and key in usages and key not in desired_keys:
+                try:
+                    self.collection.drop_index(index["name"])
+                    self._log_action("drop", index["name"], key)
+                except OperationFailure as e:
+                    self._log_action("drop_failed", index["name"], key, str(e))
+
+    def describe(self) -> Dict:
+        usages = list(map(lambda usage: {
+            "key": usage["key"],
+            "kinds": sorted(usage["kinds"]),
+            "uses": usage["uses"],
+            "last_used_at": datetime_to_milliseconds(usage["last_used_at"])
+        }, self._usages().values()))
+        actions = list(self.actions)
+        indexes = []
+        for key, index in self._existing_indexes().items():
+            indexes.append({
+                "name": index["name"],
+                "key": list(map(list, key)),
+                "unique": index.get("unique", False),
+                "managed": index["name"].startswith(self.INDEX_NAME_PREFIX)
+            })
+        return {
+            "indexes": indexes,
+            "usages": sorted(usages, key=lambda u: -u["uses"]),
+            "actions": actions
+        }
+
+    def _record(self, key: IndexKey, kind: str, uses: int = 1):
+        with self._lock:
+            if key not in self._pending:
+                self._pending[key] = _KeyUsage()
+            usage = self._pending[key]
+            usage.kinds.add(kind)
+            usage.uses += uses
+            usage.last_used_at = datetime.datetime.utcnow()
+            flush = time.monotonic() - self._flushed_at >= self.flush_seconds
+        if flush:
+            self.flush()
+
+    def _usages(self) -> Dict[IndexKey, Dict]:
+        usages = {}
+        for document in self.usage_collection.find({}):
+            usages[tuple(map(lambda k: (k[0], int(k[1])), document["key"]))] = document
+        return usages
+
+    def _desired_keys(self, usages: Dict[IndexKey, Dict]) -> Set[IndexKey]:
+        now = datetime.datetime.utcnow()
+        candidates = []
+        for key, usage in usages.items():
+            if usage["uses"] < self.min_uses:
+                continue
+            idle_since = max(usage["last_used_at"], self.started_at)
+            if (now - idle_since).total_seconds() > self.idle_seconds:
+                continue
+            candidates.append((usage["uses"], key))
+        candidates.sort(key=lambda c: -c[0])
+        return set(map(lambda c: c[1], candidates[:self.max_managed_indexes]))
+
+    def _existing_indexes(self) -> Dict[IndexKey, Dict]:
+        existing_indexes = {}
+        for name, info in self.collection.index_information().items():
+            key = tuple(map(lambda k: (k[0], int(k[1])), info["key"]))
+            if len(key) == 1:
+                key = ((key[0][0], 1),)
+            existing_indexes[key] = dict(info, name=name)
+        return existing_indexes
+
+    def _log_action(self, action: str, name: str, key: IndexKey, message: str = ""):
+        logger.info(f"Index manager {action} index {name} on {key} {message}")
+        self.actions.append({
+            "at": datetime_to_milliseconds(datetime.datetime.utcnow()),
+            "action": action,
+            "name": name,
+            "key": list(map(list, key)),
+            "message": message
+        })
+
+    @staticmethod
+    def _usage_id(key: IndexKey) -> str:
+        # Field names may contain dots and underscores, the JSON form of the key is unambiguous
+        return json.dumps(list(map(list, key)))
+
+    @staticmethod
+    def _sort_key(sort: Dict[str, int]) -> IndexKey:
+        if len(sort) == 1:
+            # A single field index serves both sort directions
+            return ((list(sort.keys())[0], 1),)
+        return tuple(map(lambda item: (item[0], int(item[1])), sort.items()))
+
+    @staticmethod
+    def _filter_fields(q: Dict) -> List[str]:
+        fields = []
+        for field, value in q.items():
+            if field in IndexManager.LOGICAL_OPERATORS and type(value) == list:
+                for sub_q in value:
+                    if type(sub_q) == dict:
+                        fields += IndexManager._filter_fields(sub_q)
+            elif not field.startswith("$") and field != "_id":
+                fields.append(field)
+        return fields
@@ -0,0 +1,62 @@
+import itertools
+import numpy as np
+from typing import Dict, List, Set
+
+
+class MultiIndexHashing(object):
+    """
+    Multi-index hashing over packed hashes of one bit length. The hash is split into 16-bit bands and every band
+    keeps a table from band value to the rows holding it. Two hashes within distance r must agree on at least one band up to
+    r // n_bands flipped bits, so a radius search only probes the band values within that many bits and verifies
+    the candidates against the full hash. Band radius 2 probes 137 values per band, covering radius 8 on 64-bit
+    hashes and 32 on 256-bit ones, beyond that the linear scan is faster
+    """
+
+    BAND_BITS = 16
+    MAX_BAND_RADIUS = 2
+
+    def __init__(self, bit_length: int):
+        self.bit_length = bit_length
+        self.n_bands = (bit_length + self.BAND_BITS - 1) // self.BAND_BITS
+        self.tables = [{} for _ in range(self.n_bands)]  # type: List[Dict[int, List]]
+
+    def supports(self, max_distance: int) -> bool:
+        return max_distance // self.n_bands <= self.MAX_BAND_RADIUS
+
+    def add(self, row: int, packed: np.ndarray):
+        for table, band_value in zip(self.tables, self._band_values(packed)):
+            table.setdefault(band_value, []).append(row)
+
+    def remove(self, row: int, packed: np.ndarray):
+        for table, band_value in zip(self.tables, self._band_values(packed)):
+            rows = table[band_value]
+            rows.remove(row)
+            if not rows:
+                del table[band_value]
+
+    def candidates(self, packed: np.ndarray, max_distance: int) -> Set[int]:
+        masks = _flip_masks(self.BAND_BITS, max_distance // self.n_bands)
+        candidates = set()
+        for table, band_value in zip(self.tables, self._band_values(packed)):
+            for mask in masks:
+                rows = table.get(band_value ^ mask)
+                if rows:
+                    candidates.update(rows)
+        return candidates
+
+    def _band_values(self, packed: np.ndarray) -> List[int]:
+        # packbits is big-endian within a byte, so a band is two consecutive bytes read big-endian
+        return packed.view(np.uint8).view(">u2")[:self.n_bands].tolist()
+
+
+_FLIP_MASKS = {}  # type: Dict[tuple, List[int]]
+
+
+def _flip_masks(width: int, radius: int) -> List[int]:
+    if (width, radius) not in _FLIP_MASKS:
+        masks = []
+        for flipped_bits in range(radius + 1):
+            for positions in itertools.combinations(range(width), flipped_bits):
+                masks.append(sum(map(lambda p: 1 << p, positions)))
+        _FLIP_MASKS[(width, radius)] = masks
+    return _FLIP_MASKS[(width, radius)]
@@ -0,0 +1,109 @@
+from typing import Dict, List, Optional, Tuple
+from bson import Binary
+
+# The packed bit layout of the BSON binary vector subtype: a dtype byte, a byte counting the unused low bits
+# of the last byte, then the bits most significant first. 8 bits take one byte instead of eight characters
+PACKED_BIT_SUBTYPE = 9
+PACKED_BIT_DTYPE = 0x10
+
+
+def is_packed(value) -> bool:
+    return isinstance(value, Binary) and value.subtype == PACKED_BIT_SUBTYPE and len(value) >= 2 \
+        and value[0] == PACKED_BIT_DTYPE
+
+
+def to_packed(binary_string: str) -> Binary:
+    n_bytes = (len(binary_string) + 7) // 8
+    padding = n_bytes * 8 - len(binary_string)
+    bits = (int(binary_string, 2) << padding) if binary_string else 0
+    return Binary(bytes([PACKED_BIT_DTYPE, padding]) + bits.to_bytes(n_bytes, "big"), PACKED_BIT_SUBTYPE)
+
+
+def packed_bytes(packed: Binary) -> Tuple[bytes, int]:
+    """
+    The packed bits and how many of them are used
+    """
+    return bytes(packed[2:]), (len(packed) - 2) * 8 - packed[1]
+
+
+def from_packed(packed: Binary) -> str:
+    data, bit_length = packed_bytes(packed)
+    if not bit_length:
+        return ""
+    return format(int.from_bytes(data, "big") >> (len(data) * 8 - bit_length), f"0{bit_length}b")
+
+
+def to_int(value) -> Optional[Tuple[int, int]]:
+    """
+    The bits of a '0'/'1' string or of a packed value as an int and their count, None for anything else
+    """
+    if is_packed(value):
+        data, bit_length = packed_bytes(value)
+        return int.from_bytes(data, "big") >> (len(data) * 8 - bit_length), bit_length
+    if isinstance(value, str) and set(value) <= set("01"):
+        return (int(value, 2) if value else 0), len(value)
+    return None
+
+
+def unpack_document(document: Dict) -> Dict:
+    """
+    Turns packed values back into '0'/'1' strings in place, so clients see the format they wrote
+    """
+    for key, value in document.items():
+        if isinstance(value, Binary):
+            if is_packed(value):
+                document[key] = from_packed(value)
+        elif isinstance(value, dict):
+            unpack_document(value)
+    return document
+
+
+def _is_bits(value) -> bool:
+    return isinstance(value, str) and value != "" and set(value) <= set("01")
+
+
+def _either_form(values: List) -> List:
+    return values + list(map(to_packed, filter(_is_bits, values)))
+
+
+def match_either_form(q: Dict) -> Dict:
+    """
+    A copy of the filter q whose equality and $in on '0'/'1' strings, and their $ne and $nin, also take the bits
+    packed. Clients filter with the strings they read back, whether a value is still stored as a string or packed
+    """
+    rewritten = {}
+    for key, value in q.items():
+        if key in ["$and", "$or", "$nor"] and isinstance(value, list):
+            rewritten[key] = list(map(lambda sub_q: match_either_form(sub_q) if isinstance(sub_q, dict) else sub_q,
+                                      value))
+        elif key.startswith("$"):
+            rewritten[key] = value
+        elif _is_bits(value):
+            rewritten[key] = {"$in": _either_form([value])}
+        elif isinstance(value, dict) and all(map(lambda operator: operator.startswith("$"), value.keys())):
+            rewritten[key] = _match_operators_either_form(value)
+        else:
+            rewritten[key] = value
+    return rewritten
+
+
+def pipeline_match_either_form(pipeline: List[Dict]) -> List[Dict]:
+    """
+    A copy of the pipeline whose top level $match stages match either form, like match_either_form
+    """
+    return list(map(
+        lambda stage: {**stage, "$match": match_either_form(stage["$match"])}
+        if isinstance(stage, dict) and isinstance(stage.get("$match"), dict) else stage,
+        pipeline
+    ))
+
+
+def _match_operators_either_form(operators: Dict) -> Dict:
+    rewritten = dict(operators)
+    for operator, list_operator in [("$eq", "$in"), ("$ne", "$nin")]:
+        if _is_bits(rewritten.get(operator)) and list_operator not in rewritten:
+            rewritten[list_operator] = [rewritten.pop(operator)]
+    for list_operator in ["$in", "$nin"]:
+        if isinstance(rewritten.get(list_operator), list):
+            rewritten[list_operator] = _either_form(rewritten[list_operator])
+    return rewritten
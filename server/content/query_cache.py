@@ -0,0 +1,248 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set
+import bson
+from bson import json_util
+from bson.regex import Regex
+
+# Operators that can read any field of a document, a query using them depends on the whole document
+OPAQUE_OPERATORS = {"$where", "$expr", "$text", "$function"}
+
+
+class _CacheEntry(object):
+    def __init__(self, documents: List[Dict], fields: Optional[Set[str]], size_bytes: int, expires_at: float,
+                 allowed_values: Dict[str, Set]):
+        self.documents = documents
+        self.fields = fields
+        self.size_bytes = size_bytes
+        self.expires_at = expires_at
+        self.allowed_values = allowed_values
+
+
+class QueryCache(object):
+    """
+    LRU cache of query results bounded by entry count, total BSON size and a TTL.
+    Appends only invalidate entries whose filter may match an inserted document, updates only invalidate entries
+    whose filter, sort or projection touch an updated field. A result read while a write is in flight is not stored,
+    so an entry never outlives the write that made it stale
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 5.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.generation = 0
+        self.size_bytes = 0
+        self._entries = OrderedDict()  # type: OrderedDict[str, _CacheEntry]
+        self._loading = {}  # type: Dict[str, threading.Lock]
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0
+        }
+
+    @staticmethod
+    def fingerprint(q: Dict, limit: Optional[int], projection: Optional[List[str]], sort: Optional[Dict[str, int]],
+                    datetime_q: Optional[List[Dict]]) -> str:
+        # Sort order is significant and kept as is, projection order is not
+        return json_util.dumps([
+            q,
+            limit or None,
+            sorted(set(projection)) if projection else None,
+            list((sort or {}).items()),
+            datetime_q or None
+        ])
+
+    @staticmethod
+    def dependent_fields(q: Dict, projection: Optional[List[str]],
+                         sort: Optional[Dict[str, int]]) -> Optional[Set[str]]:
+        """
+        Top level fields a query result depends on, or None if it depends on the whole document
+        """
+        if not projection:
+            return None
+        fields = set(map(lambda f: f.split(".")[0], projection + list((sort or {}).keys())))
+        filter_fields = QueryCache._filter_fields(q)
+        if filter_fields is None:
+            return None
+        return fields | filter_fields
+
+    def get_or_load(self, key: str, fields: Optional[Set[str]], load: Callable[[], List[Dict]],
+                    q: Optional[Dict] = None) -> List[Dict]:
+        """
+        Returns the cached documents of key, or loads and caches them. Concurrent misses of one key
+        share a single load. q is the filter of the query, without it every append invalidates the entry
+        """
+        documents = self._get(key)
+        if documents is not None:
+            return documents
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another request may have loaded the key while this one waited
+            documents = self._get(key, count_miss=False)
+            if documents is not None:
+                return documents
+            try:
+                generation = self.generation
+                allowed_values = QueryCache.allowed_values(q) if q is not None else {}
+                documents = load()
+                self._put(key, fields, documents, generation, allowed_values)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return list(map(dict, documents))
+
+    def invalidate_all(self):
+        with self._lock:
+            self.generation += 1
+            self._counters["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def invalidate_documents(self, documents: List[Dict]):
+        """
+        Invalidates the entries whose filter may match one of the inserted documents
+        """
+        document_values = {}  # type: Dict[str, Set]
+        with self._lock:
+            self.generation += 1
+            for key, entry in list(self._entries.items()):
+                may_match = True
+                for field, values in entry.allowed_values.items():
+                    if field not in document_values:
+                        document_values[field] = QueryCache._document_values(documents, field)
+                    if not values & document_values[field]:
+                        may_match = False
+                        break
+                if may_match:
+                    self._remove(key)
+                    self._counters["invalidations"] += 1
+
+    def invalidate_fields(self, fields: Set[str]):
+        with self._lock:
+            self.generation += 1
+            for key, entry in list(self._entries.items()):
+                if entry.fields is None or entry.fields & fields:
+                    self._remove(key)
+                    self._counters["invalidations"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return dict(
+                self._counters,
+                entries=len(self._entries),
+                size_bytes=self.size_bytes,
+                hit_ratio=self._counters["hits"] / lookups if lookups else 0.0
+            )
+
+    def _get(self, key: str, count_miss: bool = True) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self._counters["expirations"] += 1
+                entry = None
+            if not entry:
+                if count_miss:
+                    self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            documents = entry.documents
+        # Callers may modify the documents they get, the cached ones stay untouched at the top level
+        return list(map(dict, documents))
+
+    def _put(self, key: str, fields: Optional[Set[str]], documents: List[Dict], generation: int,
+             allowed_values: Dict[str, Set]):
+        size_bytes = sum(map(lambda d: len(bson.BSON.encode(d)), documents))
+        if size_bytes > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _CacheEntry(documents, fields, size_bytes, time.monotonic() + self.ttl_seconds,
+                                             allowed_values)
+            self.size_bytes += size_bytes
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.size_bytes -= entry.size_bytes
+
+    @staticmethod
+    def allowed_values(q: Dict) -> Dict[str, Set]:
+        """
+        Values a matching document must hold in top level fields, from the equality and $in conditions of q.
+        None stands for both null and a missing field. Fields with any other condition are left out
+        """
+        allowed_values = {}  # type: Dict[str, Set]
+        for key, condition in q.items():
+            if key == "$and" and type(condition) == list:
+                field_values = list(map(QueryCache.allowed_values, filter(lambda c: type(c) == dict, condition)))
+            elif key.startswith("$") or "." in key:
+                continue
+            elif type(condition) == dict and list(condition.keys()) == ["$eq"]:
+                field_values = [{key: {condition["$eq"]}}] if QueryCache._is_equality_value(condition["$eq"]) else []
+            elif type(condition) == dict and list(condition.keys()) == ["$in"] and type(condition["$in"]) == list:
+                in_values = condition["$in"]
+                field_values = [{key: set(in_values)}] if all(map(QueryCache._is_equality_value, in_values)) else []
+            else:
+                field_values = [{key: {condition}}] if QueryCache._is_equality_value(condition) else []
+            for values_of_field in field_values:
+                for field, values in values_of_field.items():
+                    allowed_values[field] = allowed_values[field] & values if field in allowed_values else values
+        return allowed_values
+
+    @staticmethod
+    def _is_equality_value(value) -> bool:
+        # Patterns match rather than equal, documents and arrays are left to MongoDB, NaN equals itself there
+        if isinstance(value, (dict, list, re.Pattern, Regex)) or value != value:
+            return False
+        try:
+            hash(value)
+        except TypeError:
+            return False
+        return True
+
+    @staticmethod
+    def _document_values(documents: List[Dict], field: str) -> Set:
+        values = set()
+        for document in documents:
+            value = document.get(field)
+            # An equality also matches an element of an array
+            for v in (value if type(value) == list else [value]):
+                if QueryCache._is_equality_value(v):
+                    values.add(v)
+        return values
+
+    @staticmethod
+    def _filter_fields(q) -> Optional[Set[str]]:
+        fields = set()
+        values = []
+        if type(q) == dict:
+            for key, value in q.items():
+                if key in OPAQUE_OPERATORS:
+                    return None
+                if not key.startswith("$"):
+                    fields.add(key.split(".")[0])
+                values.append(value)
+        elif type(q) == list:
+            values = q
+        for value in values:
+            if type(value) in [dict, list]:
+                nested_fields = QueryCache._filter_fields(value)
+                if nested_fields is None:
+                    return None
+                fields |= nested_fields
+        return fields
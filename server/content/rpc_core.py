@@ -1,142 +1,238 @@
-from typing import Dict, Tuple, Union, List
-from common.validate_schema_or_not import validate_schema_or_not
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union, List
+from common.validate_schema_or_not import compile_validator
 from .content_store import ContentStore
+from .packed_binary_string import match_either_form, pipeline_match_either_form
 from .rpc_schemas import SCHEMAS
 from .logging import logger
 
+# Takes the metadata and the already validated payload of a request
+VerbHandler = Callable[[Dict, Dict], Tuple[bool, object]]
+
 
 class RpcCore(object):
     def __init__(self, content_store: ContentStore):
         self.content_store = content_store
+        self.verbs = {}  # type: Dict[str, Tuple[VerbHandler, Optional[Callable[[Dict], Tuple[bool, str]]]]]
+        for verb, handler in [
+            ("append", self.append),
+            ("append_many", self.append_many),
+            ("query", self.query),
+            ("update_one", self.update_one),
+            ("schema", self.schema),
+            ("update_one_binary_string", self.update_one_binary_string),
+            ("bulk_update_one", self.bulk_update_one),
+            ("bulk_update_one_binary_string", self.bulk_update_one_binary_string),
+            ("query_nearest_hamming_neighbors", self.query_nearest_hamming_neighbors),
+            ("query_n_nearest_hamming_neighbors", self.query_n_nearest_hamming_neighbors),
+            ("random_one", self.random_one),
+            ("random_many", self.random_many),
+            ("count", self.count),
+            ("aggregate", self.aggregate),
+        ]:
+            self.register_verb(verb, handler, SCHEMAS.get(verb, {}).get("payload"))
+
+    STREAM_BATCH_SIZE = 1000
+
+    def register_verb(self, verb: str, handler: VerbHandler, payload_schema: Optional[Dict] = None):
+        """
+        Adds a verb, its payload is validated against payload_schema before handler is called.
+        The schema is compiled once here rather than on every call
+        """
+        if verb in self.verbs:
+            raise ValueError(f"Verb {verb} is already registered")
+        self.verbs[verb] = (handler, compile_validator(payload_schema) if payload_schema else None)
 
     def call(self, parsed_body: Dict) -> Tuple[bool, Union[str, Dict, List]]:
-        if not parsed_body \
-                or "verb" not in parsed_body or type(parsed_body["verb"]) != str \
-                or "metadata" not in parsed_body or type(parsed_body["metadata"]) != dict \
-                or "payload" not in parsed_body or type(parsed_body["payload"]) != dict:
-            logger.error(f"Invalid message body {parsed_body}")
-            return False, 'Invalid message body'
+        status, message = RpcCore._validate_body(parsed_body)
+        if not status:
+            return False, message
 
         verb = parsed_body["verb"]  # type: str
         metadata = parsed_body["metadata"]  # type: Dict
         payload = parsed_body['payload']  # type: Dict
-        logger.debug(f"Received rpc request verb={verb} metadata={metadata} payload={payload}")
-
-        if verb == "append":
-            return self.append(metadata, payload)
-        if verb == "query":
-            return self.query(metadata, payload)
-        if verb == "update_one":
-            return self.update_one(metadata, payload)
-        if verb == "schema":
-            return self.schema(metadata, payload)
-        if verb == 'update_one_binary_string':
-            return self.update_one_binary_string(metadata, payload)
-        if verb == 'query_nearest_hamming_neighbors':
-            return self.query_nearest_hamming_neighbors(metadata, payload)
-        if verb == 'random_one':
-            return self.random_one(metadata, payload)
-        if verb == 'count':
-            return self.count(metadata, payload)
-        return False, 'Unknown verb'
+        # Arguments rather than an f-string, so the payload is only formatted when debug logging is on
+        logger.debug("Received rpc request verb=%s metadata=%s payload=%s", verb, metadata, payload)
+
+        if verb not in self.verbs:
+            return False, 'Unknown verb'
+        handler, validate = self.verbs[verb]
+        if validate:
+            status, message = validate(payload)
+            if not status:
+                logger.info("Fails to validate %s payload=%s, message %s", verb, payload, message)
+                return False, message
+        return handler(metadata, payload)
+
+    def call_batch(self, parsed_bodies: List[Dict]) -> List[Tuple[bool, Union[str, Dict, List]]]:
+        """
+        Runs the calls in order, a call that fails or raises does not stop the ones after it
+        """
+        results = []
+        for parsed_body in parsed_bodies:
+            try:
+                results.append(self.call(parsed_body))
+            except Exception as e:
+                logger.exception(f"Fails to run batched rpc request {parsed_body}")
+                results.append((False, str(e)))
+        return results
+
+    def stream(self, parsed_body: Dict, bson_documents: bool = False) -> Tuple[bool, Union[str, Iterator]]:
+        """
+        Validates a query and returns its documents one at a time, as raw documents or as encoded BSON bytes
+        """
+        status, message = RpcCore._validate_body(parsed_body)
+        if not status:
+            return False, message
 
-    def append(self, metadata: Dict, payload: Dict) -> Tuple[bool, str]:
-        logger.debug(f"Calling append metadata={metadata}, payload={payload}")
+        verb = parsed_body["verb"]  # type: str
+        metadata = parsed_body["metadata"]  # type: Dict
+        payload = parsed_body['payload']  # type: Dict
+        logger.debug("Received streaming rpc request verb=%s metadata=%s payload=%s", verb, metadata, payload)
 
-        status, message = validate_schema_or_not(payload, SCHEMAS["append"]["payload"])
+        if verb != "query":
+            return False, f"Verb {verb} does not support streaming"
+        status, message = self.verbs["query"][1](payload)
         if not status:
-            logger.info(f"Fails to validate query payload={payload}, message {message}")
+            logger.info("Fails to validate query payload=%s, message %s", payload, message)
             return False, message
 
+        if bson_documents:
+            return True, self.content_store.iter_query_bson(
+                self._filter(payload["q"]),
+                limit=payload.get("limit"),
+                projection=payload.get("projection"),
+                sort=payload.get("sort"),
+                datetime_q=payload.get("datetime_q"),
+                batch_size=self.STREAM_BATCH_SIZE
+            )
+        return True, map(ContentStore.created_at_to_milliseconds, self.content_store.iter_query(
+            self._filter(payload["q"]),
+            limit=payload.get("limit"),
+            projection=payload.get("projection"),
+            sort=payload.get("sort"),
+            datetime_q=payload.get("datetime_q"),
+            batch_size=self.STREAM_BATCH_SIZE,
+            raw=True
+        ))
+
+    def _filter(self, q: Dict) -> Dict:
+        # Filters written against the '0'/'1' strings clients read back also match the values stored packed
+        return match_either_form(q) if self.content_store.packed_binary_strings else q
+
+    @staticmethod
+    def _validate_body(parsed_body: Dict) -> Tuple[bool, str]:
+        if not parsed_body \
+                or "verb" not in parsed_body or type(parsed_body["verb"]) != str \
+                or "metadata" not in parsed_body or type(parsed_body["metadata"]) != dict \
+                or "payload" not in parsed_body or type(parsed_body["payload"]) != dict:
+            logger.error(f"Invalid message body {parsed_body}")
+            return False, 'Invalid message body'
+        return True, ''
+
+    def append(self, metadata: Dict, payload: Dict) -> Tuple[bool, str]:
         # todo: failure
         self.content_store.append(payload["doc"], payload["idempotency_key"])
         return True, ''
 
-    def query(self, metadata: Dict, payload: Dict) -> Tuple[bool, List[Dict]]:
-        logger.debug(f"Calling query metadata={metadata}, payload={payload}")
-
-        status, message = validate_schema_or_not(payload, SCHEMAS["query"]["payload"])
-        if not status:
-            logger.info(f"Fails to validate query payload={payload}, message {message}")
-            return False, []
+    def append_many(self, metadata: Dict, payload: Dict) -> Tuple[bool, Union[List[str], str]]:
+        # todo: failure
+        return True, self.content_store.append_many(payload["docs"], payload["idempotency_key"])
 
+    def query(self, metadata: Dict, payload: Dict) -> Tuple[bool, Union[List[Dict], Dict, str]]:
         limit = payload["limit"] if "limit" in payload else None
         projection = payload["projection"] if "projection" in payload else None
         sort = payload["sort"] if "sort" in payload else None
         datetime_q = payload["datetime_q"] if "datetime_q" in payload else None
+        if "page_size" in payload:
+            try:
+                documents, resume_token = self.content_store.query_page(
+                    self._filter(payload["q"]),
+                    page_size=payload["page_size"],
+                    resume_token=payload.get("resume_token"),
+                    projection=projection,
+                    sort=sort,
+                    datetime_q=datetime_q,
+                    raw=True
+                )
+            except ValueError as e:
+                return False, str(e)
+            return True, {
+                "documents": list(map(ContentStore.created_at_to_milliseconds, documents)),
+                "resume_token": resume_token
+            }
         # todo: query failure
-        return True, self.content_store.query(payload["q"], limit=limit, projection=projection, sort=sort,
-                                              datetime_q=datetime_q)
+        # Raw documents, the json encoder converts _id and packed binary strings as it writes them
+        documents = self.content_store.query(self._filter(payload["q"]), limit=limit, projection=projection, sort=sort,
+                                             datetime_q=datetime_q, raw=True)
+        return True, list(map(ContentStore.created_at_to_milliseconds, documents))
 
     def update_one(self, metadata: Dict, payload: Dict) -> Tuple[bool, str]:
-        logger.debug(f"Calling update_one metadata={metadata}, payload={payload}")
-
-        if "filter_q" not in payload:
-            return False, "filter_q not found in payload"
-        if type(payload["filter_q"]) != dict:
-            return False, "filter_q in payload is not a dict"
-
-        if "update_doc" not in payload:
-            return False, "update_doc not found in payload"
-        if type(payload["update_doc"]) != dict:
-            return False, "update_doc in payload is not a dict"
-
         # todo: failure
-        self.content_store.update_one(filter_q=payload["filter_q"], update_doc=payload["update_doc"])
+        self.content_store.update_one(filter_q=self._filter(payload["filter_q"]), update_doc=payload["update_doc"])
         return True, ''
 
     def schema(self, metadata: Dict, payload: Dict) -> Tuple[bool, List[str]]:
-        logger.debug(f"Calling schema metadata={metadata}, payload={payload}")
         # todo: failure
         return True, self.content_store.schema()
 
     def update_one_binary_string(self, metadata: Dict, payload: Dict) -> Tuple[bool, str]:
-        logger.debug(f"Calling update_one_binary_string metadata={metadata}, payload={payload}")
-
-        status, message = validate_schema_or_not(payload, SCHEMAS["update_one_binary_string"]["payload"])
-        if not status:
-            return False, message
-
         # todo: failure
-        self.content_store.update_one_binary_string(payload["filter_q"], payload["key"], payload["binary_string"])
+        self.content_store.update_one_binary_string(self._filter(payload["filter_q"]), payload["key"],
+                                                    payload["binary_string"])
         return True, ''
 
-    def query_nearest_hamming_neighbors(self, metadata: Dict, payload: Dict) -> Tuple[bool, List[Dict]]:
-        logger.debug(f"Calling query_nearest_hamming_neighbors metadata={metadata}, payload={payload}")
+    def bulk_update_one(self, metadata: Dict, payload: Dict) -> Tuple[bool, Union[Dict, str]]:
+        return True, self.content_store.bulk_update_one(
+            list(map(lambda op: (self._filter(op["filter_q"]), op["update_doc"]), payload["ops"]))
+        )
 
-        status, message = validate_schema_or_not(payload, SCHEMAS["query_nearest_hamming_neighbors"]["payload"])
-        if not status:
-            logger.info(f"Fails to validate query_nearest_hamming_neighbors payload={payload}, message {message}")
-            return False, []
+    def bulk_update_one_binary_string(self, metadata: Dict, payload: Dict) -> Tuple[bool, Union[Dict, str]]:
+        return True, self.content_store.bulk_update_one_binary_string(
+            list(map(lambda op: (self._filter(op["filter_q"]), op["key"], op["binary_string"]), payload["ops"]))
+        )
 
+    def query_nearest_hamming_neighbors(self, metadata: Dict, payload: Dict) -> Tuple[bool, List[Dict]]:
         # todo: failure
         return True, self.content_store.query_nearest_hamming_neighbors(
-            q=payload["q"],
+            q=self._filter(payload["q"]),
             binary_string_key=payload["binary_string_key"],
             from_binary_string=payload["from_binary_string"],
             max_distance=payload["max_distance"]
         )
 
-    def random_one(self, metadata: Dict, payload: Dict) -> Tuple[bool, Union[Dict, str]]:
-        logger.debug(f"Calling random_one metadata={metadata}, payload={payload}")
-
-        status, message = validate_schema_or_not(payload, SCHEMAS["random_one"]["payload"])
-        if not status:
-            return False, message
+    def query_n_nearest_hamming_neighbors(self, metadata: Dict, payload: Dict) -> Tuple[bool, Union[List[Dict], str]]:
+        return True, self.content_store.query_n_nearest_hamming_neighbors(
+            q=self._filter(payload["q"]),
+            binary_string_key=payload["binary_string_key"],
+            from_binary_string=payload["from_binary_string"],
+            pick_n=payload["pick_n"],
+            projection=payload.get("projection")
+        )
 
+    def random_one(self, metadata: Dict, payload: Dict) -> Tuple[bool, Union[Dict, str]]:
         # todo: failure
         return True, self.content_store.random_one(
-            q=payload["q"],
+            q=self._filter(payload["q"]),
             projection=payload["projection"]
         )
 
-    def count(self, metadata: Dict, payload: Dict) -> Tuple[bool, Union[int, str]]:
-        logger.debug(f"Calling count metadata={metadata} payload={payload}")
-
-        status, message = validate_schema_or_not(payload, SCHEMAS['count']['payload'])
-        if not status:
-            logger.info(f"Fails to validate count metadata={metadata} payload={payload}")
-            return False, message
+    def random_many(self, metadata: Dict, payload: Dict) -> Tuple[bool, Union[List[Dict], str]]:
+        # todo: failure
+        return True, self.content_store.random_many(
+            q=self._filter(payload["q"]),
+            n=payload["n"],
+            projection=payload.get("projection")
+        )
 
+    def count(self, metadata: Dict, payload: Dict) -> Tuple[bool, Union[int, str]]:
         # todo: failure
-        return True, self.content_store.count(payload['q'])
+        return True, self.content_store.count(self._filter(payload['q']))
+
+    def aggregate(self, metadata: Dict, payload: Dict) -> Tuple[bool, Union[List[Dict], str]]:
+        try:
+            pipeline = payload["pipeline"]
+            if self.content_store.packed_binary_strings:
+                pipeline = pipeline_match_either_form(pipeline)
+            return True, self.content_store.aggregate(pipeline, payload.get("datetime_q"))
+        except ValueError as e:
+            return False, str(e)
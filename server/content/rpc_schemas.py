@@ -16,6 +16,55 @@ SCHEMAS = {
             "required": ["filter_q", "key", "binary_string"]
         }
     },
+    "bulk_update_one": {
+        "payload": {
+            "type": "object",
+            "properties": {
+                "ops": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "filter_q": {
+                                "type": "object"
+                            },
+                            "update_doc": {
+                                "type": "object"
+                            }
+                        },
+                        "required": ["filter_q", "update_doc"]
+                    }
+                }
+            },
+            "required": ["ops"]
+        }
+    },
+    "bulk_update_one_binary_string": {
+        "payload": {
+            "type": "object",
+            "properties": {
+                "ops": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "filter_q": {
+                                "type": "object"
+                            },
+                            "key": {
+                                "type": "string"
+                            },
+                            "binary_string": {
+                                "type": "string"
+                            }
+                        },
+                        "required": ["filter_q", "key", "binary_string"]
+                    }
+                }
+            },
+            "required": ["ops"]
+        }
+    },
     "query_nearest_hamming_neighbors": {
         "payload": {
             "type": "object",
@@ -57,11 +106,44 @@ SCHEMAS = {
                     "contains": {
                         "type": "number"
                     }
+                },
+                "page_size": {
+                    "type": "integer",
+                    "minimum": 1
+                },
+                "resume_token": {
+                    "type": "string"
                 }
             },
             "required": ["q"]
         }
     },
+    "query_n_nearest_hamming_neighbors": {
+        "payload": {
+            "type": "object",
+            "properties": {
+                "q": {
+                    "type": "object",
+                },
+                "binary_string_key": {
+                    "type": "string",
+                },
+                "from_binary_string": {
+                    "type": "string",
+                },
+                "pick_n": {
+                    "type": "integer",
+                },
+                "projection": {
+                    "type": "array",
+                    "contains": {
+                        "type": "string"
+                    }
+                }
+            },
+            "required": ["q", "binary_string_key", "from_binary_string", "pick_n"]
+        }
+    },
     "random_one": {
         "payload": {
             "type": "object",
@@ -79,6 +161,27 @@ SCHEMAS = {
             "required": ["q", "projection"]
         }
     },
+    "random_many": {
+        "payload": {
+            "type": "object",
+            "properties": {
+                "q": {
+                    "type": "object",
+                },
+                "n": {
+                    "type": "integer",
+                    "minimum": 1
+                },
+                "projection": {
+                    "type": "array",
+                    "contains": {
+                        "type": "string"
+                    }
+                }
+            },
+            "required": ["q", "n"]
+        }
+    },
     "append": {
         "payload": {
             "type": "object",
@@ -93,6 +196,23 @@ SCHEMAS = {
             "required": ["idempotency_key", "doc"]
         }
     },
+    "append_many": {
+        "payload": {
+            "type": "object",
+            "properties": {
+                "idempotency_key": {
+                    "type": "string",
+                },
+                "docs": {
+                    "type": "array",
+                    "items": {
+                        "type": "object"
+                    }
+                }
+            },
+            "required": ["idempotency_key", "docs"]
+        }
+    },
     "count": {
         "payload": {
             "type": "object",
@@ -103,5 +223,54 @@ SCHEMAS = {
             },
             "required": ["q"]
         }
+    },
+    "update_one": {
+        "payload": {
+            "type": "object",
+            "properties": {
+                "filter_q": {
+                    "type": "object",
+                },
+                "update_doc": {
+                    "type": "object",
+                }
+            },
+            "required": ["filter_q", "update_doc"]
+        }
+    },
+    "aggregate": {
+        "payload": {
+            "type": "object",
+            "properties": {
+                "pipeline": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "minProperties": 1,
+                        "maxProperties": 1
+                    }
+                },
+                "datetime_q": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "key": {
+                                "type": "string"
+                            },
+                            "op": {
+                                "type": "string",
+                                "enum": ["gt", "gte", "lt", "lte", "eq", "ne"]
+                            },
+                            "value": {
+                                "type": "integer"
+                            }
+                        },
+                        "required": ["key", "op", "value"]
+                    }
+                }
+            },
+            "required": ["pipeline"]
+        }
     }
 }
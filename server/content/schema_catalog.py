@@ -0,0 +1,129 @@
+import datetime
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from bson import ObjectId, Binary
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from .logging import logger
+
+FieldType = Tuple[str, Optional[str]]
+
+
+def type_name(value) -> str:
+    # bool before int, bool is a subclass of int
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, datetime.datetime):
+        return "date"
+    if isinstance(value, ObjectId):
+        return "oid"
+    if isinstance(value, (bytes, Binary)):
+        return "binary"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, (list, tuple)):
+        return "array"
+    return type(value).__name__
+
+
+class SchemaCatalog(object):
+    """
+    Top level field names of the content collection and the types seen for each, stored in a catalog collection.
+    Writes record their fields as they happen, only fields or types not seen before by this process reach MongoDB
+    """
+
+    REBUILD_BATCH_SIZE = 1000
+
+    def __init__(self, catalog_collection: Collection, content_collection: Collection):
+        self.catalog_collection = catalog_collection
+        self.content_collection = content_collection
+        self.known_field_types = set()  # type: Set[FieldType]
+        self._lock = threading.Lock()
+
+    def record_documents(self, docs: Iterable[Dict]):
+        field_types = set()
+        for doc in docs:
+            for field, value in doc.items():
+                field_types.add((field, type_name(value)))
+        self._record(field_types)
+
+    def record_update(self, update_doc: Dict):
+        field_types = set()
+        for operator, operator_doc in update_doc.items():
+            if type(operator_doc) != dict or operator == "$unset":
+                continue
+            for path, value in operator_doc.items():
+                if operator == "$rename":
+                    field_types.add((str(value).split(".")[0], None))
+                elif operator in ["$set", "$setOnInsert"] and "." not in path:
+                    field_types.add((path, type_name(value)))
+                else:
+                    # The type of a nested path or of an operator result is not known without reading the document
+                    field_types.add((path.split(".")[0], None))
+        self._record(field_types)
+
+    def fields(self) -> List[str]:
+        return list(map(lambda d: d["_id"], self.catalog_collection.find({"_id": {"$ne": "_id"}}, sort=[("_id", 1)])))
+
+    def describe(self) -> List[Dict]:
+        return list(map(
+            lambda d: {"field": d["_id"], "types": d.get("types", [])},
+            self.catalog_collection.find({}, sort=[("_id", 1)])
+        ))
+
+    def is_empty(self) -> bool:
+        return self.catalog_collection.find_one({}) is None
+
+    def rebuild(self, sample_size: Optional[int] = None) -> int:
+        """
+        Backfills the catalog from a $sample of sample_size documents, or from every document when None.
+        Fields are only added, a field no longer written stays in the catalog. Returns the documents read
+        """
+        if sample_size:
+            cursor = self.content_collection.aggregate([{"$sample": {"size": sample_size}}])
+        else:
+            cursor = self.content_collection.find({})
+        read_count = 0
+        batch = []
+        for document in cursor:
+            batch.append(document)
+            read_count += 1
+            if len(batch) == self.REBUILD_BATCH_SIZE:
+                self.record_documents(batch)
+                batch = []
+        self.record_documents(batch)
+        logger.info(f"Rebuilt schema catalog from {read_count} documents")
+        return read_count
+
+    def _record(self, field_types: Set[FieldType]):
+        with self._lock:
+            new_field_types = field_types - self.known_field_types
+        if not new_field_types:
+            return
+        now = datetime.datetime.utcnow()
+        types_by_field = {}  # type: Dict[str, List[str]]
+        for field, field_type in new_field_types:
+            types = types_by_field.setdefault(field, [])
+            if field_type:
+                types.append(field_type)
+        self.catalog_collection.bulk_write(
+            list(map(
+                lambda item: UpdateOne(
+                    {"_id": item[0]},
+                    {"$addToSet": {"types": {"$each": item[1]}}, "$setOnInsert": {"first_seen_at": now}},
+                    upsert=True
+                ),
+                types_by_field.items()
+            )),
+            ordered=False
+        )
+        with self._lock:
+            self.known_field_types |= new_field_types
@@ -1,11 +1,12 @@
 import pymongo
 from .objects.board_query import BoardQuery
 from typing import List, Tuple
+from common.mongo_client_registry import get_mongo_client
 
 
 class BoardsStore(object):
     def __init__(self, connection_string: str, db: str):
-        self.client = pymongo.MongoClient(connection_string)
+        self.client = get_mongo_client(connection_string)
         self.db = self.client[db]
         self.collection = self.db["broccoli.api.boards"]
 
@@ -0,0 +1,22 @@
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.getenv("WEB_THREADS", 4))
+worker_class = "gthread"
+# Each process must load the app itself, scheduler and leader election threads do not survive a fork
+preload_app = False
+graceful_timeout = 30
+
+if workers > 1:
+    # Writes of other processes reach each process through the content change log, but every process holds its
+    # own query cache, split the memory between them
+    os.environ.setdefault("CONTENT_CHANGE_LOG_ENABLED", "true")
+    os.environ.setdefault("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024 // workers))
+
+
+def worker_exit(server, worker):
+    # Hand the scheduler over right away instead of after the lease expires
+    from app import scheduler_leader_election
+    scheduler_leader_election.stop()
@@ -0,0 +1,110 @@
+import os
+import threading
+from typing import Dict, Tuple
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, \
+    EVENT_JOB_MAX_INSTANCES
+from apscheduler.executors.base import BaseExecutor
+from apscheduler.executors.pool import ThreadPoolExecutor, ProcessPoolExecutor
+from apscheduler.schedulers.base import BaseScheduler
+from .logging import logger
+
+
+class ExecutorPools(object):
+    """
+    Named executor pools of the scheduler, parsed from a spec like "default=thread:20,cpu=process:4",
+    and the saturation metrics of each pool
+    """
+
+    THREAD = "thread"
+    PROCESS = "process"
+    DEFAULT_EXECUTOR = "default"
+    # Reconciliation and other housekeeping jobs get their own pool so slow workers cannot starve them
+    SYSTEM_EXECUTOR = "broccoli.system"
+
+    def __init__(self, spec: str):
+        self.pools = {self.SYSTEM_EXECUTOR: (self.THREAD, 2)}  # type: Dict[str, Tuple[str, int]]
+        for pool_spec in filter(None, map(lambda p: p.strip(), spec.split(","))):
+            name, kind_and_size = pool_spec.split("=")
+            kind, size = kind_and_size.split(":")
+            if kind not in [self.THREAD, self.PROCESS]:
+                raise ValueError(f"Unknown executor kind {kind} of executor {name}")
+            self.pools[name.strip()] = (kind, int(size))
+        if self.DEFAULT_EXECUTOR not in self.pools:
+            self.pools[self.DEFAULT_EXECUTOR] = (self.THREAD, 20)
+
+        self._lock = threading.Lock()
+        self._job_executors = {}  # type: Dict[str, str]
+        self._counters = {}  # type: Dict[str, Dict[str, int]]
+        for name in self.pools.keys():
+            self._counters[name] = {
+                "running": 0,
+                "submitted": 0,
+                "succeeded": 0,
+                "failed": 0,
+                "missed": 0,
+                "max_instances_reached": 0
+            }
+
+    @staticmethod
+    def from_env() -> 'ExecutorPools':
+        return ExecutorPools(os.getenv("SCHEDULER_EXECUTORS", f"default=thread:20,cpu=process:{os.cpu_count() or 1}"))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.pools
+
+    def is_process_pool(self, name: str) -> bool:
+        return self.pools[name][0] == self.PROCESS
+
+    def build(self) -> Dict[str, BaseExecutor]:
+        executors = {}
+        for name, (kind, size) in self.pools.items():
+            if kind == self.THREAD:
+                executors[name] = ThreadPoolExecutor(max_workers=size)
+            else:
+                executors[name] = ProcessPoolExecutor(max_workers=size)
+        return executors
+
+    def listen(self, scheduler: BaseScheduler):
+        def on_event(event):
+            self._on_event(scheduler, event)
+        scheduler.add_listener(
+            on_event,
+            EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES
+        )
+
+    def metrics(self) -> Dict[str, Dict]:
+        with self._lock:
+            metrics = {}
+            for name, (kind, size) in self.pools.items():
+                counters = self._counters[name]
+                metrics[name] = dict(
+                    counters,
+                    kind=kind,
+                    size=size,
+                    saturation=counters["running"] / size
+                )
+            return metrics
+
+    def _on_event(self, scheduler: BaseScheduler, event):
+        # Completion events count against the executor the run was submitted to, even if the job is gone by then
+        if event.code == EVENT_JOB_SUBMITTED or event.job_id not in self._job_executors:
+            job = scheduler.get_job(event.job_id)
+            if not job or job.executor not in self._counters:
+                return
+            self._job_executors[event.job_id] = job.executor
+        with self._lock:
+            counters = self._counters[self._job_executors[event.job_id]]
+            if event.code == EVENT_JOB_SUBMITTED:
+                counters["submitted"] += 1
+                counters["running"] += 1
+            elif event.code == EVENT_JOB_EXECUTED:
+                counters["succeeded"] += 1
+                counters["running"] -= 1
+            elif event.code == EVENT_JOB_ERROR:
+                counters["failed"] += 1
+                counters["running"] -= 1
+            elif event.code == EVENT_JOB_MISSED:
+                counters["missed"] += 1
+            elif event.code == EVENT_JOB_MAX_INSTANCES:
+                counters["max_instances_reached"] += 1
+                logger.info(f"Job {event.job_id} skipped a run because max_instances is reached")
@@ -1,10 +1,11 @@
-import pymongo
 from typing import List, Dict
+from common.mongo_client_registry import get_mongo_client
+from .worker_context.metadata_store_impl import MetadataStoreImpl
 
 
 class GlobalMetadataStore(object):
     def __init__(self, connection_string: str, db: str):
-        self.client = pymongo.MongoClient(connection_string)
+        self.client = get_mongo_client(connection_string)
         self.db = self.client[db]
 
     def get_all(self, worker_id: str) -> List[Dict]:
@@ -18,12 +19,5 @@ class GlobalMetadataStore(object):
         return result
 
     def set_all(self, worker_id: str, metadata: List[Dict]):
-        collection = self.db[worker_id]
-        for m in metadata:
-            collection.update(
-                {"key": m["key"]},
-                {"$set": {
-                    "value": m["value"]
-                }},
-                upsert=True
-            )
+        # One bulk write, a key given more than once keeps its last value as it did with one update per key
+        MetadataStoreImpl.set_many_to(self.db[worker_id], dict(map(lambda m: (m["key"], m["value"]), metadata)))
@@ -0,0 +1,77 @@
+import threading
+from typing import Callable
+from pymongo.errors import PyMongoError
+from .lease_store import LeaseStore
+from .logging import logger
+
+
+class LeaderElection(object):
+    """
+    Keeps trying to hold one lease and renews it every third of its ttl while held.
+    on_elected runs when this process becomes the leader and on_deposed when it stops being one,
+    either on stop() or when a renewal fails, so a partitioned leader steps down before its lease expires.
+    A failing on_elected is followed by on_deposed and retried on the next run while the lease is held
+    """
+
+    def __init__(self, lease_store: LeaseStore, name: str, ttl_seconds: float, on_elected: Callable[[], None],
+                 on_deposed: Callable[[], None]):
+        self.lease_store = lease_store
+        self.name = name
+        self.owner = LeaseStore.new_owner()
+        self.ttl_seconds = ttl_seconds
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.is_leader = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"leader-election-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        if self.is_leader:
+            self._step_down()
+            try:
+                # Let another process take over right away instead of after the ttl
+                self.lease_store.release(self.name, self.owner)
+            except PyMongoError as e:
+                logger.error(f"Fails to release lease {self.name}, message {e}")
+
+    def run_once(self):
+        try:
+            held = self.lease_store.try_acquire(self.name, self.owner, self.ttl_seconds)
+        except PyMongoError as e:
+            logger.error(f"Fails to renew lease {self.name}, message {e}")
+            held = False
+        if held and not self.is_leader:
+            logger.info(f"{self.owner} is now the leader of {self.name}")
+            self.is_leader = True
+            try:
+                self.on_elected()
+            except Exception:
+                # Still holding the lease, the next run tries again from a clean state
+                logger.exception(f"Fails to take over as the leader of {self.name}")
+                self._step_down()
+        elif not held and self.is_leader:
+            logger.info(f"{self.owner} is no longer the leader of {self.name}")
+            self._step_down()
+
+    def _step_down(self):
+        self.is_leader = False
+        try:
+            self.on_deposed()
+        except Exception:
+            logger.exception(f"Fails to step down as the leader of {self.name}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                # Whatever fails, keep the process in the election
+                logger.exception(f"Fails to run the election of {self.name}")
+            self._stopped.wait(self.ttl_seconds / 3)
@@ -0,0 +1,65 @@
+import os
+import re
+import socket
+import uuid
+import datetime
+from typing import Dict, List, Optional, Set
+from pymongo.errors import DuplicateKeyError
+from common.mongo_client_registry import get_mongo_client
+
+
+class LeaseStore(object):
+    """
+    Named leases with an owner and an expiry, so that only one process at a time holds each of them.
+    Expiry uses the clock of the acquiring process, clocks must agree to well within a lease's ttl
+    """
+
+    def __init__(self, connection_string: str, db: str):
+        self.client = get_mongo_client(connection_string)
+        self.db = self.client[db]
+        self.collection = self.db['broccoli.leases']
+
+    @staticmethod
+    def new_owner() -> str:
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def try_acquire(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        """
+        Acquires the lease when it is free or expired, or extends it when owner already holds it
+        """
+        now = datetime.datetime.utcnow()
+        try:
+            self.collection.update_one(
+                {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + datetime.timedelta(seconds=ttl_seconds),
+                          "renewed_at": now}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Held by someone else, the upsert collides with their lease
+            return False
+        return True
+
+    def release(self, name: str, owner: str):
+        self.collection.delete_one({"_id": name, "owner": owner})
+
+    def get(self, name: str) -> Optional[Dict]:
+        return self.collection.find_one({"_id": name})
+
+    def live(self, prefix: str) -> List[Dict]:
+        """
+        Unexpired leases whose names start with prefix
+        """
+        return list(self.collection.find({
+            "_id": {"$regex": f"^{re.escape(prefix)}"},
+            "expires_at": {"$gt": datetime.datetime.utcnow()}
+        }))
+
+    def held(self, prefix: str, owner: str) -> Set[str]:
+        """
+        Names of the leases starting with prefix that owner holds or held last, expired or not
+        """
+        return set(map(
+            lambda d: d["_id"],
+            self.collection.find({"_id": {"$regex": f"^{re.escape(prefix)}"}, "owner": owner}, projection=["_id"])
+        ))
@@ -0,0 +1,40 @@
+from typing import Dict, Optional, Tuple
+from common.in_process_rpc_client import InProcessRpcClient
+from content.content_store import ContentStore
+from broccoli_plugin_interface.worker_manager.worker import Worker
+from .load_object import load_object
+from .logging import logger
+from .worker_metrics import RunReport, run_worker
+from .worker_context.work_context_impl import WorkContextImpl
+from .worker_context.instrumented_rpc_client import InstrumentedRpcClient
+
+# Per worker process state, built on the first run of a worker in that process
+_rpc_client = None
+_workers = {}  # type: Dict[str, Tuple[Worker, WorkContextImpl, RunReport]]
+
+
+def work_in_process(worker_id: str, module: str, class_name: str, args: Dict) -> Optional[Dict]:
+    """
+    Entry point of workers scheduled on a process pool. Closures cannot be sent to another process,
+    so the worker is loaded, given a context and pre_work'ed inside the pool process instead.
+    Returns the run report that WorkerMetrics picks up from the job executed event
+    """
+    global _rpc_client
+    if not _rpc_client:
+        # Writes reach the web processes through the content change log
+        _rpc_client = InProcessRpcClient(ContentStore.from_env())
+    if worker_id not in _workers:
+        status, worker_or_message = load_object(module, class_name, args)
+        if not status:
+            logger.error(f"Fails to load worker module={module} class_name={class_name} args={args}, "
+                         f"message {worker_or_message}")
+            return None
+        run_report = RunReport()
+        work_context = WorkContextImpl(worker_id, InstrumentedRpcClient(_rpc_client, worker_id, run_report))
+        worker_or_message.pre_work(work_context)
+        work_context.end_run()
+        _workers[worker_id] = (worker_or_message, work_context, run_report)
+
+    worker, work_context, run_report = _workers[worker_id]
+    seconds, succeeded = run_worker(worker_id, worker, work_context)
+    return run_report.drain(seconds, succeeded)
@@ -1,35 +1,102 @@
-import traceback
-from typing import Set
+import datetime
+import threading
+from typing import Dict, Optional, Set
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+from apscheduler.jobstores.base import JobLookupError
 from apscheduler.schedulers.base import BaseScheduler
 from .worker_config_store import WorkerConfigStore
 from .load_object import load_object
+from .executor_pools import ExecutorPools
+from .process_work import work_in_process
+from .worker_metrics import WorkerMetrics, run_worker
+from .worker_assignment import WorkerAssignment
 from .logging import logger
 from .worker_context.work_context_impl import WorkContextImpl
+from .worker_context.instrumented_rpc_client import InstrumentedRpcClient
 from broccoli_plugin_interface.rpc_client import RpcClient
 
 
 class Reconciler(object):
     RECONCILE_JOB_ID = "broccoli.worker_reconcile"
 
-    def __init__(self, worker_config_store: WorkerConfigStore, rpc_client: RpcClient):
+    def __init__(self, worker_config_store: WorkerConfigStore, rpc_client: RpcClient, executor_pools: ExecutorPools,
+                 worker_metrics: WorkerMetrics, worker_assignment: Optional[WorkerAssignment] = None):
         self.worker_config_store = worker_config_store
         self.scheduler = None
         self.rpc_client = rpc_client
+        self.executor_pools = executor_pools
+        self.worker_metrics = worker_metrics
+        # Set in cluster mode, where this node only runs the workers it holds leases for
+        self.worker_assignment = worker_assignment
+        # Worker config version the scheduled jobs match, None to diff again on the next reconcile
+        self.reconciled_version = None  # type: Optional[int]
+        # Runs submitted and not finished yet by job id. Removing a job does not stop its run, a removed or moved
+        # worker must not start again, here or on another node, before that run ends
+        self._running = {}  # type: Dict[str, int]
+        self._running_lock = threading.Lock()
 
     def set_scheduler(self, scheduler: BaseScheduler):
         self.scheduler = scheduler
+        self.reconciled_version = None
+        with self._running_lock:
+            self._running = {}
+        scheduler.add_listener(self._on_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+
+    def running_job_ids(self) -> Set[str]:
+        with self._running_lock:
+            # A run can end before its submission is reported, leaving a count of -1 for a moment
+            return set(job_id for job_id, running in self._running.items() if running > 0)
+
+    def _on_event(self, event):
+        # One submission covers every run time of a run that is not coalesced, each of them ends with its own event
+        runs = len(event.scheduled_run_times) if event.code == EVENT_JOB_SUBMITTED else -1
+        with self._running_lock:
+            running = self._running.get(event.job_id, 0) + runs
+            if running:
+                self._running[event.job_id] = running
+            else:
+                del self._running[event.job_id]
+
+    def trigger(self):
+        """
+        Moves the next reconcile to now, it still runs as the scheduled job so that reconciles never overlap.
+        Does nothing in a process without a running scheduler, the leader notices the change by its version
+        """
+        if not self.scheduler:
+            return
+        try:
+            self.scheduler.modify_job(self.RECONCILE_JOB_ID, next_run_time=datetime.datetime.now())
+        except JobLookupError:
+            logger.debug("Reconcile job is not scheduled")
 
     def reconcile(self):
         if not self.scheduler:
             logger.error("scheduler is not configured!")
             return
-        actual_job_ids = set(map(lambda j: j.id, self.scheduler.get_jobs())) - {self.RECONCILE_JOB_ID}  # type: Set[str]
+        version = self.worker_config_store.get_version()
+        # In cluster mode the leases need renewing and nodes may have come or gone, so always diff
+        if version == self.reconciled_version and not self.worker_assignment:
+            logger.debug(f"Worker config is still at version {version}")
+            return
+        # Housekeeping jobs such as this one run on the system executor and are not workers
+        worker_jobs = filter(lambda j: j.executor != ExecutorPools.SYSTEM_EXECUTOR, self.scheduler.get_jobs())
+        actual_job_ids = set(map(lambda j: j.id, worker_jobs))  # type: Set[str]
         desired_jobs = self.worker_config_store.get_all()
+        if self.worker_assignment:
+            claimed_job_ids = self.worker_assignment.claim(desired_jobs.keys(), self.running_job_ids())
+            desired_jobs = {job_id: job for job_id, job in desired_jobs.items() if job_id in claimed_job_ids}
         desired_job_ids = desired_jobs.keys()  # type: Set[str]
 
         self.remove_jobs(actual_job_ids=actual_job_ids, desired_job_ids=desired_job_ids)
-        self.add_jobs(actual_job_ids=actual_job_ids, desired_job_ids=desired_job_ids, desired_jobs=desired_jobs)
-        self.configure_jobs(actual_job_ids=actual_job_ids, desired_job_ids=desired_job_ids, desired_jobs=desired_jobs)
+        if self.worker_assignment:
+            # Only now that their jobs are gone may other nodes pick the workers up, once their last run ended
+            self.worker_assignment.release_unclaimed()
+        all_added = self.add_jobs(actual_job_ids=actual_job_ids, desired_job_ids=desired_job_ids,
+                                  desired_jobs=desired_jobs)
+        all_configured = self.configure_jobs(actual_job_ids=actual_job_ids, desired_job_ids=desired_job_ids,
+                                             desired_jobs=desired_jobs)
+        # A worker that fails to load is retried on every reconcile, as before
+        self.reconciled_version = version if all_added and all_configured else None
 
     def remove_jobs(self, actual_job_ids: Set[str], desired_job_ids: Set[str]):
         removed_job_ids = actual_job_ids - desired_job_ids
@@ -40,45 +107,80 @@ class Reconciler(object):
         for removed_job_id in removed_job_ids:
             self.scheduler.remove_job(job_id=removed_job_id)
 
-    def add_jobs(self, actual_job_ids: Set[str], desired_job_ids: Set[str], desired_jobs):
+    def add_jobs(self, actual_job_ids: Set[str], desired_job_ids: Set[str], desired_jobs) -> bool:
         added_job_ids = desired_job_ids - actual_job_ids
         if not added_job_ids:
             logger.debug(f"No job to add")
-            return
+            return True
+        # A job removed while running is only added back once that run ended
+        running_job_ids = added_job_ids & self.running_job_ids()
+        if running_job_ids:
+            logger.info(f"Waiting for the runs of removed jobs with id {running_job_ids} before adding them back")
+            added_job_ids = added_job_ids - running_job_ids
         logger.info(f"Going to add jobs with id {added_job_ids}")
-        for added_job_id in added_job_ids:
-            self.add_job(added_job_id, desired_jobs)
-
-    def add_job(self, added_job_id: str, desired_jobs):
-        module, class_name, args, interval_seconds = desired_jobs[added_job_id]
-        status, worker_or_message = load_object(module, class_name, args)
-        if not status:
-            logger.error(f"Fails to add worker module={module} class_name={class_name} args={args}, "
-                         f"message {worker_or_message}")
-            return
-        work_context = WorkContextImpl(added_job_id, self.rpc_client)
-        worker_or_message.pre_work(work_context)
+        all_added = all(list(map(lambda added_job_id: self.add_job(added_job_id, desired_jobs), added_job_ids)))
+        return all_added and not running_job_ids
 
-        def work_wrap():
-            try:
-                worker_or_message.work(work_context)
-            except Exception as e:
-                traceback.print_exc()
-                logger.error(f"Fail to execute work for {added_job_id}, message {e}")
+    def add_job(self, added_job_id: str, desired_jobs) -> bool:
+        module, class_name, args, interval_seconds, scheduling = desired_jobs[added_job_id]
+        executor = self._resolve_executor(added_job_id, scheduling)
+        if self.executor_pools.is_process_pool(executor):
+            # The worker is loaded inside the pool process on its first run
+            func = work_in_process
+            func_args = [added_job_id, module, class_name, args]
+        else:
+            status, worker_or_message = load_object(module, class_name, args)
+            if not status:
+                logger.error(f"Fails to add worker module={module} class_name={class_name} args={args}, "
+                             f"message {worker_or_message}")
+                return False
+            work_context = WorkContextImpl(
+                added_job_id,
+                InstrumentedRpcClient(self.rpc_client, added_job_id, self.worker_metrics)
+            )
+            worker_or_message.pre_work(work_context)
+            work_context.end_run()
+
+            def work_wrap():
+                seconds, succeeded = run_worker(added_job_id, worker_or_message, work_context)
+                self.worker_metrics.record_run(added_job_id, seconds, succeeded)
+            func = work_wrap
+            func_args = []
 
         self.scheduler.add_job(
-            work_wrap,
+            func,
+            args=func_args,
             id=added_job_id,
             trigger='interval',
-            seconds=interval_seconds
+            seconds=interval_seconds,
+            executor=executor,
+            max_instances=scheduling["max_instances"],
+            coalesce=scheduling["coalesce"],
+            misfire_grace_time=scheduling["misfire_grace_time"]
         )
+        return True
 
-    def configure_jobs(self, actual_job_ids: Set[str], desired_job_ids: Set[str], desired_jobs):
+    def configure_jobs(self, actual_job_ids: Set[str], desired_job_ids: Set[str], desired_jobs) -> bool:
         # todo: configure job if worker.work bytecode changes..?
         same_job_ids = actual_job_ids.intersection(desired_job_ids)
+        all_configured = True
         for job_id in same_job_ids:
-            _1, _2, _3, desired_interval_seconds = desired_jobs[job_id]
-            actual_interval_seconds = self.scheduler.get_job(job_id).trigger.interval.seconds
+            _1, _2, _3, desired_interval_seconds, desired_scheduling = desired_jobs[job_id]
+            job = self.scheduler.get_job(job_id)
+            desired_executor = self._resolve_executor(job_id, desired_scheduling)
+            if desired_executor != job.executor:
+                if job_id in self.running_job_ids():
+                    # No new run in the old executor, the job moves on a later reconcile once the current run ended
+                    if job.next_run_time:
+                        logger.info(f"Pausing job with id {job_id} until its run ends to move it")
+                        self.scheduler.pause_job(job_id)
+                    all_configured = False
+                    continue
+                logger.info(f"Going to move job with id {job_id} to executor {desired_executor}")
+                self.scheduler.remove_job(job_id=job_id)
+                all_configured = self.add_job(job_id, desired_jobs) and all_configured
+                continue
+            actual_interval_seconds = job.trigger.interval.seconds
             if desired_interval_seconds != actual_interval_seconds:
                 logger.info(f"Going to reconfigure job interval with id {job_id} to {desired_interval_seconds} seconds")
                 self.scheduler.reschedule_job(
@@ -86,3 +188,24 @@ class Reconciler(object):
                     trigger='interval',
                     seconds=desired_interval_seconds
                 )
+            actual_scheduling = {
+                "max_instances": job.max_instances,
+                "coalesce": job.coalesce,
+                "misfire_grace_time": job.misfire_grace_time
+            }
+            changes = {}
+            for key, actual_value in actual_scheduling.items():
+                if desired_scheduling[key] != actual_value:
+                    changes[key] = desired_scheduling[key]
+            if changes:
+                logger.info(f"Going to reconfigure job with id {job_id} with {changes}")
+                self.scheduler.modify_job(job_id=job_id, **changes)
+        return all_configured
+
+    def _resolve_executor(self, job_id: str, scheduling) -> str:
+        executor = scheduling["executor"]
+        if executor not in self.executor_pools:
+            logger.error(f"Executor {executor} of worker {job_id} does not exist, "
+                         f"using {ExecutorPools.DEFAULT_EXECUTOR}")
+            return ExecutorPools.DEFAULT_EXECUTOR
+        return executor
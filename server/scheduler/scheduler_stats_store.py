@@ -0,0 +1,44 @@
+import datetime
+from typing import Dict, List, Optional
+from common.mongo_client_registry import get_mongo_client
+
+
+class SchedulerStatsStore(object):
+    """
+    Worker and executor metrics, and the Prometheus exposition of the registry, as last published by each scheduler
+    leader, so that every process serving the API answers with them and not only the process running the scheduler
+    """
+
+    def __init__(self, connection_string: str, db: str):
+        self.client = get_mongo_client(connection_string)
+        self.db = self.client[db]
+        self.collection = self.db['broccoli.scheduler_stats']
+
+    def publish(self, name: str, owner: str, workers: Dict[str, Dict], executors: Dict[str, Dict], jobs: int,
+                metrics: str = ""):
+        # Worker ids and executor names go into values rather than keys, they may contain dots
+        self.collection.replace_one({"_id": name}, {
+            "owner": owner,
+            "published_at": datetime.datetime.utcnow(),
+            "workers": SchedulerStatsStore._to_list("worker_id", workers),
+            "executors": SchedulerStatsStore._to_list("executor", executors),
+            "jobs": jobs,
+            "metrics": metrics
+        }, upsert=True)
+
+    def get(self, name: str) -> Optional[Dict]:
+        document = self.collection.find_one({"_id": name})
+        if not document:
+            return None
+        return {
+            "owner": document["owner"],
+            "published_at": document["published_at"],
+            "workers": dict(map(lambda d: (d["worker_id"], d["stats"]), document["workers"])),
+            "executors": dict(map(lambda d: (d["executor"], d["stats"]), document["executors"])),
+            "jobs": document["jobs"],
+            "metrics": document.get("metrics", "")
+        }
+
+    @staticmethod
+    def _to_list(key: str, stats: Dict[str, Dict]) -> List[Dict]:
+        return list(map(lambda item: {key: item[0], "stats": item[1]}, stats.items()))
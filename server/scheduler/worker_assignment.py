@@ -0,0 +1,62 @@
+import hashlib
+from typing import Iterable, Set
+from .lease_store import LeaseStore
+from .logging import logger
+
+
+class WorkerAssignment(object):
+    """
+    Splits workers between the nodes of a cluster. Every node keeps a node lease alive, and each worker goes to
+    the live node that ranks highest for it by rendezvous hashing, so a joining or leaving node only moves its
+    own share. A node runs a worker only while it holds the lease of that worker, and gives the lease up only
+    after it has stopped scheduling the worker
+    """
+
+    NODE_LEASE_PREFIX = "broccoli.node."
+    WORKER_LEASE_PREFIX = "broccoli.worker_lease."
+
+    def __init__(self, lease_store: LeaseStore, owner: str, ttl_seconds: float):
+        self.lease_store = lease_store
+        self.owner = owner
+        self.ttl_seconds = ttl_seconds
+        self._releasable = set()  # type: Set[str]
+
+    def claim(self, worker_ids: Iterable[str], busy_worker_ids: Iterable[str] = ()) -> Set[str]:
+        """
+        Renews or acquires the leases of the workers this node should run and returns their ids.
+        Leases held for other workers are only released by the release_unclaimed() that follows, except for
+        busy workers still running here, whose leases are renewed until their run ends
+        """
+        self.lease_store.try_acquire(self.NODE_LEASE_PREFIX + self.owner, self.owner, self.ttl_seconds)
+        nodes = list(map(lambda d: d["owner"], self.lease_store.live(self.NODE_LEASE_PREFIX)))
+        if self.owner not in nodes:
+            nodes.append(self.owner)
+        claimed = set()
+        for worker_id in worker_ids:
+            if WorkerAssignment.preferred_node(worker_id, nodes) != self.owner:
+                continue
+            if self.lease_store.try_acquire(self.WORKER_LEASE_PREFIX + worker_id, self.owner, self.ttl_seconds):
+                claimed.add(worker_id)
+        held = self.lease_store.held(self.WORKER_LEASE_PREFIX, self.owner)
+        claimed_names = set(map(lambda worker_id: self.WORKER_LEASE_PREFIX + worker_id, claimed))
+        busy_names = set(map(lambda worker_id: self.WORKER_LEASE_PREFIX + worker_id, busy_worker_ids))
+        for name in (held & busy_names) - claimed_names:
+            self.lease_store.try_acquire(name, self.owner, self.ttl_seconds)
+        self._releasable = held - claimed_names - busy_names
+        return claimed
+
+    def release_unclaimed(self):
+        for name in self._releasable:
+            logger.info(f"{self.owner} hands over {name}")
+            self.lease_store.release(name, self.owner)
+        self._releasable = set()
+
+    def release_all(self):
+        for name in self.lease_store.held(self.WORKER_LEASE_PREFIX, self.owner):
+            self.lease_store.release(name, self.owner)
+        self.lease_store.release(self.NODE_LEASE_PREFIX + self.owner, self.owner)
+        self._releasable = set()
+
+    @staticmethod
+    def preferred_node(worker_id: str, nodes: Iterable[str]) -> str:
+        return max(nodes, key=lambda node: hashlib.sha1(f"{node}/{worker_id}".encode("utf-8")).digest())
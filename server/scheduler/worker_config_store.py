@@ -1,16 +1,27 @@
-import pymongo
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 from .logging import logger
 from .load_object import load_object
+from common.mongo_client_registry import get_mongo_client
 
 
 class WorkerConfigStore(object):
+    DEFAULT_SCHEDULING = {
+        "executor": "default",
+        "max_instances": 1,
+        "coalesce": False,
+        "misfire_grace_time": 1
+    }
+    VERSION_ID = "workers"
+
     def __init__(self, connection_string: str, db: str):
-        self.client = pymongo.MongoClient(connection_string)
+        self.client = get_mongo_client(connection_string)
         self.db = self.client[db]
         self.collection = self.db['broccoli.workers']
+        # A counter bumped on every change, so readers can tell whether anything changed without reading workers
+        self.version_collection = self.db['broccoli.workers_version']
 
-    def add(self, module: str, class_name: str, args: Dict, interval_seconds: int) -> Tuple[bool, str]:
+    def add(self, module: str, class_name: str, args: Dict, interval_seconds: int,
+            scheduling: Optional[Dict] = None) -> Tuple[bool, str]:
         # todo: garbage collect this w?
         status, worker_or_message = load_object(module, class_name, args)
         if not status:
@@ -27,11 +38,13 @@ class WorkerConfigStore(object):
             "module": module,
             "class_name": class_name,
             "args": args,
-            "interval_seconds": interval_seconds
+            "interval_seconds": interval_seconds,
+            "scheduling": WorkerConfigStore._with_default_scheduling(scheduling)
         })
+        self._bump_version()
         return True, worker_id
 
-    def get_all(self) -> Dict[str, Tuple[str, str, Dict, int]]:
+    def get_all(self) -> Dict[str, Tuple[str, str, Dict, int, Dict]]:
         res = {}
         # todo: find fails?
         for document in self.collection.find():
@@ -39,7 +52,8 @@ class WorkerConfigStore(object):
                 document["module"],
                 document["class_name"],
                 document["args"],
-                document["interval_seconds"]
+                document["interval_seconds"],
+                WorkerConfigStore._with_default_scheduling(document.get("scheduling"))
             )
         return res
 
@@ -49,6 +63,7 @@ class WorkerConfigStore(object):
             return False, f"Worker with id {worker_id} does not exist"
         # todo: delete_one fails?
         self.collection.delete_one({"worker_id": worker_id})
+        self._bump_version()
         return True, ""
 
     def update_interval_seconds(self, worker_id: str, interval_seconds: int) -> Tuple[bool, str]:
@@ -57,4 +72,30 @@ class WorkerConfigStore(object):
             return False, f"Worker with id {worker_id} does not exist"
         # todo: update_one fails
         self.collection.update_one({"worker_id": worker_id}, {"$set": {"interval_seconds": interval_seconds}})
+        self._bump_version()
+        return True, ""
+
+    def update_scheduling(self, worker_id: str, scheduling: Dict) -> Tuple[bool, str]:
+        existing_doc = self.collection.find_one({"worker_id": worker_id})
+        if not existing_doc:
+            return False, f"Worker with id {worker_id} does not exist"
+        # todo: update_one fails
+        self.collection.update_one(
+            {"worker_id": worker_id},
+            {"$set": {"scheduling": WorkerConfigStore._with_default_scheduling(
+                dict(existing_doc.get("scheduling", {}), **scheduling)
+            )}}
+        )
+        self._bump_version()
         return True, ""
+
+    def get_version(self) -> int:
+        document = self.version_collection.find_one({"_id": self.VERSION_ID})
+        return document["version"] if document else 0
+
+    def _bump_version(self):
+        self.version_collection.update_one({"_id": self.VERSION_ID}, {"$inc": {"version": 1}}, upsert=True)
+
+    @staticmethod
+    def _with_default_scheduling(scheduling: Optional[Dict]) -> Dict:
+        return dict(WorkerConfigStore.DEFAULT_SCHEDULING, **(scheduling or {}))
@@ -0,0 +1,120 @@
+import os
+import copy
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from broccoli_plugin_interface.worker_manager.metadata_store import MetadataStore
+from .metadata_store_impl import MetadataStoreImpl
+
+_ABSENT = object()
+
+
+class OtherWorkerKeys(object):
+    """
+    Keys read from the metadata of other workers, shared by every worker of the process. An entry lives for
+    ttl_seconds, or until the worker owning it flushes in this process
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}  # type: Dict[Tuple[str, str], Tuple[Any, float]]
+        self._lock = threading.Lock()
+
+    def get(self, worker_id: str, key: str, load: Callable[[], Any]):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((worker_id, key))
+        if entry and now - entry[1] < self.ttl_seconds:
+            return entry[0]
+        value = load()
+        with self._lock:
+            self._entries[(worker_id, key)] = (value, now)
+        return value
+
+    def invalidate(self, worker_id: str, keys: List[str]):
+        with self._lock:
+            for key in keys:
+                self._entries.pop((worker_id, key), None)
+
+
+OTHER_WORKER_KEYS = OtherWorkerKeys(ttl_seconds=float(os.getenv("METADATA_CACHE_TTL_SECONDS", 5)))
+
+
+class CachedMetadataStore(MetadataStore):
+    """
+    Write-back cache in front of the metadata of one worker. A key is read from MongoDB at most once per run
+    and writes are held until flush(), which sends every dirty key in one bulk_write. end_run() flushes and
+    forgets what was read, so edits made elsewhere between runs are seen by the next run.
+    When flush_interval_seconds is set, a write also flushes once that long has passed since the last flush
+    """
+
+    def __init__(self, metadata_store: MetadataStoreImpl, worker_id: str,
+                 flush_interval_seconds: Optional[float] = None, other_worker_keys: OtherWorkerKeys = None):
+        self.metadata_store = metadata_store
+        self.worker_id = worker_id
+        self.flush_interval_seconds = flush_interval_seconds
+        self.other_worker_keys = other_worker_keys or OTHER_WORKER_KEYS
+        self._values = {}  # type: Dict[str, Any]
+        self._dirty = set()
+        self._last_flushed_at = time.monotonic()
+        self._lock = threading.RLock()
+
+    def exists(self, key: str) -> bool:
+        return key in self.get_many([key])
+
+    def get(self, key: str):
+        values = self.get_many([key])
+        if key not in values:
+            raise KeyError(key)
+        return values[key]
+
+    def set(self, key: str, value):
+        self.set_many({key: value})
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        with self._lock:
+            unread_keys = list(filter(lambda k: k not in self._values, keys))
+            if unread_keys:
+                loaded = self.metadata_store.get_many(unread_keys)
+                for key in unread_keys:
+                    self._values[key] = loaded.get(key, _ABSENT)
+            # Copies, so that changing a returned value does not change the cache behind set()'s back
+            return {key: copy.deepcopy(self._values[key]) for key in keys if self._values[key] is not _ABSENT}
+
+    def set_many(self, values: Dict[str, Any]):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = copy.deepcopy(value)
+                self._dirty.add(key)
+            if self.flush_interval_seconds is not None \
+                    and time.monotonic() - self._last_flushed_at >= self.flush_interval_seconds:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            dirty_values = {key: self._values[key] for key in self._dirty}
+            self.metadata_store.set_many(dirty_values)
+            self._dirty = set()
+            self._last_flushed_at = time.monotonic()
+        self.other_worker_keys.invalidate(self.worker_id, list(dirty_values.keys()))
+
+    def end_run(self):
+        with self._lock:
+            self.flush()
+            self._values = {}
+
+    def get_from_another_worker(self, worker_id: str, key: str):
+        value = self._get_from_another_worker(worker_id, key)
+        if value is _ABSENT:
+            raise KeyError(key)
+        return copy.deepcopy(value)
+
+    def exists_in_another_worker(self, worker_id: str, key: str):
+        return self._get_from_another_worker(worker_id, key) is not _ABSENT
+
+    def _get_from_another_worker(self, worker_id: str, key: str):
+        return self.other_worker_keys.get(
+            worker_id,
+            key,
+            lambda: MetadataStoreImpl.get_many_from(self.metadata_store.db[worker_id], [key]).get(key, _ABSENT)
+        )
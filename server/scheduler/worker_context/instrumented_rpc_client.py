@@ -0,0 +1,73 @@
+import time
+from typing import Dict, List, Optional, Tuple
+from broccoli_plugin_interface.rpc_client import RpcClient
+
+
+class InstrumentedRpcClient(RpcClient):
+    """
+    Times every call of the wrapped client and records it against the worker making it.
+    metrics is anything with a record_rpc_call(worker_id, verb, seconds, succeeded) method
+    """
+
+    def __init__(self, rpc_client: RpcClient, worker_id: str, metrics):
+        self.rpc_client = rpc_client
+        self.worker_id = worker_id
+        self.metrics = metrics
+
+    def _call(self, verb: str, func, *args):
+        started_at = time.perf_counter()
+        succeeded = False
+        try:
+            result = func(*args)
+            succeeded = True
+            return result
+        finally:
+            self.metrics.record_rpc_call(self.worker_id, verb, time.perf_counter() - started_at, succeeded)
+
+    def blocking_query(self, q: Dict, limit: Optional[int] = None, projection: List[str] = None,
+                       sort: Dict[str, int] = None, datetime_q: List[Dict] = None) -> List[Dict]:
+        return self._call("query", self.rpc_client.blocking_query, q, limit, projection, sort, datetime_q)
+
+    def blocking_query_page(self, q: Dict, page_size: int, resume_token: Optional[str] = None,
+                            projection: List[str] = None, sort: Dict[str, int] = None,
+                            datetime_q: List[Dict] = None) -> Tuple[List[Dict], Optional[str]]:
+        return self._call("query_page", self.rpc_client.blocking_query_page, q, page_size, resume_token, projection,
+                          sort, datetime_q)
+
+    def blocking_update_one(self, filter_q: Dict, update_doc: Dict):
+        return self._call("update_one", self.rpc_client.blocking_update_one, filter_q, update_doc)
+
+    def blocking_update_one_binary_string(self, filter_q: Dict, key: str, binary_string: List[bool]):
+        return self._call("update_one_binary_string", self.rpc_client.blocking_update_one_binary_string, filter_q,
+                          key, binary_string)
+
+    def blocking_bulk_update_one(self, ops: List[Tuple[Dict, Dict]]) -> Dict[str, int]:
+        return self._call("bulk_update_one", self.rpc_client.blocking_bulk_update_one, ops)
+
+    def blocking_bulk_update_one_binary_string(self, ops: List[Tuple[Dict, str, List[bool]]]) -> Dict[str, int]:
+        return self._call("bulk_update_one_binary_string", self.rpc_client.blocking_bulk_update_one_binary_string,
+                          ops)
+
+    def blocking_append(self, idempotency_key: str, doc: Dict):
+        return self._call("append", self.rpc_client.blocking_append, idempotency_key, doc)
+
+    def blocking_append_many(self, idempotency_key: str, docs: List[Dict]) -> List[str]:
+        return self._call("append_many", self.rpc_client.blocking_append_many, idempotency_key, docs)
+
+    def blocking_random_one(self, q: Dict, projection: List[str]) -> Optional[Dict]:
+        return self._call("random_one", self.rpc_client.blocking_random_one, q, projection)
+
+    def blocking_random_many(self, q: Dict, n: int, projection: List[str] = None) -> List[Dict]:
+        return self._call("random_many", self.rpc_client.blocking_random_many, q, n, projection)
+
+    def blocking_count(self, q: Dict) -> int:
+        return self._call("count", self.rpc_client.blocking_count, q)
+
+    def blocking_aggregate(self, pipeline: List[Dict], datetime_q: List[Dict] = None) -> List[Dict]:
+        return self._call("aggregate", self.rpc_client.blocking_aggregate, pipeline, datetime_q)
+
+    def blocking_query_n_nearest_hamming_neighbors(self, q: Dict, binary_string_key: str, from_binary_string: str,
+                                                   pick_n: int, projection: List[str] = None) -> List[Dict]:
+        return self._call("query_n_nearest_hamming_neighbors",
+                          self.rpc_client.blocking_query_n_nearest_hamming_neighbors, q, binary_string_key,
+                          from_binary_string, pick_n, projection)
@@ -1,10 +1,12 @@
-import pymongo
+from typing import Any, Dict, List
+from pymongo import UpdateOne
 from broccoli_plugin_interface.worker_manager.metadata_store import MetadataStore
+from common.mongo_client_registry import get_mongo_client
 
 
 class MetadataStoreImpl(MetadataStore):
     def __init__(self, connection_string: str, db: str, collection_name: str):
-        self.client = pymongo.MongoClient(connection_string)
+        self.client = get_mongo_client(connection_string)
         self.db = self.client[db]
         self.collection = self.db[collection_name]
 
@@ -19,6 +21,12 @@ class MetadataStoreImpl(MetadataStore):
     def set(self, key: str, value):
         self.collection.update_one({'key': key}, {'$set': {'value': value}}, upsert=True)
 
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        return MetadataStoreImpl.get_many_from(self.collection, keys)
+
+    def set_many(self, values: Dict[str, Any]):
+        MetadataStoreImpl.set_many_to(self.collection, values)
+
     def get_from_another_worker(self, worker_id: str, key: str):
         collection = self.db[worker_id]
         doc = collection.find_one({'key': key})
@@ -28,3 +36,18 @@ class MetadataStoreImpl(MetadataStore):
         collection = self.db[worker_id]
         count = collection.count_documents({'key': key})
         return count != 0
+
+    @staticmethod
+    def get_many_from(collection, keys: List[str]) -> Dict[str, Any]:
+        if not keys:
+            return {}
+        return dict(map(lambda doc: (doc['key'], doc['value']), collection.find({'key': {'$in': list(keys)}})))
+
+    @staticmethod
+    def set_many_to(collection, values: Dict[str, Any]):
+        if not values:
+            return
+        collection.bulk_write(list(map(
+            lambda item: UpdateOne({'key': item[0]}, {'$set': {'value': item[1]}}, upsert=True),
+            values.items()
+        )), ordered=False)
@@ -1,10 +1,14 @@
+import os
 import logging
 from .metadata_store_impl import MetadataStoreImpl
+from .cached_metadata_store import CachedMetadataStore
 from common.logging import DefaultHandler, get_logging_level
 from common.getenv_or_raise import getenv_or_raise
+from broccoli_plugin_interface.thread_pool_async_rpc_client import ThreadPoolAsyncRpcClient
 from broccoli_plugin_interface.worker_manager.work_context import WorkContext
 from broccoli_plugin_interface.worker_manager.metadata_store import MetadataStore
 from broccoli_plugin_interface.rpc_client import RpcClient
+from broccoli_plugin_interface.async_rpc_client import AsyncRpcClient
 
 
 class WorkContextImpl(WorkContext):
@@ -14,16 +18,32 @@ class WorkContextImpl(WorkContext):
         self._logger.addHandler(DefaultHandler)
 
         self._rpc_client = rpc_client
-        self._metadata_store = MetadataStoreImpl(
-            connection_string=getenv_or_raise("MONGODB_CONNECTION_STRING"),
-            db=getenv_or_raise("MONGODB_DB"),
-            collection_name=worker_id
+        # Calls of the async client go through the same, possibly instrumented, blocking client
+        self._async_rpc_client = ThreadPoolAsyncRpcClient(rpc_client)
+        self._metadata_store = CachedMetadataStore(
+            MetadataStoreImpl(
+                connection_string=getenv_or_raise("MONGODB_CONNECTION_STRING"),
+                db=getenv_or_raise("MONGODB_DB"),
+                collection_name=worker_id
+            ),
+            worker_id,
+            flush_interval_seconds=float(os.getenv("METADATA_FLUSH_INTERVAL_SECONDS", 30))
         )
 
+    def end_run(self):
+        """
+        Writes back the metadata set since the last run, to be called after pre_work and after every work
+        """
+        self._metadata_store.end_run()
+
     @property
     def rpc_client(self) -> RpcClient:
         return self._rpc_client
 
+    @property
+    def async_rpc_client(self) -> AsyncRpcClient:
+        return self._async_rpc_client
+
     @property
     def logger(self) -> logging.Logger:
         return self._logger
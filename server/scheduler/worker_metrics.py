@@ -0,0 +1,146 @@
+import datetime
+import threading
+import time
+import traceback
+from typing import Dict, List, Tuple
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED
+from apscheduler.schedulers.base import BaseScheduler
+from common.datetime_utils import datetime_to_milliseconds
+from common.metrics import MetricsRegistry
+from broccoli_plugin_interface.worker_manager.worker import Worker
+from .logging import logger
+from .worker_context.work_context_impl import WorkContextImpl
+
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+
+class WorkerMetrics(object):
+    """
+    Run durations, outcomes, scheduling lag and RPC calls of every worker.
+    Scheduling lag is the delay between the scheduled run time and the submission of the run to its executor
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.runs = registry.counter(
+            "broccoli_worker_runs_total", "Worker runs by outcome", ["worker_id", "status"])
+        self.run_seconds = registry.histogram(
+            "broccoli_worker_run_duration_seconds", "Duration of worker runs", ["worker_id"])
+        self.lag_seconds = registry.histogram(
+            "broccoli_worker_scheduling_lag_seconds", "Delay between scheduled and actual submission of worker runs",
+            ["worker_id"])
+        self.rpc_calls = registry.counter(
+            "broccoli_worker_rpc_calls_total", "RPC calls made by workers by verb and outcome",
+            ["worker_id", "verb", "status"])
+        self.rpc_seconds = registry.histogram(
+            "broccoli_worker_rpc_duration_seconds", "Latency of RPC calls made by workers", ["worker_id", "verb"])
+        self._last_runs = {}  # type: Dict[str, Dict]
+        self._rpc_verbs = {}  # type: Dict[str, set]
+        self._lock = threading.Lock()
+
+    def record_run(self, worker_id: str, seconds: float, succeeded: bool):
+        status = STATUS_SUCCEEDED if succeeded else STATUS_FAILED
+        self.runs.inc((worker_id, status))
+        self.run_seconds.observe((worker_id,), seconds)
+        with self._lock:
+            self._last_runs[worker_id] = {
+                "at": datetime_to_milliseconds(datetime.datetime.utcnow()),
+                "duration_seconds": seconds,
+                "status": status
+            }
+
+    def record_rpc_call(self, worker_id: str, verb: str, seconds: float, succeeded: bool):
+        self.rpc_calls.inc((worker_id, verb, STATUS_SUCCEEDED if succeeded else STATUS_FAILED))
+        self.rpc_seconds.observe((worker_id, verb), seconds)
+        with self._lock:
+            self._rpc_verbs.setdefault(worker_id, set()).add(verb)
+
+    def record_report(self, worker_id: str, report: Dict):
+        """
+        Records a run reported back by a worker running in a process pool, see RunReport
+        """
+        for verb, seconds, succeeded in report["rpc_calls"]:
+            self.record_rpc_call(worker_id, verb, seconds, succeeded)
+        self.record_run(worker_id, report["duration_seconds"], report["succeeded"])
+
+    def listen(self, scheduler: BaseScheduler):
+        scheduler.add_listener(self._on_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED)
+
+    def summary(self, worker_id: str) -> Dict:
+        succeeded = self.runs.get((worker_id, STATUS_SUCCEEDED))
+        failed = self.runs.get((worker_id, STATUS_FAILED))
+        run_count, run_seconds = self.run_seconds.get((worker_id,))
+        lag_count, lag_seconds = self.lag_seconds.get((worker_id,))
+        with self._lock:
+            last_run = self._last_runs.get(worker_id)
+            verbs = sorted(self._rpc_verbs.get(worker_id, set()))
+        rpc_calls = {}
+        for verb in verbs:
+            count, seconds = self.rpc_seconds.get((worker_id, verb))
+            rpc_calls[verb] = {
+                "count": count,
+                "failed": self.rpc_calls.get((worker_id, verb, STATUS_FAILED)),
+                "average_seconds": seconds / count if count else 0.0
+            }
+        return {
+            "runs": {
+                "succeeded": succeeded,
+                "failed": failed,
+                "average_seconds": run_seconds / run_count if run_count else 0.0,
+                "total_seconds": run_seconds
+            },
+            "last_run": last_run,
+            "scheduling_lag_average_seconds": lag_seconds / lag_count if lag_count else 0.0,
+            "rpc_calls": rpc_calls
+        }
+
+    def _on_event(self, event):
+        if event.code == EVENT_JOB_SUBMITTED:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            for scheduled_run_time in event.scheduled_run_times:
+                self.lag_seconds.observe((event.job_id,), max(0.0, (now - scheduled_run_time).total_seconds()))
+        elif isinstance(event.retval, dict) and RunReport.KEY in event.retval:
+            self.record_report(event.job_id, event.retval[RunReport.KEY])
+
+
+class RunReport(object):
+    """
+    Collects the RPC calls of one run in a process pool, to be sent back to the scheduler process
+    as the return value of the job
+    """
+
+    KEY = "broccoli.run_report"
+
+    def __init__(self):
+        self._rpc_calls = []  # type: List
+        self._lock = threading.Lock()
+
+    def record_rpc_call(self, worker_id: str, verb: str, seconds: float, succeeded: bool):
+        with self._lock:
+            self._rpc_calls.append((verb, seconds, succeeded))
+
+    def drain(self, seconds: float, succeeded: bool) -> Dict:
+        with self._lock:
+            rpc_calls, self._rpc_calls = self._rpc_calls, []
+        return {self.KEY: {"duration_seconds": seconds, "succeeded": succeeded, "rpc_calls": rpc_calls}}
+
+
+def run_worker(worker_id: str, worker: Worker, work_context: WorkContextImpl) -> Tuple[float, bool]:
+    """
+    Runs worker.work once and writes back the metadata it set, returning the duration and whether it succeeded
+    """
+    started_at = time.perf_counter()
+    try:
+        worker.work(work_context)
+        succeeded = True
+    except Exception as e:
+        traceback.print_exc()
+        logger.error(f"Fail to execute work for {worker_id}, message {e}")
+        succeeded = False
+    # Metadata set before a failure is kept, as it was when every set went straight to MongoDB
+    try:
+        work_context.end_run()
+    except Exception as e:
+        logger.error(f"Fail to write back metadata for {worker_id}, message {e}")
+        succeeded = False
+    return time.perf_counter() - started_at, succeeded
@@ -0,0 +1,41 @@
+import asyncio
+import time
+import unittest
+import mongomock
+from concurrent.futures import ThreadPoolExecutor
+from common.in_process_rpc_client import AsyncInProcessRpcClient
+from broccoli_plugin_interface.thread_pool_async_rpc_client import ThreadPoolAsyncRpcClient
+from content.content_store import ContentStore
+
+
+class _SlowRpcClient(object):
+    def blocking_count(self, q):
+        time.sleep(0.1)
+        return q["n"]
+
+
+class TestThreadPoolAsyncRpcClient(unittest.TestCase):
+    def test_concurrent_calls(self):
+        async_rpc_client = ThreadPoolAsyncRpcClient(_SlowRpcClient(), ThreadPoolExecutor(max_workers=10))
+
+        async def fan_out():
+            return await asyncio.gather(*map(lambda n: async_rpc_client.count({"n": n}), range(10)))
+
+        start = time.perf_counter()
+        assert asyncio.run(fan_out()) == list(range(10))
+        assert time.perf_counter() - start < 0.5
+
+
+class TestAsyncInProcessRpcClient(unittest.TestCase):
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def test_fan_out(self):
+        content_store = ContentStore("localhost:27017", "test_db")
+        async_rpc_client = AsyncInProcessRpcClient(content_store)
+
+        async def fan_out():
+            await async_rpc_client.append_many("key", list(map(lambda i: {"key": f"value_{i}"}, range(5))))
+            return await asyncio.gather(*map(lambda i: async_rpc_client.query({"key": f"value_{i}"}), range(5)))
+
+        actual_results = asyncio.run(fan_out())
+        assert list(map(lambda r: r[0]["key"], actual_results)) == list(map(lambda i: f"value_{i}", range(5)))
+        content_store.client.drop_database("test_db")
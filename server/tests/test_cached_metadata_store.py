@@ -0,0 +1,74 @@
+import unittest
+import mongomock
+from unittest import mock
+from scheduler.global_metadata_store import GlobalMetadataStore
+from scheduler.worker_context.cached_metadata_store import CachedMetadataStore, OtherWorkerKeys
+from scheduler.worker_context.metadata_store_impl import MetadataStoreImpl
+
+
+class TestCachedMetadataStore(unittest.TestCase):
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUp(self):
+        self.metadata_store = MetadataStoreImpl("localhost:27017", "test_db", "worker_a")
+        self.other_worker_keys = OtherWorkerKeys(ttl_seconds=60)
+        self.cached_metadata_store = CachedMetadataStore(self.metadata_store, "worker_a",
+                                                         other_worker_keys=self.other_worker_keys)
+
+    def tearDown(self):
+        self.metadata_store.client.drop_database("test_db")
+
+    def test_reads_once_per_run(self):
+        self.metadata_store.set_many({"cursor": 1, "count": 2})
+        with mock.patch.object(self.metadata_store, "get_many", wraps=self.metadata_store.get_many) as get_many:
+            assert self.cached_metadata_store.exists("cursor")
+            assert self.cached_metadata_store.get("cursor") == 1
+            assert not self.cached_metadata_store.exists("missing")
+            assert not self.cached_metadata_store.exists("missing")
+            assert self.cached_metadata_store.get_many(["cursor", "count", "missing"]) == {"cursor": 1, "count": 2}
+            assert get_many.call_count == 3
+        with self.assertRaises(KeyError):
+            self.cached_metadata_store.get("missing")
+
+    def test_write_back(self):
+        with mock.patch.object(self.metadata_store, "set_many", wraps=self.metadata_store.set_many) as set_many:
+            self.cached_metadata_store.set("cursor", 1)
+            self.cached_metadata_store.set_many({"cursor": 2, "count": 3})
+            assert not self.metadata_store.exists("cursor")
+            assert self.cached_metadata_store.get("cursor") == 2
+            self.cached_metadata_store.end_run()
+            set_many.assert_called_once_with({"cursor": 2, "count": 3})
+        assert self.metadata_store.get_many(["cursor", "count"]) == {"cursor": 2, "count": 3}
+
+    def test_returned_values_are_copies(self):
+        self.cached_metadata_store.set("seen", [1])
+        self.cached_metadata_store.get("seen").append(2)
+        assert self.cached_metadata_store.get("seen") == [1]
+
+    def test_sees_outside_edits_next_run(self):
+        self.metadata_store.set("cursor", 1)
+        assert self.cached_metadata_store.get("cursor") == 1
+        self.metadata_store.set("cursor", 5)
+        assert self.cached_metadata_store.get("cursor") == 1
+        self.cached_metadata_store.end_run()
+        assert self.cached_metadata_store.get("cursor") == 5
+
+    def test_other_worker_invalidated_on_flush(self):
+        other_metadata_store = MetadataStoreImpl("localhost:27017", "test_db", "worker_b")
+        other_cached_metadata_store = CachedMetadataStore(other_metadata_store, "worker_b",
+                                                          other_worker_keys=self.other_worker_keys)
+        assert not self.cached_metadata_store.exists_in_another_worker("worker_b", "cursor")
+        other_cached_metadata_store.set("cursor", 7)
+        assert not self.cached_metadata_store.exists_in_another_worker("worker_b", "cursor")
+        other_cached_metadata_store.end_run()
+        assert self.cached_metadata_store.get_from_another_worker("worker_b", "cursor") == 7
+
+
+class TestGlobalMetadataStore(unittest.TestCase):
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def test_set_all(self):
+        global_metadata_store = GlobalMetadataStore("localhost:27017", "test_db")
+        global_metadata_store.set_all("worker_a", [{"key": "a", "value": 1}, {"key": "b", "value": 2}])
+        global_metadata_store.set_all("worker_a", [{"key": "a", "value": 3}])
+        assert sorted(map(lambda m: (m["key"], m["value"]), global_metadata_store.get_all("worker_a"))) == \
+            [("a", 3), ("b", 2)]
+        global_metadata_store.client.drop_database("test_db")
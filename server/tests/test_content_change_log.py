@@ -0,0 +1,78 @@
+import unittest
+import mongomock
+from content.content_change_log import ContentChangeLog
+from content.content_store import ContentStore
+from content.query_cache import QueryCache
+
+
+class TestContentChangeLog(unittest.TestCase):
+    def setUp(self) -> None:
+        self.db = mongomock.MongoClient().db
+
+    def test_skips_own_entries(self):
+        reader = ContentChangeLog(self.db, poll_interval_seconds=0)
+        writer = ContentChangeLog(self.db, poll_interval_seconds=0)
+        writer.publish([1], {"a"}, True)
+        reader.publish([2], {"b"}, False)
+        complete, entries = reader.poll()
+        assert complete
+        assert list(map(lambda e: (e["ids"], e["fields"], e["inserted"]), entries)) == [([1], ["a"], True)]
+        assert reader.applied_version == 2
+
+    def test_waits_for_a_missing_entry_then_starts_over(self):
+        reader = ContentChangeLog(self.db, poll_interval_seconds=0, gap_timeout_seconds=0)
+        writer = ContentChangeLog(self.db, poll_interval_seconds=0)
+        # A writer that numbered its entry but has not written it yet
+        self.db['broccoli.content_version'].update_one({"_id": "content"}, {"$inc": {"version": 1}}, upsert=True)
+        writer.publish([1], {"a"}, True)
+        assert reader.poll() == (True, [])
+        assert reader.applied_version == 0
+        assert reader.poll() == (False, [])
+        assert reader.applied_version == 2
+
+
+class TestContentStoreChangeLog(unittest.TestCase):
+    @classmethod
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUpClass(cls) -> None:
+        cls.reader = ContentStore("localhost:27017", "test_db", query_cache=QueryCache(), change_log_enabled=True,
+                                  change_log_poll_seconds=0)
+        cls.writer = ContentStore("localhost:27017", "test_db", change_log_enabled=True, change_log_poll_seconds=0)
+
+    def tearDown(self) -> None:
+        self.reader.client.drop_database("test_db")
+        for content_store in [self.reader, self.writer]:
+            content_store.hamming_indexes.clear()
+            content_store.schema_catalog.known_field_types.clear()
+            content_store.change_log.applied_version = 0
+        self.reader.query_cache.invalidate_all()
+
+    def _nearest_keys(self, from_binary_string: str, max_distance: int):
+        return sorted(map(lambda d: d["key"], self.reader.query_nearest_hamming_neighbors(
+            {}, "bs", from_binary_string, max_distance)))
+
+    def test_writes_reach_the_hamming_index_of_another_store(self):
+        self.writer.append({"key": "value_1", "bs": "0000"}, "key")
+        assert self._nearest_keys("0000", 0) == ["value_1"]
+        self.writer.append({"key": "value_2", "bs": "0000"}, "key")
+        self.writer.update_one_binary_string({"key": "value_1"}, "bs", "1111")
+        assert self._nearest_keys("0000", 0) == ["value_2"]
+        assert self._nearest_keys("1111", 0) == ["value_1"]
+
+    def test_writes_reach_the_query_cache_of_another_store(self):
+        self.writer.append({"key": "value_1"}, "key")
+        assert len(self.reader.query({}, projection=["key"])) == 1
+        self.writer.append({"key": "value_2"}, "key")
+        assert len(self.reader.query({}, projection=["key"])) == 2
+        self.writer.update_one({"key": "value_2"}, {"$set": {"key": "value_3"}})
+        assert sorted(map(lambda d: d["key"], self.reader.query({}, projection=["key"]))) == ["value_1", "value_3"]
+
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def test_enable_change_log(self):
+        content_store = ContentStore("localhost:27017", "test_db", change_log_poll_seconds=0)
+        content_store.append({"key": "value_1"}, "key")
+        assert self.writer.change_log.version() == 0
+        content_store.enable_change_log()
+        content_store.append({"key": "value_2"}, "key")
+        _id = content_store.collection.find_one({"key": "value_2"})["_id"]
+        assert self.reader.change_log.poll()[1][0]["ids"] == [_id]
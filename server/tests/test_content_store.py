@@ -1,8 +1,12 @@
 import unittest
+import unittest.mock
 import mongomock
 import freezegun
 import datetime
+import bson
+from pymongo.errors import BulkWriteError
 from content.content_store import ContentStore
+from content.packed_binary_string import is_packed
 
 
 class TestContentStore(unittest.TestCase):
@@ -13,6 +17,32 @@ class TestContentStore(unittest.TestCase):
 
     def tearDown(self) -> None:
         self.content_store.client.drop_database("test_db")
+        self.content_store.hamming_indexes.clear()
+        self.content_store.schema_catalog.known_field_types.clear()
+
+
+class TestContentStorePacked(TestContentStore):
+    """
+    Runs the tests of the classes it is mixed into with binary strings stored packed
+    """
+
+    @classmethod
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUpClass(cls) -> None:
+        cls.content_store = ContentStore("localhost:27017", "test_db", packed_binary_strings=True)
+
+    def setUp(self) -> None:
+        super().setUp()
+        append_many = self.content_store.append_many
+
+        def append_many_then_pack(docs, idempotency_key):
+            statuses = append_many(docs, idempotency_key)
+            # As if the documents were written before packing was turned on and migrated since
+            self.content_store.migrate_binary_strings("bs")
+            return statuses
+        patcher = unittest.mock.patch.object(self.content_store, "append_many", side_effect=append_many_then_pack)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
 
 class TestContentStoreAppend(TestContentStore):
@@ -46,6 +76,99 @@ class TestContentStoreAppend(TestContentStore):
         ]
 
 
+class TestContentStoreIterQueryBson(TestContentStore):
+    def test_same_documents_as_query(self):
+        self.content_store.append_many([{"key": i} for i in range(3)], "key")
+        documents = list(map(bson.decode, self.content_store.iter_query_bson({"key": {"$gte": 1}}, sort={"key": 1})))
+        assert list(map(lambda d: d["key"], documents)) == [1, 2]
+        assert isinstance(documents[0]["created_at"], datetime.datetime)
+
+
+class TestContentStoreAppendMany(TestContentStore):
+    def test_statuses(self):
+        self.content_store.append({"key": "value_1"}, "key")
+        statuses = self.content_store.append_many(
+            [{"key": "value_1"}, {"key": "value_2"}, {"other_key": "value_3"}, {"key": "value_2"}],
+            "key"
+        )
+        assert statuses == ["duplicate", "inserted", "invalid", "duplicate"]
+        assert self.content_store.collection.count_documents({}) == 2
+
+    def test_existing_duplicates(self):
+        self.content_store.collection.insert_many([{"key": "value_1"}, {"key": "value_1"}])
+        statuses = self.content_store.append_many([{"key": "value_1"}, {"key": "value_2"}], "key")
+        assert statuses == ["duplicate", "inserted"]
+        assert self.content_store.collection.count_documents({"key": "value_2"}) == 1
+
+    def test_idempotency_keys_do_not_hold_back_each_other(self):
+        self.content_store.append_many([{"url": "u1", "img": "a"}], "url")
+        statuses = self.content_store.append_many([{"url": "u1", "img": "b"}, {"url": "u1", "img": "c"}], "img")
+        assert statuses == ["inserted", "inserted"]
+        assert self.content_store.collection.count_documents({"url": "u1"}) == 3
+        self.content_store.update_one({"img": "c"}, {"$set": {"url": "u2"}})
+        self.content_store.update_one({"img": "b"}, {"$set": {"url": "u2"}})
+        assert self.content_store.collection.count_documents({"url": "u2"}) == 2
+
+    def test_many_batches(self):
+        docs = list(map(lambda i: {"key": i % 600}, range(1200)))
+        statuses = self.content_store.append_many(docs, "key")
+        assert statuses == ["inserted"] * 600 + ["duplicate"] * 600
+        assert self.content_store.collection.count_documents({}) == 600
+
+    def test_value_claimed_by_concurrent_append(self):
+        self.content_store.idempotency_claims.insert_one({"_id": {"key": "key", "value": "value_1"}})
+        statuses = self.content_store.append_many([{"key": "value_1"}, {"key": "value_2"}], "key")
+        assert statuses == ["duplicate", "inserted"]
+        assert self.content_store.collection.count_documents({}) == 1
+
+    def test_releases_claims_of_failed_writes(self):
+        with unittest.mock.patch.object(self.content_store.collection, "bulk_write",
+                                        side_effect=BulkWriteError({"writeErrors": [], "upserted": []})):
+            with self.assertRaises(BulkWriteError):
+                self.content_store.append_many([{"key": "value_1"}], "key")
+        assert self.content_store.append_many([{"key": "value_1"}], "key") == ["inserted"]
+
+
+class TestContentStoreQueryPage(TestContentStore):
+    def _all_pages(self, page_size, **kwargs):
+        pages = []
+        resume_token = None
+        for _ in range(100):
+            documents, resume_token = self.content_store.query_page({}, page_size, resume_token, **kwargs)
+            pages.append(list(map(lambda d: d["key"], documents)))
+            if not resume_token:
+                return pages
+        raise AssertionError(f"Pages do not end, first ones {pages[:5]}")
+
+    def test_pages_by_id(self):
+        self.content_store.append_many(list(map(lambda i: {"key": i}, range(5))), "key")
+        assert self._all_pages(2) == [[0, 1], [2, 3], [4]]
+
+    def test_pages_by_sort_with_ties(self):
+        self.content_store.append_many(list(map(lambda i: {"key": i, "group": i % 2}, range(5))), "key")
+        assert self._all_pages(2, sort={"group": -1}, projection=["key"]) == [[1, 3], [0, 2], [4]]
+
+    def test_pages_by_sort_with_missing_keys(self):
+        self.content_store.append_many(list(map(lambda i: {"key": i, "group": i % 3} if i % 2 else {"key": i},
+                                                range(7))), "key")
+        assert self._all_pages(2, sort={"group": 1}) == [[0, 2], [4, 6], [3, 1], [5]]
+        assert self._all_pages(2, sort={"group": -1}) == [[5, 1], [3, 0], [2, 4], [6]]
+
+    def test_pages_by_dotted_sort_key(self):
+        self.content_store.append_many(list(map(lambda i: {"key": i, "a": {"b": (i * 3) % 7}}, range(7))), "key")
+        assert self._all_pages(2, sort={"a.b": 1}) == [[0, 5], [3, 1], [6, 4], [2]]
+        assert self._all_pages(2, sort={"a.b": -1}, projection=["key", "a.b"]) == [[2, 4], [6, 1], [3, 5], [0]]
+
+    def test_projection_drops_sort_keys(self):
+        self.content_store.append({"key": 1, "group": 1, "other": 1}, "key")
+        documents, _ = self.content_store.query_page({}, 2, sort={"group": 1}, projection=["key"])
+        assert set(documents[0].keys()) == {"_id", "key", "created_at"}
+
+    def test_invalid_resume_token(self):
+        with self.assertRaises(ValueError):
+            self.content_store.query_page({}, 2, resume_token="not a token")
+
+
 class TestContentStoreQueryNearestNeighbors(TestContentStore):
     def test_invalid_from_binary_string(self):
         assert self.content_store.query_nearest_hamming_neighbors(
@@ -125,6 +248,10 @@ class TestContentStoreQueryNearestNeighbors(TestContentStore):
         ]
 
 
+class TestContentStoreQueryNearestNeighborsPacked(TestContentStorePacked, TestContentStoreQueryNearestNeighbors):
+    pass
+
+
 class TestContentStoreQueryNNearestNeighbors(TestContentStore):
     def test_invalid_from_binary_string(self):
         assert self.content_store.query_n_nearest_hamming_neighbors(
@@ -203,3 +330,281 @@ class TestContentStoreQueryNNearestNeighbors(TestContentStore):
                 "created_at": 1557875710000
             }
         ]
+
+
+class TestContentStoreQueryNNearestNeighborsWithoutIndex(TestContentStoreQueryNNearestNeighbors):
+    @classmethod
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUpClass(cls) -> None:
+        cls.content_store = ContentStore("localhost:27017", "test_db", hamming_index_enabled=False)
+
+
+class TestContentStoreQueryNNearestNeighborsPacked(TestContentStorePacked, TestContentStoreQueryNNearestNeighbors):
+    pass
+
+
+class TestContentStoreQueryNNearestNeighborsPackedWithoutIndex(TestContentStorePacked,
+                                                               TestContentStoreQueryNNearestNeighbors):
+    @classmethod
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUpClass(cls) -> None:
+        cls.content_store = ContentStore("localhost:27017", "test_db", hamming_index_enabled=False,
+                                         packed_binary_strings=True)
+
+
+class TestContentStoreQueryNNearestNeighborsFewerThanN(TestContentStore):
+    def test_returns_fewer_than_n(self):
+        self.content_store.append({"key": "value_1", "bs": "0001"}, "key")
+        self.content_store.append({"key": "value_2", "bs": "0011"}, "key")
+        self.content_store.append({"key": "value_3", "bs": "001"}, "key")
+        actual_documents = self.content_store.query_n_nearest_hamming_neighbors(
+            q={},
+            binary_string_key="bs",
+            from_binary_string="0000",
+            pick_n=5,
+            projection=["key"]
+        )
+        assert sorted(map(lambda d: d["key"], actual_documents)) == ["value_1", "value_2"]
+        assert set(actual_documents[0].keys()) == {"_id", "key", "created_at"}
+
+
+class TestContentStoreQueryNNearestNeighborsSelectiveQuery(TestContentStore):
+    def test_walks_past_the_first_batches(self):
+        # The 40 documents nearest to the origin do not match q, more than the first batches hold
+        self.content_store.append_many(
+            [{"key": f"value_{i}", "attr": i >= 40, "bs": format(i, "08b")} for i in range(60)], "key")
+        actual_documents = self.content_store.query_n_nearest_hamming_neighbors(
+            q={"attr": True},
+            binary_string_key="bs",
+            from_binary_string="00000000",
+            pick_n=2
+        )
+        # 40 and 48 are the only matching values with two bits set, 40 was inserted first
+        assert list(map(lambda d: d["key"], actual_documents)) == ["value_48", "value_40"]
+
+
+class TestContentStoreQueryNNearestNeighborsSelectiveQueryWithoutIndex(
+        TestContentStoreQueryNNearestNeighborsSelectiveQuery):
+    @classmethod
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUpClass(cls) -> None:
+        cls.content_store = ContentStore("localhost:27017", "test_db", hamming_index_enabled=False)
+
+
+class TestContentStoreQueryNNearestNeighborsFewerThanNWithoutIndex(TestContentStoreQueryNNearestNeighborsFewerThanN):
+    @classmethod
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUpClass(cls) -> None:
+        cls.content_store = ContentStore("localhost:27017", "test_db", hamming_index_enabled=False)
+
+
+class TestContentStoreHammingIndex(TestContentStore):
+    def test_append_after_index_built(self):
+        self.content_store.append({"key": "value_1", "bs": "0000"}, "key")
+        assert len(self.content_store.query_nearest_hamming_neighbors({}, "bs", "0000", 0)) == 1
+        self.content_store.append({"key": "value_2", "bs": "0001"}, "key")
+        actual_documents = self.content_store.query_nearest_hamming_neighbors({}, "bs", "0000", 1)
+        assert list(map(lambda d: d["key"], actual_documents)) == ["value_1", "value_2"]
+
+    def test_update_one_binary_string_after_index_built(self):
+        self.content_store.append({"key": "value_1", "bs": "0000"}, "key")
+        self.content_store.append({"key": "value_2"}, "key")
+        assert len(self.content_store.query_nearest_hamming_neighbors({}, "bs", "1111", 0)) == 0
+        self.content_store.update_one_binary_string({"key": "value_1"}, "bs", "1111")
+        self.content_store.update_one_binary_string({"key": "value_2"}, "bs", "1110")
+        actual_documents = self.content_store.query_nearest_hamming_neighbors({}, "bs", "1111", 1)
+        assert list(map(lambda d: d["key"], actual_documents)) == ["value_1", "value_2"]
+        assert self.content_store.query_nearest_hamming_neighbors({}, "bs", "0000", 1) == []
+
+    def test_update_one_unset_after_index_built(self):
+        self.content_store.append({"key": "value_1", "bs": "0000"}, "key")
+        assert len(self.content_store.query_nearest_hamming_neighbors({}, "bs", "0000", 0)) == 1
+        self.content_store.update_one({"key": "value_1"}, {"$unset": {"bs": ""}})
+        assert self.content_store.query_nearest_hamming_neighbors({}, "bs", "0000", 0) == []
+
+    def test_writes_while_index_is_built(self):
+        self.content_store.append({"key": "value_1", "bs": "0000"}, "key")
+        self.content_store.append({"key": "value_2", "bs": "0000"}, "key")
+        find = self.content_store.collection.find
+
+        def find_then_write(*args, **kwargs):
+            if args[0] != {"bs": {"$exists": True}}:
+                return find(*args, **kwargs)
+            # The collection is read before the writes, as by a build running next to them
+            documents = list(find(*args, **kwargs))
+            self.content_store.append({"key": "value_3", "bs": "0001"}, "key")
+            self.content_store.update_one_binary_string({"key": "value_2"}, "bs", "1111")
+            return iter(documents)
+
+        with unittest.mock.patch.object(self.content_store.collection, "find", side_effect=find_then_write):
+            self.content_store._hamming_index("bs")
+        actual_documents = self.content_store.query_nearest_hamming_neighbors({}, "bs", "0000", 1)
+        assert sorted(map(lambda d: d["key"], actual_documents)) == ["value_1", "value_3"]
+
+
+class TestContentStoreHammingIndexPacked(TestContentStorePacked, TestContentStoreHammingIndex):
+    pass
+
+
+class TestContentStoreRandom(TestContentStore):
+    def test_random_one_without_match(self):
+        self.content_store.append({"key": "value_1"}, "key")
+        assert self.content_store.random_one({"key": "value_2"}, ["key"]) is None
+
+    def test_random_one(self):
+        self.content_store.append({"key": "value_1", "other": 1}, "key")
+        self.content_store.append({"key": "value_2", "other": 2}, "key")
+        actual_document = self.content_store.random_one({"key": "value_2"}, ["key"])
+        assert actual_document["key"] == "value_2"
+        assert set(actual_document.keys()) == {"_id", "key", "created_at"}
+
+    def test_random_many(self):
+        self.content_store.append_many(list(map(lambda i: {"key": f"value_{i}"}, range(10))), "key")
+        actual_documents = self.content_store.random_many({}, 4)
+        assert len(actual_documents) == 4
+        assert len(set(map(lambda d: d["key"], actual_documents))) == 4
+        assert len(self.content_store.random_many({"key": "value_3"}, 4)) == 1
+
+
+class TestContentStoreSchema(TestContentStore):
+    def test_schema_from_writes(self):
+        self.content_store.append({"key": "value_1", "a": 1}, "key")
+        self.content_store.update_one({"key": "value_1"}, {"$set": {"b": "x", "c.d": 1}})
+        assert self.content_store.schema() == ["a", "b", "c", "created_at", "key"]
+        types = dict(map(lambda d: (d["field"], d["types"]), self.content_store.schema_catalog.describe()))
+        assert types["a"] == ["integer"]
+        assert types["c"] == []
+
+    def test_rebuild(self):
+        self.content_store.collection.insert_many([{"key": "value_1", "a": 1}, {"key": "value_2", "b": 1.5}])
+        assert self.content_store.schema() == []
+        assert self.content_store.schema_catalog.rebuild(sample_size=10) == 2
+        assert self.content_store.schema() == ["a", "b", "key"]
+
+
+class TestContentStoreBulkUpdateOne(TestContentStore):
+    def test_counts(self):
+        self.content_store.append({"key": "value_1", "group": "a"}, "key")
+        self.content_store.append({"key": "value_2", "group": "a"}, "key")
+        self.content_store.append({"key": "value_3", "group": "b", "n": 1}, "key")
+        actual_counts = self.content_store.bulk_update_one([
+            ({"key": "value_1"}, {"$set": {"n": 1}}),
+            ({"key": "value_3"}, {"$set": {"n": 1}}),
+            ({"key": "value_4"}, {"$set": {"n": 1}}),
+            ({"group": "a"}, {"$set": {"n": 2}}),
+            ({"group": "b"}, {"$set": {"n": 2}}),
+        ])
+        assert actual_counts == {"matched": 3, "modified": 2, "rejected": 2}
+        actual_n = dict(map(lambda d: (d["key"], d.get("n")), self.content_store.query({})))
+        assert actual_n == {"value_1": 1, "value_2": None, "value_3": 2}
+
+    def test_operator_filters_in_one_round_trip(self):
+        self.content_store.append_many(list(map(lambda i: {"key": i, "group": i % 2}, range(6))), "key")
+        ops = [
+            ({"key": {"$gt": 4}}, {"$set": {"n": 1}}),
+            ({"key": {"$in": [1, 3]}, "group": 1}, {"$set": {"n": 1}}),
+            ({"$or": [{"key": 0}, {"key": 100}]}, {"$set": {"n": 1}}),
+            ({"key": {"$lt": 0}}, {"$set": {"n": 1}}),
+        ]
+        with unittest.mock.patch.object(self.content_store.collection, "aggregate",
+                                        wraps=self.content_store.collection.aggregate) as aggregate:
+            actual_counts = self.content_store.bulk_update_one(ops)
+        assert aggregate.call_count == 1
+        assert actual_counts == {"matched": 2, "modified": 2, "rejected": 2}
+        assert sorted(map(lambda d: d["key"], self.content_store.query({"n": 1}))) == [0, 5]
+
+    def test_invalid_update_doc(self):
+        self.content_store.append({"key": "value_1"}, "key")
+        actual_counts = self.content_store.bulk_update_one([({"key": "value_1"}, {"n": 1})])
+        assert actual_counts == {"matched": 0, "modified": 0, "rejected": 1}
+
+    def test_binary_string(self):
+        self.content_store.append({"key": "value_1", "bs": "0000"}, "key")
+        self.content_store.append({"key": "value_2"}, "key")
+        assert len(self.content_store.query_nearest_hamming_neighbors({}, "bs", "1111", 0)) == 0
+        actual_counts = self.content_store.bulk_update_one_binary_string([
+            ({"key": "value_1"}, "bs", "1111"),
+            ({"key": "value_2"}, "bs", "1110"),
+            ({"key": "value_2"}, "bs", "2"),
+        ])
+        assert actual_counts == {"matched": 2, "modified": 2, "rejected": 1}
+        actual_documents = self.content_store.query_nearest_hamming_neighbors({}, "bs", "1111", 1)
+        assert list(map(lambda d: d["key"], actual_documents)) == ["value_1", "value_2"]
+
+
+class TestContentStorePackedBinaryString(TestContentStore):
+    @classmethod
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUpClass(cls) -> None:
+        cls.content_store = ContentStore("localhost:27017", "test_db", packed_binary_strings=True)
+
+    def test_stored_packed_read_as_string(self):
+        self.content_store.append({"key": "value_1"}, "key")
+        self.content_store.update_one_binary_string({"key": "value_1"}, "bs", "0101")
+        assert is_packed(self.content_store.collection.find_one({"key": "value_1"})["bs"])
+        assert self.content_store.query({"key": "value_1"})[0]["bs"] == "0101"
+
+    def test_hamming_on_mixed_storage(self):
+        self.content_store.append({"key": "value_1", "bs": "0000"}, "key")
+        self.content_store.append({"key": "value_2"}, "key")
+        self.content_store.update_one_binary_string({"key": "value_2"}, "bs", "0001")
+        for hamming_index_enabled in [True, False]:
+            self.content_store.hamming_index_enabled = hamming_index_enabled
+            actual_documents = self.content_store.query_n_nearest_hamming_neighbors({}, "bs", "0011", 1)
+            assert list(map(lambda d: d["key"], actual_documents)) == ["value_2"]
+            actual_documents = self.content_store.query_nearest_hamming_neighbors({}, "bs", "0000", 1)
+            assert list(map(lambda d: d["bs"], actual_documents)) == ["0000", "0001"]
+        self.content_store.hamming_index_enabled = True
+
+    def test_migrate(self):
+        self.content_store.append_many(list(map(lambda i: {"key": f"value_{i}", "bs": format(i, "04b")}, range(5))),
+                                       "key")
+        self.content_store.append({"key": "value_5", "bs": "not binary"}, "key")
+        self.content_store.BINARY_STRING_MIGRATION_BATCH_SIZE = 2
+        try:
+            assert self.content_store.migrate_binary_strings("bs") == 5
+        finally:
+            del self.content_store.BINARY_STRING_MIGRATION_BATCH_SIZE
+        assert self.content_store.binary_string_storage("bs") == {"string": 1, "packed": 5}
+        actual_bs = list(map(lambda d: d["bs"], self.content_store.query({}, sort={"key": 1})))
+        assert actual_bs == ["0000", "0001", "0010", "0011", "0100", "not binary"]
+
+
+class TestContentStoreAggregate(TestContentStore):
+    def setUp(self) -> None:
+        for i, (tag, day) in enumerate([("a", 1), ("a", 1), ("b", 2), ("a", 3)]):
+            with freezegun.freeze_time(datetime.datetime(2020, 1, day)):
+                self.content_store.append({"i": i, "tag": tag}, "i")
+
+    def test_group(self):
+        actual = self.content_store.aggregate([
+            {"$group": {"_id": "$tag", "n": {"$sum": 1}}},
+            {"$sort": {"n": -1}}
+        ])
+        assert actual == [{"_id": "a", "n": 3}, {"_id": "b", "n": 1}]
+
+    def test_datetime_q(self):
+        actual = self.content_store.aggregate(
+            [{"$group": {"_id": None, "n": {"$sum": 1}, "last": {"$max": "$created_at"}}}],
+            datetime_q=[{"key": "created_at", "op": "gte", "value": 1577923200000}]
+        )
+        assert actual == [{"_id": None, "n": 2, "last": 1578009600000}]
+
+    def test_facet(self):
+        actual = self.content_store.aggregate([{"$facet": {
+            "tags": [{"$group": {"_id": "$tag"}}, {"$sort": {"_id": 1}}],
+            "first": [{"$sort": {"i": 1}}, {"$limit": 1}, {"$project": {"i": 1}}]
+        }}])
+        assert actual[0]["tags"] == [{"_id": "a"}, {"_id": "b"}]
+        assert type(actual[0]["first"][0]["_id"]) == str
+
+    def test_refuses_stages_and_operators(self):
+        for pipeline in [
+            [{"$out": "other"}],
+            [{"$match": {}, "$limit": 1}],
+            [{"$facet": {"nested": [{"$facet": {}}]}}],
+            [{"$match": {"$where": "true"}}],
+            [{"$group": {"_id": None, "x": {"$accumulator": {}}}}],
+        ]:
+            with self.assertRaises(ValueError):
+                self.content_store.aggregate(pipeline)
@@ -0,0 +1,24 @@
+import unittest
+from scheduler.executor_pools import ExecutorPools
+
+
+class TestExecutorPools(unittest.TestCase):
+    def test_parse_spec(self):
+        pools = ExecutorPools("default=thread:5, cpu=process:2")
+        self.assertEqual(pools.pools["default"], ("thread", 5))
+        self.assertTrue(pools.is_process_pool("cpu"))
+        self.assertIn(ExecutorPools.SYSTEM_EXECUTOR, pools)
+        self.assertNotIn("gpu", pools)
+
+    def test_default_pool_is_always_present(self):
+        pools = ExecutorPools("cpu=process:2")
+        self.assertEqual(pools.pools["default"], ("thread", 20))
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            ExecutorPools("default=fiber:2")
+
+    def test_metrics(self):
+        metrics = ExecutorPools("default=thread:4").metrics()
+        self.assertEqual(metrics["default"]["saturation"], 0)
+        self.assertEqual(metrics["default"]["size"], 4)
@@ -0,0 +1,136 @@
+import unittest
+from content.hamming_index import HammingIndex, pack_binary_string
+from content.multi_index_hashing import MultiIndexHashing
+
+
+class TestPackBinaryString(unittest.TestCase):
+    def test_pads_to_words(self):
+        assert len(pack_binary_string("1" * 64)) == 1
+        assert len(pack_binary_string("1" * 65)) == 2
+
+
+class TestHammingIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = HammingIndex("bs")
+
+    def test_invalid_binary_string(self):
+        assert not self.index.add(1, "abcd")
+        assert not self.index.add(2, 1234)
+        assert len(self.index) == 0
+
+    def test_within(self):
+        self.index.add(1, "0000")
+        self.index.add(2, "0011")
+        self.index.add(3, "0001")
+        self.index.add(4, "00000")
+        assert self.index.within("0000", 1) == [1, 3]
+
+    def test_within_long_strings(self):
+        self.index.add(1, "1" * 100)
+        self.index.add(2, "1" * 90 + "0" * 10)
+        assert self.index.within("1" * 100, 9) == [1]
+        assert self.index.within("1" * 100, 10) == [1, 2]
+
+    def test_nearest(self):
+        self.index.add(1, "0001")
+        self.index.add(2, "0011")
+        self.index.add(3, "0011")
+        self.index.add(4, "0111")
+        assert self.index.nearest("0000", 3) == [(1, 1), (3, 2), (2, 2)]
+
+    def test_nearest_limit_is_a_prefix(self):
+        import random
+        random_gen = random.Random(3)
+        for i in range(500):
+            self.index.add(i, format(random_gen.getrandbits(16), "016b"))
+        for i in range(0, 500, 4):
+            self.index.remove(i)
+        everything = self.index.nearest("0" * 16)
+        assert len(everything) == 375
+        for limit in [1, 10, 374, 375, 1000]:
+            assert self.index.nearest("0" * 16, limit) == everything[:limit]
+
+    def test_iter_nearest_pages_through_nearest(self):
+        import random
+        random_gen = random.Random(5)
+        for i in range(500):
+            self.index.add(i, format(random_gen.getrandbits(16), "016b"))
+        batches = list(self.index.iter_nearest("0" * 16, 10, 100))
+        assert list(map(len, batches)) == [10, 20, 40, 80, 100, 100, 100, 50]
+        assert sum(batches, []) == self.index.nearest("0" * 16)
+
+    def test_iter_nearest_skips_removed(self):
+        for i in range(4):
+            self.index.add(i, "000" + str(i % 2))
+        batches = self.index.iter_nearest("0000", 1, 10)
+        assert next(batches) == [(2, 0)]
+        self.index.remove(0)
+        assert list(batches) == [[(3, 1)], [(1, 1)]]
+
+    def test_replace_and_remove(self):
+        self.index.add(1, "0000")
+        self.index.add(2, "0000")
+        self.index.add(1, "11111")
+        self.index.remove(2)
+        assert self.index.within("0000", 4) == []
+        assert self.index.within("11111", 0) == [1]
+
+    def test_compaction_keeps_order(self):
+        for i in range(3000):
+            self.index.add(i, "0000")
+        for i in range(0, 2900):
+            self.index.remove(i)
+        assert self.index.within("0000", 0) == list(range(2900, 3000))
+        self.index.add(5000, "0000")
+        assert self.index.within("0000", 0)[-1] == 5000
+
+
+class TestHammingIndexMultiIndexHashing(unittest.TestCase):
+    def test_agrees_with_linear_scan(self):
+        import random
+        random_gen = random.Random(42)
+        multi_index = HammingIndex("bs", multi_index_hashing=True)
+        linear = HammingIndex("bs", multi_index_hashing=False)
+        base = format(random_gen.getrandbits(64), "064b")
+        for i in range(2000):
+            bits = list(base)
+            for position in random_gen.sample(range(64), random_gen.randint(0, 12)):
+                bits[position] = "1" if bits[position] == "0" else "0"
+            multi_index.add(i, "".join(bits))
+            linear.add(i, "".join(bits))
+        for i in range(0, 2000, 3):
+            multi_index.remove(i)
+            linear.remove(i)
+        for max_distance in [0, 4, 7, 8, 11]:
+            assert multi_index.within(base, max_distance) == linear.within(base, max_distance)
+
+    def test_agrees_with_linear_scan_after_compaction(self):
+        import random
+        random_gen = random.Random(7)
+        multi_index = HammingIndex("bs", multi_index_hashing=True)
+        linear = HammingIndex("bs", multi_index_hashing=False)
+        base = format(random_gen.getrandbits(64), "064b")
+        for i in range(3000):
+            bits = list(base)
+            for position in random_gen.sample(range(64), random_gen.randint(0, 10)):
+                bits[position] = "1" if bits[position] == "0" else "0"
+            multi_index.add(i, "".join(bits))
+            linear.add(i, "".join(bits))
+        for i in range(2000):
+            multi_index.remove(i)
+            linear.remove(i)
+        for max_distance in [2, 8]:
+            assert multi_index.within(base, max_distance) == linear.within(base, max_distance)
+
+    def test_supports_radius_8_on_64_bits(self):
+        multi_index = MultiIndexHashing(64)
+        assert multi_index.supports(8)
+        assert multi_index.supports(11)
+        assert not multi_index.supports(12)
+
+    def test_replace(self):
+        index = HammingIndex("bs", multi_index_hashing=True)
+        index.add(1, "0" * 64)
+        index.add(1, "1" * 64)
+        assert index.within("0" * 64, 4) == []
+        assert index.within("1" * 64, 4) == [1]
@@ -0,0 +1,197 @@
+import base64
+import datetime
+import http.client
+import io
+import json
+import socket
+import threading
+import time
+import unittest
+import bson
+import mongomock
+from bson import ObjectId
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+from broccoli_plugin_interface.http_rpc_client import HttpRpcClient, RpcError, _jwt_expires_at
+from broccoli_plugin_interface.lazy_bson_document import read_bson_documents
+from content.content_store import ContentStore
+from content.packed_binary_string import to_packed
+from content.rpc_core import RpcCore
+
+BSON_DOCUMENTS = [
+    {"_id": ObjectId("5f1f0a0a0a0a0a0a0a0a0a0a"), "created_at": datetime.datetime(2020, 1, 1),
+     "hash": to_packed("011")},
+    {"_id": ObjectId("5f1f0a0a0a0a0a0a0a0a0a0b"), "created_at": datetime.datetime(2020, 1, 2), "nested": {"n": 1}},
+]
+
+
+def _fake_jwt(exp: float) -> str:
+    claims = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode()).decode().rstrip("=")
+    return f"header.{claims}.signature"
+
+
+class TestJwtExpiresAt(unittest.TestCase):
+    def test_exp(self):
+        assert _jwt_expires_at(_fake_jwt(1700000000)) == 1700000000
+
+    def test_malformed(self):
+        assert _jwt_expires_at("not-a-jwt") is None
+
+
+class TestRpcCoreCallBatch(unittest.TestCase):
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def test_failures_do_not_stop_the_batch(self):
+        content_store = ContentStore("localhost:27017", "test_db")
+        rpc_core = RpcCore(content_store)
+        actual_results = rpc_core.call_batch([
+            {"verb": "append", "metadata": {}, "payload": {"idempotency_key": "key", "doc": {"key": "value"}}},
+            {"verb": "no_such_verb", "metadata": {}, "payload": {}},
+            {"verb": "count", "metadata": {}, "payload": {"q": {}}},
+        ])
+        assert list(map(lambda r: r[0], actual_results)) == [True, False, True]
+        assert actual_results[2][1] == 1
+        content_store.client.drop_database("test_db")
+
+
+class TestReadBsonDocuments(unittest.TestCase):
+    def test_lazy_documents(self):
+        documents = list(read_bson_documents(io.BytesIO(b"".join(map(bson.encode, BSON_DOCUMENTS))).read))
+        assert documents[0]._document is None
+        assert dict(documents[0]) == {"_id": "5f1f0a0a0a0a0a0a0a0a0a0a", "created_at": 1577836800000, "hash": "011"}
+        assert documents[1]["nested"] == {"n": 1}
+
+    def test_truncated(self):
+        with self.assertRaises(EOFError):
+            list(read_bson_documents(io.BytesIO(bson.encode(BSON_DOCUMENTS[0])[:-1]).read))
+
+
+class _BrokenConnection(object):
+    """
+    Pooled connection that fails when sending the request, or after sending it
+    """
+
+    def __init__(self, request_error: Exception = None, response_error: Exception = None):
+        self.request_error = request_error
+        self.response_error = response_error
+        self.closed = False
+
+    def request(self, *args, **kwargs):
+        if self.request_error:
+            raise self.request_error
+
+    def getresponse(self):
+        raise self.response_error
+
+    def close(self):
+        self.closed = True
+
+
+class TestHttpRpcClient(unittest.TestCase):
+    def setUp(self):
+        self.logins = 0
+        self.tokens = []
+        app = Flask(__name__)
+
+        @app.route("/auth", methods=["POST"])
+        def auth():
+            self.logins += 1
+            return jsonify({"status": "ok", "access_token": _fake_jwt(time.time() + 3600)})
+
+        @app.route("/apiInternal/rpc", methods=["POST"])
+        def rpc():
+            self.tokens.append(request.headers["Authorization"])
+            if request.headers.get("Accept") == "application/bson" and request.json["verb"] == "query" \
+                    and not request.json["payload"]["q"]:
+                # The first chunk ends inside a document
+                data = b"".join(map(bson.encode, BSON_DOCUMENTS))
+                return Response(iter([data[:40], data[40:]]), mimetype="application/bson")
+            if request.json["verb"] == "count":
+                return jsonify({"status": "ok", "payload": 7})
+            return jsonify({"status": "error", "payload": {"message": "Unknown verb"}}), 500
+
+        @app.route("/apiInternal/rpc/batch", methods=["POST"])
+        def rpc_batch():
+            return jsonify({"status": "ok", "payload": list(map(
+                lambda body: {"status": "ok", "payload": body["payload"]["q"]["n"]} if body["verb"] == "count"
+                else {"status": "error", "payload": {"message": "Unknown verb"}},
+                request.json
+            ))})
+
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_reuses_access_token(self):
+        rpc_client = HttpRpcClient(self.base_url, username="admin", password="password")
+        assert rpc_client.blocking_count({}) == 7
+        assert rpc_client.blocking_count({}) == 7
+        assert self.logins == 1
+        assert len(set(self.tokens)) == 1
+
+    def test_refreshes_expiring_access_token(self):
+        rpc_client = HttpRpcClient(self.base_url, username="admin", password="password")
+        rpc_client.blocking_count({})
+        rpc_client._access_token_expires_at = time.time() + 1
+        rpc_client.blocking_count({})
+        assert self.logins == 2
+
+    def test_error(self):
+        rpc_client = HttpRpcClient(self.base_url, access_token=_fake_jwt(time.time() + 3600))
+        with self.assertRaises(RpcError):
+            rpc_client.call("no_such_verb", {})
+
+    def test_batch(self):
+        rpc_client = HttpRpcClient(self.base_url, access_token=_fake_jwt(time.time() + 3600), max_batch_size=2)
+        actual_results = rpc_client.batch([
+            ("count", {"q": {"n": 1}}),
+            ("no_such_verb", {}),
+            ("count", {"q": {"n": 3}})
+        ])
+        assert actual_results[0] == 1
+        assert isinstance(actual_results[1], RpcError)
+        assert actual_results[2] == 3
+
+    def test_iter_query(self):
+        rpc_client = HttpRpcClient(self.base_url, access_token=_fake_jwt(time.time() + 3600), max_idle_connections=1)
+        documents = list(rpc_client.blocking_iter_query({}, limit=2))
+        assert list(map(lambda d: d["_id"], documents)) == ["5f1f0a0a0a0a0a0a0a0a0a0a", "5f1f0a0a0a0a0a0a0a0a0a0b"]
+        assert documents[0]["hash"] == "011"
+        # The connection of the finished stream is reused
+        assert rpc_client.blocking_count({}) == 7
+
+    def test_iter_query_error(self):
+        rpc_client = HttpRpcClient(self.base_url, access_token=_fake_jwt(time.time() + 3600))
+        with self.assertRaises(RpcError):
+            rpc_client.blocking_iter_query({"fails": True})
+
+    def _rpc_client_with_idle(self, connection: _BrokenConnection) -> HttpRpcClient:
+        rpc_client = HttpRpcClient(self.base_url, access_token=_fake_jwt(time.time() + 3600))
+        rpc_client._pool.release(connection)
+        return rpc_client
+
+    def test_resends_when_a_reused_connection_fails_to_send(self):
+        connection = _BrokenConnection(request_error=BrokenPipeError())
+        with self.assertRaises(RpcError):
+            self._rpc_client_with_idle(connection).call("append", {})
+        assert connection.closed
+        assert len(self.tokens) == 1
+
+    def test_resends_only_idempotent_verbs_once_sent(self):
+        connection = _BrokenConnection(response_error=http.client.RemoteDisconnected())
+        with self.assertRaises(http.client.RemoteDisconnected):
+            self._rpc_client_with_idle(connection).call("append", {})
+        assert connection.closed
+        assert self.tokens == []
+        connection = _BrokenConnection(response_error=http.client.RemoteDisconnected())
+        assert self._rpc_client_with_idle(connection).blocking_count({}) == 7
+        assert connection.closed
+
+    def test_does_not_resend_on_timeout(self):
+        connection = _BrokenConnection(response_error=socket.timeout())
+        with self.assertRaises(socket.timeout):
+            self._rpc_client_with_idle(connection).blocking_count({})
+        assert connection.closed
+        assert self.tokens == []
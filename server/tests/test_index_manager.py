@@ -0,0 +1,86 @@
+import datetime
+import unittest
+import freezegun
+import mongomock
+from content.index_manager import IndexManager
+
+
+class TestIndexManager(unittest.TestCase):
+    def setUp(self) -> None:
+        db = mongomock.MongoClient().db
+        self.collection = db.collection
+        self.usage_collection = db.usage
+        self.collection.insert_one({"a": 1})
+        self.index_manager = self._index_manager()
+
+    def _index_manager(self):
+        return IndexManager(self.collection, self.usage_collection, min_uses=2, idle_seconds=60)
+
+    def _index_names(self):
+        return sorted(self.collection.index_information().keys())
+
+    def test_filter_fields(self):
+        assert IndexManager._filter_fields({
+            "a": 1,
+            "_id": 2,
+            "$or": [{"b": 1}, {"$and": [{"c": {"$gt": 1}}]}],
+            "$where": "x"
+        }) == ["a", "b", "c"]
+
+    def test_creates_index_for_keys_used_often(self):
+        self.index_manager.record_filter({"a": 1, "b": 2})
+        self.index_manager.record_filter({"a": 3})
+        self.index_manager.record_sort({"c": -1})
+        self.index_manager.record_sort({"c": 1})
+        self.index_manager.reconcile()
+        assert self._index_names() == ["_id_", "broccoli_auto_a_1", "broccoli_auto_c_1"]
+
+    def test_creates_non_unique_index_for_idempotency_keys(self):
+        self.index_manager.record_idempotency_key("a")
+        self.index_manager.record_idempotency_key("a")
+        self.index_manager.reconcile()
+        assert self._index_names() == ["_id_", "broccoli_auto_a_1"]
+        assert not self.collection.index_information()["broccoli_auto_a_1"].get("unique", False)
+
+    def test_board_query_qualifies_right_away(self):
+        self.index_manager.record_board_query({"a": True}, {"b": -1, "c": 1})
+        self.index_manager.reconcile()
+        assert self._index_names() == ["_id_", "broccoli_auto_a_1", "broccoli_auto_b_-1_c_1"]
+
+    def test_drops_idle_managed_indexes_only(self):
+        self.collection.create_index("z", name="z_1")
+        with freezegun.freeze_time(datetime.datetime.utcnow()) as frozen_time:
+            self.index_manager.started_at = datetime.datetime.utcnow()
+            self.index_manager.record_board_query({"a": True}, None)
+            self.index_manager.reconcile()
+            frozen_time.tick(datetime.timedelta(seconds=120))
+            self.index_manager.reconcile()
+        assert self._index_names() == ["_id_", "z_1"]
+        assert list(map(lambda a: a["action"], self.index_manager.describe()["actions"])) == ["create", "drop"]
+
+    def test_keeps_managed_indexes_across_restarts(self):
+        self.index_manager.record_board_query({"a": True}, None)
+        self.index_manager.reconcile()
+        restarted_index_manager = self._index_manager()
+        restarted_index_manager.reconcile()
+        assert self._index_names() == ["_id_", "broccoli_auto_a_1"]
+        assert restarted_index_manager.describe()["usages"][0]["uses"] == 2
+
+    def test_never_drops_managed_indexes_without_recorded_usage(self):
+        self.collection.create_index("z", name="broccoli_auto_z_1")
+        self.index_manager.record_board_query({"a": True}, None)
+        self.index_manager.reconcile()
+        assert self._index_names() == ["_id_", "broccoli_auto_a_1", "broccoli_auto_z_1"]
+
+    def test_sums_usage_of_processes(self):
+        other_index_manager = self._index_manager()
+        self.index_manager.record_filter({"a": 1})
+        other_index_manager.record_filter({"a": 2})
+        other_index_manager.flush()
+        self.index_manager.reconcile()
+        assert self._index_names() == ["_id_", "broccoli_auto_a_1"]
+
+    def test_flushes_usage_every_flush_seconds(self):
+        self.index_manager.flush_seconds = 0
+        self.index_manager.record_filter({"a.b": 1})
+        assert self.usage_collection.find_one({})["key"] == [["a.b", 1]]
@@ -0,0 +1,68 @@
+import datetime
+import gzip
+import json
+import unittest
+from bson import ObjectId
+from flask import Flask, jsonify, request
+from common.json_provider import set_json_provider
+from common.response_compression import ResponseCompression
+from content.packed_binary_string import to_packed
+
+DOCUMENT = {
+    "_id": ObjectId("5f1f0a0a0a0a0a0a0a0a0a0a"),
+    "updated_at": datetime.datetime(2020, 1, 1, 0, 0, 0, 123000),
+    "hash": to_packed("0110"),
+    "nested": {"hash": to_packed("1")},
+}
+EXPECTED = {
+    "_id": "5f1f0a0a0a0a0a0a0a0a0a0a",
+    "updated_at": "Wed, 01 Jan 2020 00:00:00 GMT",
+    "hash": "0110",
+    "nested": {"hash": "1"},
+}
+
+
+class TestJsonProvider(unittest.TestCase):
+    def test_mongo_values(self):
+        for name in ["orjson", "json"]:
+            app = Flask(__name__)
+            set_json_provider(app, name)
+            assert json.loads(app.json.dumps(DOCUMENT)) == EXPECTED
+
+    def test_orjson_falls_back_on_big_integers(self):
+        app = Flask(__name__)
+        set_json_provider(app, "orjson")
+        assert json.loads(app.json.dumps({"big": 2 ** 70})) == {"big": 2 ** 70}
+
+    def test_unknown_provider(self):
+        with self.assertRaises(ValueError):
+            set_json_provider(Flask(__name__), "no_such_provider")
+
+
+class TestResponseCompression(unittest.TestCase):
+    def setUp(self) -> None:
+        self.app = Flask(__name__)
+        response_compression = ResponseCompression(min_bytes=100)
+        self.app.after_request(lambda response: response_compression.compress(request, response))
+        self.app.add_url_rule("/small", "small", lambda: jsonify({"key": "value"}))
+        self.app.add_url_rule("/large", "large", lambda: jsonify([{"key": "value"}] * 100))
+        self.client = self.app.test_client()
+
+    def test_gzip(self):
+        response = self.client.get("/large", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(response.data)) == [{"key": "value"}] * 100
+
+    def test_prefers_brotli(self):
+        response = self.client.get("/large", headers={"Accept-Encoding": "gzip, br"})
+        assert response.headers["Content-Encoding"] == "br"
+
+    def test_not_accepted(self):
+        response = self.client.get("/large")
+        assert "Content-Encoding" not in response.headers
+        assert response.json == [{"key": "value"}] * 100
+
+    def test_small(self):
+        response = self.client.get("/small", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+
@@ -0,0 +1,64 @@
+import unittest
+import mongomock
+from scheduler.lease_store import LeaseStore
+from scheduler.leader_election import LeaderElection
+
+
+class TestLeaderElection(unittest.TestCase):
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUp(self):
+        self.lease_store = LeaseStore("localhost:27017", "test_db")
+        self.events = []
+
+    def tearDown(self):
+        self.lease_store.client.drop_database("test_db")
+
+    def _election(self, name: str, ttl_seconds: float = 30) -> LeaderElection:
+        return LeaderElection(self.lease_store, "leader", ttl_seconds, lambda: self.events.append(f"{name} elected"),
+                              lambda: self.events.append(f"{name} deposed"))
+
+    def test_single_leader(self):
+        election_a, election_b = self._election("a"), self._election("b")
+        election_a.run_once()
+        election_b.run_once()
+        election_a.run_once()
+        assert (election_a.is_leader, election_b.is_leader) == (True, False)
+        assert self.events == ["a elected"]
+
+    def test_failover_on_stop(self):
+        election_a, election_b = self._election("a"), self._election("b")
+        election_a.run_once()
+        election_a.stop()
+        election_b.run_once()
+        assert election_b.is_leader
+        assert self.events == ["a elected", "a deposed", "b elected"]
+
+    def test_failover_on_expiry(self):
+        election_a, election_b = self._election("a", ttl_seconds=0), self._election("b")
+        election_a.run_once()
+        election_b.run_once()
+        election_a.run_once()
+        assert (election_a.is_leader, election_b.is_leader) == (False, True)
+        assert self.events == ["a elected", "b elected", "a deposed"]
+
+    def test_failing_callbacks(self):
+        failures = ["elected"]
+
+        def on_elected():
+            self.events.append("elected")
+            if failures:
+                raise RuntimeError(failures.pop())
+
+        def on_deposed():
+            self.events.append("deposed")
+            raise RuntimeError("deposed")
+
+        election = LeaderElection(self.lease_store, "leader", 30, on_elected, on_deposed)
+        election.run_once()
+        assert not election.is_leader
+        election.run_once()
+        assert election.is_leader
+        election.stop()
+        assert not election.is_leader
+        assert self.events == ["elected", "deposed", "elected", "deposed"]
+        assert self.lease_store.get("leader") is None
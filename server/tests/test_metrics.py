@@ -0,0 +1,65 @@
+import unittest
+from common.metrics import MetricsRegistry
+from scheduler.worker_metrics import WorkerMetrics, RunReport
+from scheduler.worker_context.instrumented_rpc_client import InstrumentedRpcClient
+
+
+class _FailingRpcClient(object):
+    def blocking_count(self, q):
+        raise RuntimeError("boom")
+
+    def blocking_query(self, q, limit, projection, sort, datetime_q):
+        return [{"a": 1}]
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_expose(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("runs_total", "Runs", ["worker_id"])
+        histogram = registry.histogram("run_seconds", "Run seconds", ["worker_id"], buckets=[1, 5])
+        counter.inc(("w\"1",))
+        histogram.observe(("w1",), 0.5)
+        histogram.observe(("w1",), 3)
+        text = registry.expose()
+        self.assertIn("# TYPE runs_total counter", text)
+        self.assertIn("runs_total{worker_id=\"w\\\"1\"} 1", text)
+        self.assertIn("run_seconds_bucket{worker_id=\"w1\",le=\"1.0\"} 1", text)
+        self.assertIn("run_seconds_bucket{worker_id=\"w1\",le=\"5.0\"} 2", text)
+        self.assertIn("run_seconds_bucket{worker_id=\"w1\",le=\"+Inf\"} 2", text)
+        self.assertIn("run_seconds_count{worker_id=\"w1\"} 2", text)
+
+    def test_register_twice(self):
+        registry = MetricsRegistry()
+        registry.counter("runs_total", "Runs")
+        with self.assertRaises(ValueError):
+            registry.counter("runs_total", "Runs")
+
+
+class TestWorkerMetrics(unittest.TestCase):
+    def setUp(self):
+        self.worker_metrics = WorkerMetrics(MetricsRegistry())
+
+    def test_instrumented_rpc_client(self):
+        rpc_client = InstrumentedRpcClient(_FailingRpcClient(), "w1", self.worker_metrics)
+        self.assertEqual(rpc_client.blocking_query({}), [{"a": 1}])
+        with self.assertRaises(RuntimeError):
+            rpc_client.blocking_count({})
+        self.worker_metrics.record_run("w1", 0.5, True)
+        self.worker_metrics.record_run("w1", 1.5, False)
+
+        summary = self.worker_metrics.summary("w1")
+        self.assertEqual(summary["runs"]["succeeded"], 1)
+        self.assertEqual(summary["runs"]["failed"], 1)
+        self.assertEqual(summary["runs"]["average_seconds"], 1.0)
+        self.assertEqual(summary["last_run"]["status"], "failed")
+        self.assertEqual(summary["rpc_calls"]["query"]["count"], 1)
+        self.assertEqual(summary["rpc_calls"]["count"]["failed"], 1)
+
+    def test_run_report(self):
+        run_report = RunReport()
+        InstrumentedRpcClient(_FailingRpcClient(), "w1", run_report).blocking_query({})
+        self.worker_metrics.record_report("w1", run_report.drain(2.0, True)[RunReport.KEY])
+        summary = self.worker_metrics.summary("w1")
+        self.assertEqual(summary["runs"]["succeeded"], 1)
+        self.assertEqual(summary["rpc_calls"]["query"]["count"], 1)
+        self.assertEqual(run_report.drain(1.0, True)[RunReport.KEY]["rpc_calls"], [])
@@ -0,0 +1,53 @@
+import unittest
+from bson import BSON
+from content.hamming_index import pack_binary_string, pack_bytes
+from content.packed_binary_string import from_packed, is_packed, match_either_form, packed_bytes, to_int, to_packed, \
+    unpack_document
+
+
+class TestPackedBinaryString(unittest.TestCase):
+    def test_round_trip(self):
+        for binary_string in ["", "0", "1", "10110", "0" * 8, "1" * 9, "0110" * 64]:
+            packed = to_packed(binary_string)
+            assert is_packed(packed)
+            assert from_packed(packed) == binary_string
+            assert to_int(packed) == to_int(binary_string)
+
+    def test_bit_length(self):
+        assert packed_bytes(to_packed("10110")) == (bytes([0b10110000]), 5)
+
+    def test_to_int_invalid(self):
+        assert to_int("012") is None
+        assert to_int(b"0101") is None
+
+    def test_hamming_words_match(self):
+        binary_string = "1101" * 33
+        data, bit_length = packed_bytes(to_packed(binary_string))
+        assert (pack_bytes(data, bit_length) == pack_binary_string(binary_string)).all()
+
+    def test_unpack_document(self):
+        document = {"bs": to_packed("0101"), "nested": {"bs": to_packed("1")}, "n": 1}
+        assert unpack_document(document) == {"bs": "0101", "nested": {"bs": "1"}, "n": 1}
+
+    def test_smaller(self):
+        binary_string = "0110" * 64
+        string_size = len(BSON.encode({"bs": binary_string}))
+        packed_size = len(BSON.encode({"bs": to_packed(binary_string)}))
+        assert string_size - packed_size >= 256 - 256 // 8 - 2
+
+    def test_match_either_form(self):
+        assert match_either_form({
+            "a": "01",
+            "b": {"$in": ["10", "x"]},
+            "c": {"$ne": "1"},
+            "$or": [{"d": {"$eq": "0"}}, {"e": "x"}],
+            "f": "",
+            "g": {"$gt": "01"}
+        }) == {
+            "a": {"$in": ["01", to_packed("01")]},
+            "b": {"$in": ["10", "x", to_packed("10")]},
+            "c": {"$nin": ["1", to_packed("1")]},
+            "$or": [{"d": {"$in": ["0", to_packed("0")]}}, {"e": "x"}],
+            "f": "",
+            "g": {"$gt": "01"}
+        }
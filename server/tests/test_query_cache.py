@@ -0,0 +1,102 @@
+import unittest
+import mongomock
+from content.content_store import ContentStore
+from content.query_cache import QueryCache
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        query_cache = QueryCache(max_entries=2)
+        for key in ["a", "b", "a", "c"]:
+            query_cache.get_or_load(key, None, lambda: [{"key": key}])
+        assert query_cache.get_or_load("a", None, lambda: []) == [{"key": "a"}]
+        assert query_cache.get_or_load("b", None, lambda: []) == []
+        assert query_cache.stats()["evictions"] == 2
+
+    def test_byte_size_eviction(self):
+        query_cache = QueryCache(max_bytes=100)
+        query_cache.get_or_load("a", None, lambda: [{"key": "x" * 60}])
+        query_cache.get_or_load("b", None, lambda: [{"key": "y" * 60}])
+        assert query_cache.stats()["entries"] == 1
+        assert query_cache.stats()["size_bytes"] <= 100
+
+    def test_ttl(self):
+        query_cache = QueryCache(ttl_seconds=0)
+        query_cache.get_or_load("a", None, lambda: [{"key": 1}])
+        assert query_cache.get_or_load("a", None, lambda: [{"key": 2}]) == [{"key": 2}]
+        assert query_cache.stats()["expirations"] == 1
+
+    def test_dependent_fields(self):
+        assert QueryCache.dependent_fields({"a": 1}, None, None) is None
+        assert QueryCache.dependent_fields({"$or": [{"a.b": 1}, {"c": {"$gt": 1}}]}, ["d"], {"e": 1}) == \
+            {"a", "c", "d", "e"}
+        assert QueryCache.dependent_fields({"$expr": {"$gt": ["$a", 1]}}, ["d"], None) is None
+
+    def test_allowed_values(self):
+        assert QueryCache.allowed_values({
+            "a": 1,
+            "b": {"$in": [1, 2]},
+            "c": {"$gt": 1},
+            "d.e": 1,
+            "$and": [{"b": {"$in": [2, 3]}}, {"f": None}],
+            "g": {"$regex": "^x"},
+            "h": [1]
+        }) == {"a": {1}, "b": {2}, "f": {None}}
+
+    def test_invalidate_documents(self):
+        query_cache = QueryCache()
+        for key, q in [("group_1", {"group": 1}), ("group_1_or_2", {"group": {"$in": [1, 2]}}),
+                       ("no_group", {"group": None}), ("everything", {}), ("not_given", None)]:
+            query_cache.get_or_load(key, None, lambda: [], q)
+        query_cache.invalidate_documents([{"group": 2}, {"group": [3, 4]}])
+        assert query_cache.stats()["entries"] == 2
+        query_cache.invalidate_documents([{"other": 1}])
+        assert query_cache.stats()["entries"] == 1
+        query_cache.invalidate_documents([{"group": [1]}])
+        assert query_cache.stats()["entries"] == 0
+
+
+class TestContentStoreQueryCache(unittest.TestCase):
+    @classmethod
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUpClass(cls) -> None:
+        cls.content_store = ContentStore("localhost:27017", "test_db", query_cache=QueryCache())
+
+    def tearDown(self) -> None:
+        self.content_store.client.drop_database("test_db")
+        self.content_store.schema_catalog.known_field_types.clear()
+        self.content_store.query_cache.invalidate_all()
+
+    def test_hit(self):
+        self.content_store.append({"key": "value_1"}, "key")
+        hits = self.content_store.query_cache.stats()["hits"]
+        first = self.content_store.query({}, projection=["key"])
+        first[0]["key"] = "modified"
+        assert self.content_store.query({}, projection=["key"])[0]["key"] == "value_1"
+        assert self.content_store.query_cache.stats()["hits"] == hits + 1
+
+    def test_append_invalidates(self):
+        self.content_store.append({"key": "value_1"}, "key")
+        assert len(self.content_store.query({})) == 1
+        self.content_store.append({"key": "value_2"}, "key")
+        assert len(self.content_store.query({})) == 2
+
+    def test_append_keeps_queries_it_cannot_match(self):
+        self.content_store.append({"key": "value_1", "group": 1}, "key")
+        self.content_store.query({"group": 1})
+        hits = self.content_store.query_cache.stats()["hits"]
+        self.content_store.append_many([{"key": "value_2", "group": 2}, {"key": "value_3", "group": 2}], "key")
+        assert len(self.content_store.query({"group": 1})) == 1
+        assert self.content_store.query_cache.stats()["hits"] == hits + 1
+        self.content_store.append({"key": "value_4", "group": 1}, "key")
+        assert len(self.content_store.query({"group": 1})) == 2
+
+    def test_update_invalidates_dependent_queries(self):
+        self.content_store.append({"key": "value_1", "a": 1, "b": 1}, "key")
+        self.content_store.query({}, projection=["a"])
+        self.content_store.query({}, projection=["b"])
+        invalidations = self.content_store.query_cache.stats()["invalidations"]
+        self.content_store.update_one({"key": "value_1"}, {"$set": {"a": 2}})
+        assert self.content_store.query({}, projection=["a"])[0]["a"] == 2
+        assert self.content_store.query({}, projection=["b"])[0]["b"] == 1
+        assert self.content_store.query_cache.stats()["invalidations"] == invalidations + 1
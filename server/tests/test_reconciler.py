@@ -0,0 +1,145 @@
+import datetime
+import os
+import threading
+import unittest
+import mongomock
+from unittest import mock
+from apscheduler.schedulers.background import BackgroundScheduler
+from common.metrics import MetricsRegistry
+from scheduler.executor_pools import ExecutorPools
+from scheduler.lease_store import LeaseStore
+from scheduler.reconciler import Reconciler
+from scheduler.worker_assignment import WorkerAssignment
+from scheduler.worker_config_store import WorkerConfigStore
+from scheduler.worker_metrics import WorkerMetrics
+
+
+class Worker(object):
+    def __init__(self, name: str):
+        self.name = name
+
+    def get_id(self):
+        return self.name
+
+    def pre_work(self, context):
+        pass
+
+    def work(self, context):
+        pass
+
+
+class BlockingWorker(Worker):
+    """
+    Runs until released
+    """
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def work(self, context):
+        BlockingWorker.started.set()
+        BlockingWorker.release.wait(10)
+
+
+@mock.patch.dict(os.environ, {"MONGODB_CONNECTION_STRING": "localhost:27017", "MONGODB_DB": "test_db"})
+class TestReconciler(unittest.TestCase):
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUp(self):
+        self.worker_config_store = WorkerConfigStore("localhost:27017", "test_db")
+        self.reconciler = Reconciler(self.worker_config_store, mock.Mock(), ExecutorPools("default=thread:1"),
+                                     WorkerMetrics(MetricsRegistry()))
+        self.scheduler = BackgroundScheduler()
+        self.reconciler.set_scheduler(self.scheduler)
+        self.scheduler.add_job(self.reconciler.reconcile, id=Reconciler.RECONCILE_JOB_ID, trigger="interval",
+                               seconds=60)
+
+    def tearDown(self):
+        self.worker_config_store.client.drop_database("test_db")
+
+    def _worker_job_ids(self):
+        return set(map(lambda j: j.id, self.scheduler.get_jobs())) - {Reconciler.RECONCILE_JOB_ID}
+
+    def test_diffs_only_when_version_changes(self):
+        self.worker_config_store.add(__name__, "Worker", {"name": "a"}, 5)
+        self.reconciler.reconcile()
+        assert self._worker_job_ids() == {"broccoli.worker.a"}
+
+        with mock.patch.object(self.worker_config_store, "get_all") as get_all:
+            self.reconciler.reconcile()
+            get_all.assert_not_called()
+
+        self.worker_config_store.remove("broccoli.worker.a")
+        self.reconciler.reconcile()
+        assert self._worker_job_ids() == set()
+
+    def test_failed_worker_is_retried(self):
+        self.worker_config_store.collection.insert_one({
+            "worker_id": "broccoli.worker.missing",
+            "module": __name__,
+            "class_name": "MissingWorker",
+            "args": {},
+            "interval_seconds": 5
+        })
+        self.reconciler.reconcile()
+        assert self.reconciler.reconciled_version is None
+
+    def test_trigger(self):
+        self.reconciler.trigger()
+        assert self.scheduler.get_job(Reconciler.RECONCILE_JOB_ID).next_run_time is not None
+
+
+class TestReconcilerRunningJobs(unittest.TestCase):
+    WORKER_ID = "broccoli.worker.blocking"
+
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUp(self):
+        # Workers are given their context while added, outside of the test methods
+        environ = mock.patch.dict(os.environ, {"MONGODB_CONNECTION_STRING": "localhost:27017", "MONGODB_DB": "test_db"})
+        environ.start()
+        self.addCleanup(environ.stop)
+        BlockingWorker.started.clear()
+        BlockingWorker.release.clear()
+        self.worker_config_store = WorkerConfigStore("localhost:27017", "test_db")
+        self.lease_store = LeaseStore("localhost:27017", "test_db")
+        executor_pools = ExecutorPools("default=thread:1,other=thread:1")
+        self.reconciler = Reconciler(self.worker_config_store, mock.Mock(), executor_pools,
+                                     WorkerMetrics(MetricsRegistry()), WorkerAssignment(self.lease_store, "a", 60))
+        self.scheduler = BackgroundScheduler(executors=executor_pools.build())
+        self.reconciler.set_scheduler(self.scheduler)
+        self.scheduler.start()
+        self.worker_config_store.add(__name__, "BlockingWorker", {"name": "blocking"}, 60)
+        self.reconciler.reconcile()
+        self.scheduler.modify_job(self.WORKER_ID, next_run_time=datetime.datetime.now(datetime.timezone.utc))
+        assert BlockingWorker.started.wait(5)
+
+    def tearDown(self):
+        BlockingWorker.release.set()
+        self.scheduler.shutdown(wait=True)
+        self.worker_config_store.client.drop_database("test_db")
+
+    def _end_run(self):
+        BlockingWorker.release.set()
+        for _ in range(100):
+            if not self.reconciler.running_job_ids():
+                return
+            threading.Event().wait(0.05)
+        raise AssertionError("The run does not end")
+
+    def test_keeps_the_lease_of_a_removed_job_until_its_run_ends(self):
+        self.worker_config_store.remove(self.WORKER_ID)
+        self.reconciler.reconcile()
+        assert self.scheduler.get_job(self.WORKER_ID) is None
+        assert self.lease_store.get(WorkerAssignment.WORKER_LEASE_PREFIX + self.WORKER_ID)["owner"] == "a"
+        self._end_run()
+        self.reconciler.reconcile()
+        assert self.lease_store.get(WorkerAssignment.WORKER_LEASE_PREFIX + self.WORKER_ID) is None
+
+    def test_moves_a_job_once_its_run_ends(self):
+        self.worker_config_store.update_scheduling(self.WORKER_ID, {"executor": "other"})
+        self.reconciler.reconcile()
+        job = self.scheduler.get_job(self.WORKER_ID)
+        assert (job.executor, job.next_run_time) == ("default", None)
+        self._end_run()
+        self.reconciler.reconcile()
+        job = self.scheduler.get_job(self.WORKER_ID)
+        assert job.executor == "other" and job.next_run_time is not None
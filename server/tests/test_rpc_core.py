@@ -0,0 +1,95 @@
+import datetime
+import unittest
+import mongomock
+from common.validate_schema_or_not import compile_validator, validate_schema_or_not
+from content.content_store import ContentStore
+from content.rpc_core import RpcCore
+from content.rpc_schemas import SCHEMAS
+
+
+class TestRpcCore(unittest.TestCase):
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUp(self) -> None:
+        self.content_store = ContentStore("localhost:27017", "test_db")
+        self.rpc_core = RpcCore(self.content_store)
+
+    def tearDown(self) -> None:
+        self.content_store.client.drop_database("test_db")
+
+    def test_unknown_verb(self):
+        assert self.rpc_core.call({"verb": "no_such_verb", "metadata": {}, "payload": {}}) == (False, 'Unknown verb')
+
+    def test_invalid_payload(self):
+        status, message = self.rpc_core.call({"verb": "update_one", "metadata": {}, "payload": {"filter_q": {}}})
+        assert not status
+        assert "update_doc" in message
+
+    def test_call(self):
+        self.rpc_core.call({"verb": "append", "metadata": {}, "payload": {"idempotency_key": "key", "doc": {"key": 1}}})
+        assert self.rpc_core.call({"verb": "count", "metadata": {}, "payload": {"q": {"key": 1}}}) == (True, 1)
+
+    def test_query_created_at_in_milliseconds(self):
+        self.rpc_core.call({"verb": "append", "metadata": {}, "payload": {"idempotency_key": "key", "doc": {"key": 1}}})
+        for payload in [{"q": {}}, {"q": {}, "page_size": 1}]:
+            status, result = self.rpc_core.call({"verb": "query", "metadata": {}, "payload": payload})
+            documents = result["documents"] if "page_size" in payload else result
+            assert type(documents[0]["created_at"]) == int
+        assert type(self.content_store.collection.find_one({})["created_at"]) == datetime.datetime
+
+    def test_aggregate(self):
+        self.rpc_core.call({"verb": "append", "metadata": {}, "payload": {"idempotency_key": "key", "doc": {"key": 1}}})
+        assert self.rpc_core.call({"verb": "aggregate", "metadata": {}, "payload": {
+            "pipeline": [{"$group": {"_id": "$key", "n": {"$sum": 1}}}]
+        }}) == (True, [{"_id": 1, "n": 1}])
+        status, message = self.rpc_core.call({"verb": "aggregate", "metadata": {}, "payload": {
+            "pipeline": [{"$lookup": {}}]
+        }})
+        assert not status
+        assert "$lookup" in message
+
+    def test_string_filters_match_packed_values(self):
+        self.content_store.packed_binary_strings = True
+        self.content_store.append_many([{"key": 1, "bs": "0101"}, {"key": 2}, {"key": 3, "bs": "0111"}], "key")
+        self.content_store.update_one_binary_string({"key": 2}, "bs", "0101")
+        for q in [{"bs": "0101"}, {"bs": {"$in": ["0101"]}}]:
+            assert self.rpc_core.call({"verb": "count", "metadata": {}, "payload": {"q": q}}) == (True, 2)
+        assert self.rpc_core.call({"verb": "aggregate", "metadata": {}, "payload": {
+            "pipeline": [{"$match": {"bs": {"$ne": "0101"}}}, {"$project": {"_id": 0, "key": 1}}]
+        }}) == (True, [{"key": 3}])
+
+    def test_register_verb(self):
+        self.rpc_core.register_verb(
+            "echo",
+            lambda metadata, payload: (True, payload["text"]),
+            {"type": "object", "properties": {"text": {"type": "string"}}, "required": ["text"]}
+        )
+        assert self.rpc_core.call({"verb": "echo", "metadata": {}, "payload": {"text": "hi"}}) == (True, "hi")
+        assert not self.rpc_core.call({"verb": "echo", "metadata": {}, "payload": {"text": 1}})[0]
+
+    def test_register_verb_twice(self):
+        with self.assertRaises(ValueError):
+            self.rpc_core.register_verb("count", lambda metadata, payload: (True, 0))
+
+
+class TestCompileValidator(unittest.TestCase):
+    def test_same_as_validate_schema_or_not(self):
+        schema = SCHEMAS["query"]["payload"]
+        validate = compile_validator(schema)
+        for payload in [{"q": {}}, {"q": {}, "limit": "10"}, {}]:
+            assert validate(payload) == validate_schema_or_not(payload, schema)
+
+    def test_every_schema_same_as_validate_schema_or_not(self):
+        payloads = [
+            {}, [], {"q": {}, "n": 1, "projection": ["key"]}, {"q": {}, "n": 0}, {"q": {}, "n": 1.0},
+            {"q": {}, "n": True}, {"q": {}, "projection": [1]}, {"q": {}, "sort": {"key": -1}, "page_size": 2},
+            {"filter_q": {}, "update_doc": {"$set": {"a": 1}}}, {"filter_q": [], "update_doc": {}},
+            {"ops": [{"filter_q": {}, "update_doc": {}, "key": "k", "binary_string": "01"}]}, {"ops": [{}]},
+            {"doc": {}, "docs": [{}], "idempotency_key": "key"}, {"docs": [1], "idempotency_key": "key"},
+            {"pipeline": [{"$match": {}}], "datetime_q": [{"key": "created_at", "op": "gte", "value": 1}]},
+            {"pipeline": [{}]}, {"pipeline": [{"$match": {}}], "datetime_q": [{"key": "k", "op": "in", "value": 1}]},
+            {"q": {}, "binary_string_key": "k", "from_binary_string": "01", "max_distance": 1, "pick_n": 1},
+        ]
+        for verb, schemas in SCHEMAS.items():
+            validate = compile_validator(schemas["payload"])
+            for payload in payloads:
+                assert validate(payload) == validate_schema_or_not(payload, schemas["payload"]), (verb, payload)
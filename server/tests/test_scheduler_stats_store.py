@@ -0,0 +1,28 @@
+import unittest
+import mongomock
+from scheduler.scheduler_stats_store import SchedulerStatsStore
+
+
+class TestSchedulerStatsStore(unittest.TestCase):
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUp(self):
+        self.scheduler_stats_store = SchedulerStatsStore("localhost:27017", "test_db")
+
+    def tearDown(self):
+        self.scheduler_stats_store.client.drop_database("test_db")
+
+    def test_not_published(self):
+        assert self.scheduler_stats_store.get("leader") is None
+
+    def test_last_published(self):
+        self.scheduler_stats_store.publish("leader", "a", {"worker.1": {"runs": 1}}, {}, 1)
+        self.scheduler_stats_store.publish("leader", "b", {"worker.1": {"runs": 2}}, {"broccoli.system": {"size": 1}}, 2)
+        stats = self.scheduler_stats_store.get("leader")
+        assert (stats["owner"], stats["jobs"]) == ("b", 2)
+        assert stats["workers"] == {"worker.1": {"runs": 2}}
+        assert stats["executors"] == {"broccoli.system": {"size": 1}}
+        assert stats["metrics"] == ""
+
+    def test_published_metrics(self):
+        self.scheduler_stats_store.publish("leader", "a", {}, {}, 0, "broccoli_worker_runs_total 1\n")
+        assert self.scheduler_stats_store.get("leader")["metrics"] == "broccoli_worker_runs_total 1\n"
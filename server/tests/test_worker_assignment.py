@@ -0,0 +1,56 @@
+import unittest
+import mongomock
+from scheduler.lease_store import LeaseStore
+from scheduler.worker_assignment import WorkerAssignment
+
+WORKER_IDS = list(map(lambda i: f"broccoli.worker.w{i}", range(30)))
+
+
+class TestWorkerAssignment(unittest.TestCase):
+    @mongomock.patch("mongodb://localhost:27017/test_db")
+    def setUp(self):
+        self.lease_store = LeaseStore("localhost:27017", "test_db")
+
+    def tearDown(self):
+        self.lease_store.client.drop_database("test_db")
+
+    def _node(self, owner: str) -> WorkerAssignment:
+        return WorkerAssignment(self.lease_store, owner, ttl_seconds=60)
+
+    @staticmethod
+    def _reconcile(nodes):
+        # Two rounds, a node hands workers over in one round and the preferred node claims them in the next
+        claimed = {}
+        for _ in range(2):
+            for node in nodes:
+                claimed[node.owner] = node.claim(WORKER_IDS)
+                node.release_unclaimed()
+        return claimed
+
+    def test_disjoint_and_complete(self):
+        nodes = list(map(self._node, ["a", "b", "c"]))
+        claimed = self._reconcile(nodes)
+        assert sum(map(len, claimed.values())) == len(WORKER_IDS)
+        assert set().union(*claimed.values()) == set(WORKER_IDS)
+        assert all(map(lambda worker_ids: len(worker_ids) > 0, claimed.values()))
+
+    def test_rebalance_on_join_and_leave(self):
+        node_a, node_b = self._node("a"), self._node("b")
+        claimed = self._reconcile([node_a])
+        assert claimed["a"] == set(WORKER_IDS)
+
+        claimed = self._reconcile([node_a, node_b])
+        assert claimed["a"].isdisjoint(claimed["b"])
+        assert claimed["a"] | claimed["b"] == set(WORKER_IDS)
+        assert claimed["b"]
+
+        node_b.release_all()
+        claimed = self._reconcile([node_a])
+        assert claimed["a"] == set(WORKER_IDS)
+
+    def test_not_claimed_while_held(self):
+        node_a = self._node("a")
+        node_a.claim(WORKER_IDS)
+        node_b = self._node("b")
+        # b is preferred for some workers but a has not handed them over yet
+        assert node_b.claim(WORKER_IDS) == set()
@@ -0,0 +1,9 @@
+"""
+Production entry point, API requests are served by several processes and only the elected one runs the scheduler
+
+    pipenv run gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import app, scheduler_leader_election
+
+# Every process competes for the leader lease, the app is loaded after the fork so each one has its own thread
+scheduler_leader_election.start()